@@ -0,0 +1,160 @@
+import asyncio
+import time
+from collections import deque
+from contextvars import ContextVar
+from enum import Enum, StrEnum
+from typing import NamedTuple
+
+# key-down time of the press a task is running an action for; the scheduler sets
+# it before starting each action, and the action's task keeps its own copy
+PRESSED_AT: ContextVar[float | None] = ContextVar("pressed_at", default=None)
+
+
+class Coalesce(Enum):
+    # every press runs
+    NONE = "none"
+    # a second queued press of the same toggle undoes the first, so both are dropped
+    TOGGLE = "toggle"
+    # a newer press in the same group replaces the queued one, keeping its place in line
+    LATEST = "latest"
+
+
+class Status(StrEnum):
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+    # undone by a second press of the same toggle
+    COALESCED = "coalesced"
+    # replaced by a newer request in the same group
+    SUPERSEDED = "superseded"
+    # the queue was full
+    DROPPED = "dropped"
+
+
+class ActionResult(NamedTuple):
+    name: str
+    status: Status
+    # from key press (or request) to the action starting, and its run time
+    queued_seconds: float = 0.0
+    run_seconds: float = 0.0
+
+
+def resolve(waiters, result: ActionResult):
+    for waiter in waiters:
+        if not waiter.done():
+            waiter.set_result(result)
+
+
+class QueuedAction:
+    def __init__(self, name: str, device: str, group: str | None, pressed_at=None):
+        self.name = name
+        self.device = device
+        self.group = group
+        self.enqueued_at = time.monotonic()
+        # when the key was pressed according to the kernel, on the monotonic clock
+        self.pressed_at = self.enqueued_at if pressed_at is None else pressed_at
+        # futures for whoever wants this action's ActionResult
+        self.waiters: list[asyncio.Future] = []
+
+
+class ActionQueue:
+    """
+    Bounded FIFO of pending actions for one input device.
+
+    Presses that can be merged are merged on the way in (see Coalesce); a press
+    that arrives while the queue is full is dropped and counted.
+    """
+
+    def __init__(self, device: str, max_length: int):
+        self.device = device
+        self.max_length = max_length
+        self.items: deque[QueuedAction] = deque()
+
+        self.enqueued = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.last_wait = 0.0
+        self.max_wait = 0.0
+        self.total_wait = 0.0
+        self.dequeued = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def push(
+        self,
+        name: str,
+        coalesce=Coalesce.NONE,
+        group: str | None = None,
+        pressed_at=None,
+        waiter: asyncio.Future | None = None,
+    ) -> bool:
+        """
+        Queue an action. Returns False if it was dropped because the queue is full.
+        `waiter` gets the action's ActionResult, including when it's merged away.
+        """
+        if coalesce is Coalesce.TOGGLE:
+            for item in reversed(self.items):
+                if item.name == name:
+                    self.items.remove(item)
+                    self.coalesced += 2
+                    resolve(item.waiters, ActionResult(name, Status.COALESCED))
+                    resolve(
+                        (waiter,) if waiter else (),
+                        ActionResult(name, Status.COALESCED),
+                    )
+                    return True
+
+        elif coalesce is Coalesce.LATEST:
+            for item in self.items:
+                if item.group == group:
+                    resolve(item.waiters, ActionResult(item.name, Status.SUPERSEDED))
+                    item.waiters = [waiter] if waiter else []
+                    item.name = name
+                    if pressed_at is not None:
+                        item.pressed_at = pressed_at
+                    self.coalesced += 1
+                    return True
+
+        if len(self.items) >= self.max_length:
+            self.dropped += 1
+            resolve((waiter,) if waiter else (), ActionResult(name, Status.DROPPED))
+            return False
+
+        item = QueuedAction(name, self.device, group, pressed_at)
+        if waiter is not None:
+            item.waiters.append(waiter)
+        self.items.append(item)
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, len(self.items))
+        return True
+
+    def peek(self) -> QueuedAction | None:
+        return self.items[0] if self.items else None
+
+    def pop(self) -> QueuedAction:
+        item = self.items.popleft()
+        wait = time.monotonic() - item.enqueued_at
+        self.last_wait = wait
+        self.max_wait = max(self.max_wait, wait)
+        self.total_wait += wait
+        self.dequeued += 1
+        return item
+
+    def clear(self):
+        for item in self.items:
+            resolve(item.waiters, ActionResult(item.name, Status.CANCELLED))
+        self.items.clear()
+
+    def stats(self) -> dict:
+        return {
+            "depth": len(self.items),
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "last_wait": self.last_wait,
+            "max_wait": self.max_wait,
+            "mean_wait": self.total_wait / self.dequeued if self.dequeued else 0.0,
+        }
@@ -0,0 +1,28 @@
+import tomllib
+from pathlib import Path
+
+CONFIG_FILE = Path(__file__).parent / "config.toml"
+# machine-specific overrides and secrets, kept out of git
+LOCAL_CONFIG_FILE = Path(__file__).parent / "config.local.toml"
+
+
+def merge(base: dict, override: dict) -> dict:
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_config(path=CONFIG_FILE, local_path=LOCAL_CONFIG_FILE) -> dict:
+    with open(path, "rb") as f:
+        loaded = tomllib.load(f)
+    if local_path.exists():
+        with open(local_path, "rb") as f:
+            loaded = merge(loaded, tomllib.load(f))
+    return loaded
+
+
+config = load_config()
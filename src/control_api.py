@@ -0,0 +1,279 @@
+import asyncio
+import json
+import time
+
+from action_queue import Status
+from coordinator import RECEIVER_ACTION_PREFIX, Coordinator
+from diagnostics import Diagnostics
+from logger import get_logger
+from remote import MACROS
+from scheduler import VALUE_SEPARATOR
+
+logger = get_logger(__name__)
+
+# the scheduler queue API requests go into, as if it were one more keypad
+CONTROL_DEVICE = "control"
+MAX_BODY_BYTES = 64 * 1024
+
+
+def is_whole_number(value) -> bool:
+    # JSON true and false load as bools, which are ints too
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class ControlApi:
+    """
+    Local HTTP/1.1 API for driving the service without a keypad:
+
+        GET  /actions      every action, its lane and an IR macro's expected length
+        POST /actions      {"actions": [...], "wait": true}: run them, report timings
+        GET  /status       running action, queues, IR, device state, last scene runs
+        GET  /gestures     the delay each gesture binding can add, and has added
+        POST /diagnostics  {"profile_seconds": 10}: stacks, state, profile, to a file
+        GET  /receiver     the receiver's power, volume, input, listening mode, levels
+        POST /receiver     {"volume": 40, "levels": {"zone2": 30}}: set them over eISCP
+
+    Actions are submitted to the same scheduler as key presses, from their own
+    "control" queue, so they are prioritized, merged, preempted and cancelled
+    exactly like presses. Connections are kept alive between requests.
+    """
+
+    def __init__(
+        self, coordinator: Coordinator, diagnostics: Diagnostics | None = None
+    ):
+        self.coordinator = coordinator
+        self.diagnostics = diagnostics
+        # requests that didn't ask to wait, kept referenced until they finish
+        self.background: set[asyncio.Task] = set()
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                    if request is None:
+                        break
+                    method, path, headers, body = request
+                    status, payload = await self.respond(method, path, body)
+                except ApiError as e:
+                    headers = {}
+                    status, payload = e.status, {"error": str(e)}
+                data = json.dumps(payload).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status < 400 else 'Error'}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+                if status >= 400 or headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError as e:
+            raise ApiError(400, "malformed request line") from e
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = headers.get("content-length") or "0"
+        # int() would take "-1", "+1" and "1_000"
+        if not (length.isascii() and length.isdigit()):
+            raise ApiError(400, "malformed Content-Length")
+        length = int(length)
+        if length > MAX_BODY_BYTES:
+            raise ApiError(413, "request body too large")
+        body = await reader.readexactly(length)
+        return method, target.split("?", 1)[0], headers, body
+
+    async def respond(self, method: str, path: str, body: bytes):
+        if path == "/actions" and method == "GET":
+            return 200, self.actions()
+        if path == "/actions" and method == "POST":
+            return await self.run_actions(body)
+        if path == "/status" and method == "GET":
+            return 200, self.coordinator.status()
+        if path == "/diagnostics" and method == "POST":
+            return await self.run_diagnostics(body)
+        if path == "/gestures" and method == "GET":
+            coordinator = self.coordinator
+            return 200, {
+                "gestures": coordinator.gestures.latency_report(coordinator.keymap)
+            }
+        if path == "/receiver" and method in ("GET", "POST"):
+            return await self.receiver(body if method == "POST" else None)
+        raise ApiError(404, f"no {method} {path}")
+
+    def actions(self) -> dict:
+        macros = self.coordinator.remote.macros
+        actions = {}
+        for name, policy in self.coordinator.policies.items():
+            actions[name] = {"lane": policy.priority.name.lower()}
+            if name in MACROS:
+                actions[name]["expected_seconds"] = round(
+                    macros.expected_duration(MACROS[name]), 3
+                )
+        return {"actions": actions}
+
+    async def run_actions(self, body: bytes):
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError as e:
+            raise ApiError(400, f"invalid JSON: {e}") from e
+        if not isinstance(request, dict):
+            raise ApiError(400, "expected a JSON object")
+        names = request.get(
+            "actions", [request["action"]] if "action" in request else []
+        )
+        if not isinstance(names, list) or not all(
+            isinstance(name, str) for name in names
+        ):
+            raise ApiError(400, '"actions" must be a list of action names')
+        # reject the whole batch rather than run part of it
+        unknown = [name for name in names if not self.coordinator.is_known_action(name)]
+        if unknown:
+            raise ApiError(404, f"unknown actions: {', '.join(unknown)}")
+
+        started = time.monotonic()
+        # one task per action, created in order, so they are submitted in order
+        tasks = [
+            asyncio.create_task(self.coordinator.request(name, CONTROL_DEVICE))
+            for name in names
+        ]
+        if not request.get("wait", True):
+            for task in tasks:
+                self.background.add(task)
+                task.add_done_callback(self.background.discard)
+            return 202, {"queued": names}
+
+        results = await asyncio.gather(*tasks)
+        logger.info(f"control: ran {', '.join(names)}")
+        return 200, {
+            "results": [
+                {
+                    "action": result.name,
+                    "status": result.status,
+                    "queued_ms": round(result.queued_seconds * 1000, 1),
+                    "run_ms": round(result.run_seconds * 1000, 1),
+                }
+                for result in results
+            ],
+            "total_ms": round((time.monotonic() - started) * 1000, 1),
+        }
+
+    async def run_diagnostics(self, body: bytes):
+        if self.diagnostics is None:
+            raise ApiError(404, "diagnostics are not enabled")
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError as e:
+            raise ApiError(400, f"invalid JSON: {e}") from e
+        seconds = request.get("profile_seconds") if isinstance(request, dict) else None
+        if seconds is not None and (
+            not isinstance(seconds, (int, float)) or seconds < 0
+        ):
+            raise ApiError(400, '"profile_seconds" must be a number of seconds')
+        try:
+            path = await asyncio.shield(self.diagnostics.request(seconds))
+        except OSError as e:
+            raise ApiError(500, f"writing diagnostics failed: {e}") from e
+        return 200, {"file": str(path)}
+
+    async def receiver(self, body: bytes | None):
+        """
+        Read the receiver fresh, after setting what the body asks. Settings
+        run as receiver:<setting>=<level> actions, through the scheduler like
+        key presses, so they queue behind and merge with other receiver changes.
+        """
+        onkyo = self.coordinator.remote.onkyo
+        settings = {}
+        if body is not None:
+            try:
+                request = json.loads(body or b"{}")
+            except ValueError as e:
+                raise ApiError(400, f"invalid JSON: {e}") from e
+            if not isinstance(request, dict):
+                raise ApiError(400, "expected a JSON object")
+            volume = request.get("volume")
+            levels = request.get("levels", {})
+            if volume is not None and not is_whole_number(volume):
+                raise ApiError(400, '"volume" must be a whole number')
+            if not isinstance(levels, dict) or not all(
+                is_whole_number(level) for level in levels.values()
+            ):
+                raise ApiError(400, '"levels" must map level names to whole numbers')
+            unknown = [name for name in levels if name not in onkyo.levels]
+            if unknown:
+                raise ApiError(404, f"unknown levels: {', '.join(unknown)}")
+            settings = dict(levels) if volume is None else {"volume": volume, **levels}
+            for setting, level in settings.items():
+                allowed = onkyo.setting_range(setting)
+                if level not in allowed:
+                    raise ApiError(
+                        400,
+                        f'"{setting}" must be from {allowed.start} to {allowed[-1]}',
+                    )
+        if not onkyo.is_connected():
+            raise ApiError(503, "not connected to the receiver")
+        names = [
+            f"{RECEIVER_ACTION_PREFIX}{setting}{VALUE_SEPARATOR}{level}"
+            for setting, level in settings.items()
+        ]
+        # created in order, so they're submitted in order
+        tasks = [
+            asyncio.create_task(self.coordinator.request(name, CONTROL_DEVICE))
+            for name in names
+        ]
+        results = await asyncio.gather(*tasks)
+        if names:
+            logger.info(f"control: ran {', '.join(names)}")
+        failed = [result.name for result in results if result.status is Status.FAILED]
+        if failed:
+            raise ApiError(502, f"receiver: {', '.join(failed)} failed")
+        await onkyo.refresh()
+        report = onkyo.report()
+        if results:
+            report["results"] = {result.name: result.status for result in results}
+        return 200, report
+
+
+async def serve_control(
+    coordinator: Coordinator,
+    control_config: dict,
+    diagnostics: Diagnostics | None = None,
+):
+    """Serve the control API on a localhost port or a unix socket, per [control]."""
+    api = ControlApi(coordinator, diagnostics)
+    try:
+        if control_config.get("socket"):
+            where = control_config["socket"]
+            server = await asyncio.start_unix_server(api.handle_client, where)
+        elif control_config.get("port"):
+            host = control_config.get("host", "127.0.0.1")
+            where = f"{host}:{control_config['port']}"
+            server = await asyncio.start_server(
+                api.handle_client, host, control_config["port"]
+            )
+        else:
+            return
+    except OSError as e:
+        # keypads keep working without the API
+        logger.error(f"could not serve the control API on {where}: {e}")
+        return
+    logger.info(f"serving the control API on {where}")
+    async with server:
+        await server.serve_forever()
@@ -1,189 +1,276 @@
 import asyncio
+import time
 
+from action_queue import ActionResult, Coalesce, Status
+from gestures import GestureRecognizer
+from keymap import ANY_DEVICE, GESTURE_ACTION, KEYMAP_FILE, Keymap, KeymapWatcher
+from logger import get_logger
+from metrics import event_time, metrics
 from remote import Remote
+from scenes import Scene, SceneRunner
+from scheduler import VALUE_SEPARATOR, ActionPolicy, Priority, Scheduler
 
-# keyboard input codes
-MUTE_CODE = 113
-VOLUME_DOWN_CODE = 114
-VOLUME_UP_CODE = 115
-F1_CODE = 59
-F2_CODE = 60
-F3_CODE = 61
-F4_CODE = 62
-F5_CODE = 63
-F6_CODE = 64
-ESCAPE_CODE = 1
-TAB_CODE = 15
-EQUALS_CODE = 13
-NUM_LOCK_CODE = 69
-SLASH_CODE = 98
-STAR_CODE = 55
-BACKSPACE_CODE = 14
-NUM_7_CODE = 71
-NUM_8_CODE = 72
-NUM_9_CODE = 73
-MINUS_CODE = 74
-NUM_4_CODE = 75
-NUM_5_CODE = 76
-NUM_6_CODE = 77
-PLUS_CODE = 78
-NUM_1_CODE = 79
-NUM_2_CODE = 80
-NUM_3_CODE = 81
-NUM_0_CODE = 82
-PERIOD_CODE = 83
-ENTER_CODE = 96
-
-# 6 key macropad triggers
-MACROPAD_VOLUME_UP_TRIGGER = F1_CODE
-MACROPAD_VOLUME_DOWN_TRIGGER = F4_CODE
-MACROPAD_TOGGLE_DJ_TV_MODE_TRIGGER = F3_CODE
-MACROPAD_TOGGLE_KITCHEN_SPEAKERS_TRIGGER = F6_CODE
-MACROPAD_TOGGLE_SURROUND_MODE_TRIGGER = F2_CODE
-MACROPAD_TOGGLE_DISCO_LIGHT_RED_YELLOW_TRIGGER = F5_CODE
-
-# numpad triggers
-NUMPAD_VOLUME_DOWN_TRIGGER = NUM_1_CODE
-NUMPAD_VOLUME_UP_TRIGGER = NUM_2_CODE
-NUMPAD_TV_MODE_TRIGGER = NUM_4_CODE
-NUMPAD_DJ_MODE_TRIGGER = NUM_5_CODE
-NUMPAD_KITCHEN_SPEAKERS_ON_TRIGGER = NUM_7_CODE
-NUMPAD_KITCHEN_SPEAKERS_OFF_TRIGGER = NUM_8_CODE
-NUMPAD_DISCO_LIGHT_WHITE_TRIGGER = BACKSPACE_CODE
-NUMPAD_DISCO_LIGHT_YELLOW_TRIGGER = MINUS_CODE
-NUMPAD_DISCO_LIGHT_RED_TRIGGER = PLUS_CODE
-NUMPAD_DISCO_LIGHT_TOGGLE_TRIGGER = ENTER_CODE
-NUMPAD_DISCO_LIGHT_TOGGLE_FADE_TRIGGER = STAR_CODE
-NUMPAD_DISCO_LIGHT_OFF_TRIGGER = NUM_3_CODE
-NUMPAD_SPOTIFY_DARK_MODE_TRIGGER = TAB_CODE
-NUMPAD_TV_POWER_TRIGGER = EQUALS_CODE
-NUMPAD_TOGGLE_SURROUND_MODE_TRIGGER = NUM_0_CODE
-NUMPAD_CANCEL_TASK_TRIGGER = ESCAPE_CODE
-NUMPAD_PAUSE_TRIGGER = PERIOD_CODE
-NUMPAD_REACTIVE_MODE_TRIGGER = NUM_9_CODE
+logger = get_logger(__name__)
+
+# actions that can be bound to a key in keymap.toml: which scheduler lane they
+# run in and how queued presses of each one merge
+ACTION_POLICIES = {
+    # coordinator actions
+    "start_holding_volume_down": ActionPolicy(Priority.INTERACTIVE),
+    "start_holding_volume_up": ActionPolicy(Priority.INTERACTIVE),
+    "stop_holding_volume_button": ActionPolicy(Priority.INTERACTIVE, preempt=False),
+    # remote coroutines
+    "pause": ActionPolicy(Priority.INTERACTIVE, Coalesce.TOGGLE),
+    "switch_to_dj_mode": ActionPolicy(
+        Priority.NORMAL, Coalesce.LATEST, "receiver_input"
+    ),
+    "switch_to_tv_mode": ActionPolicy(
+        Priority.NORMAL, Coalesce.LATEST, "receiver_input"
+    ),
+    "turn_disco_light_white": ActionPolicy(
+        Priority.NORMAL, Coalesce.LATEST, "spotlight"
+    ),
+    "turn_disco_light_yellow": ActionPolicy(
+        Priority.NORMAL, Coalesce.LATEST, "spotlight"
+    ),
+    "turn_disco_light_red": ActionPolicy(Priority.NORMAL, Coalesce.LATEST, "spotlight"),
+    "turn_disco_light_off": ActionPolicy(Priority.NORMAL, Coalesce.LATEST, "spotlight"),
+    "toggle_disco_light_fade": ActionPolicy(
+        Priority.NORMAL, Coalesce.LATEST, "spotlight"
+    ),
+    "enable_reactive_mode": ActionPolicy(Priority.NORMAL, Coalesce.LATEST, "spotlight"),
+    "toggle_disco_ball_motor": ActionPolicy(Priority.NORMAL, Coalesce.TOGGLE),
+    "turn_disco_ball_on": ActionPolicy(Priority.NORMAL, Coalesce.LATEST, "disco_ball"),
+    "turn_disco_ball_off": ActionPolicy(Priority.NORMAL, Coalesce.LATEST, "disco_ball"),
+    "toggle_tv_power": ActionPolicy(Priority.NORMAL, Coalesce.TOGGLE),
+    "toggle_surround_mode": ActionPolicy(Priority.MACRO, Coalesce.TOGGLE),
+    "switch_to_direct": ActionPolicy(Priority.MACRO, Coalesce.LATEST, "listening_mode"),
+    "switch_to_all_channel_stereo": ActionPolicy(
+        Priority.MACRO, Coalesce.LATEST, "listening_mode"
+    ),
+    "toggle_spotify_dark_mode": ActionPolicy(Priority.MACRO, Coalesce.TOGGLE),
+    "turn_kitchen_speakers_on": ActionPolicy(
+        Priority.MACRO, Coalesce.LATEST, "kitchen_speakers"
+    ),
+    "turn_kitchen_speakers_off": ActionPolicy(
+        Priority.MACRO, Coalesce.LATEST, "kitchen_speakers"
+    ),
+    "resync_state": ActionPolicy(Priority.MACRO, Coalesce.LATEST, "resync_state"),
+    "forget_state": ActionPolicy(Priority.NORMAL),
+}
+
+# handled immediately instead of being queued
+CANCEL_ACTION = "cancel"
+# bound to a volume key's autorepeat: the key is still held, keep ramping
+KEEP_HOLDING_ACTION = "keep_holding_volume_button"
+# "home_assistant:<name>" runs a named service call from config.toml
+HOME_ASSISTANT_ACTION_PREFIX = "home_assistant:"
+# "scene:<name>" runs a scene from [scenes] in config.toml
+SCENE_ACTION_PREFIX = "scene:"
+# "receiver:volume=<n>" or "receiver:<level>=<n>" sets the receiver's volume or a
+# level from [onkyo.levels] over eISCP
+RECEIVER_ACTION_PREFIX = "receiver:"
+# actions a scene can't include: holds need a key release, and scenes don't nest
+NOT_IN_SCENES = {
+    CANCEL_ACTION,
+    "start_holding_volume_down",
+    "start_holding_volume_up",
+    "stop_holding_volume_button",
+    "resync_state",
+    "forget_state",
+}
+
+
+class BindableActions:
+    """What keymap.toml can bind: any action the coordinator runs, and the heartbeat."""
+
+    def __init__(self, coordinator: "Coordinator"):
+        self.coordinator = coordinator
+
+    def __contains__(self, name):
+        return name == KEEP_HOLDING_ACTION or self.coordinator.is_known_action(name)
 
 
 class Coordinator:
-    def __init__(self, remote: Remote):
+    def __init__(
+        self, remote: Remote, keymap_file=KEYMAP_FILE, scenes: dict | None = None
+    ):
         self.remote = remote
-        self.current_task = None
-        self.holding = False
-
-    def start_task(self, promise):
-        self.current_task = asyncio.create_task(promise)
-
-    def handle_keyboard_event(self, event):
-        # logger.info("GOT EVENT:")
-        # logger.info(evdev.categorize(event))
-        # logger.info(event.value)
-        # logger.info(event.code)
-
-        # TODO: handle these async on new threads so we can keep handling keyboard input
-        # this will fix the queueing problem and allow for a kill switch
-        # TODO: came back here 8 months later to add the same comment
-        # maybe 8 months from now I'll actually fix it
-
-        # push key event
-
-        # if no task is running, then accept input
-        if event.value == 1:
-            # if a task is running, then don't accept a new task
-            if self.current_task and not self.current_task.done():
-                # if cancel task button is pressed, cancel the current task
-                # if event.code == NUMPAD_CANCEL_TASK_TRIGGER:
-                #     self.current_task.cancel()
-                #     print("cancelled task")
-                #     print(self.current_task)
-                #     print(self.current_task.done())
-                #     print(self.current_task.cancelled())
-                #     print(self.current_task.exception())
-                #     print(self.current_task.result())
-                #     print(self.current_task.get_coro())
-                #     print(self.current_task.get_stack())
-                #     print(self.current_task.get_name())
-
-                # if any other key is pressed, do nothing
-                return
-
-            if (
-                event.code == MACROPAD_VOLUME_DOWN_TRIGGER
-                or event.code == NUMPAD_VOLUME_DOWN_TRIGGER
-            ):
-                if not self.holding:
-                    self.holding = True
-                    self.remote.start_holding_volume_down()
-
-            elif (
-                event.code == MACROPAD_VOLUME_UP_TRIGGER
-                or event.code == NUMPAD_VOLUME_UP_TRIGGER
-            ):
-                if not self.holding:
-                    self.holding = True
-                    self.remote.start_holding_volume_up()
-
-            elif event.code == NUMPAD_KITCHEN_SPEAKERS_ON_TRIGGER:
-                self.start_task(self.remote.turn_kitchen_speakers_on())
-
-            elif event.code == NUMPAD_KITCHEN_SPEAKERS_OFF_TRIGGER:
-                self.start_task(self.remote.turn_kitchen_speakers_off())
-
-            elif (
-                event.code == MACROPAD_TOGGLE_SURROUND_MODE_TRIGGER
-                or event.code == NUMPAD_TOGGLE_SURROUND_MODE_TRIGGER
-            ):
-                self.start_task(self.remote.toggle_surround_mode())
-
-            elif event.code == NUMPAD_DJ_MODE_TRIGGER:
-                self.start_task(self.remote.switch_to_dj_mode())
-
-            elif event.code == NUMPAD_TV_MODE_TRIGGER:
-                self.start_task(self.remote.switch_to_tv_mode())
-
-            elif event.code == NUMPAD_DISCO_LIGHT_WHITE_TRIGGER:
-                self.start_task(self.remote.turn_disco_light_white())
-
-            elif event.code == NUMPAD_DISCO_LIGHT_YELLOW_TRIGGER:
-                self.start_task(self.remote.turn_disco_light_yellow())
-
-            elif event.code == NUMPAD_DISCO_LIGHT_RED_TRIGGER:
-                self.start_task(self.remote.turn_disco_light_red())
-
-            elif event.code == NUMPAD_DISCO_LIGHT_TOGGLE_TRIGGER:
-                self.start_task(self.remote.toggle_disco_ball_motor())
-
-            elif event.code == NUMPAD_DISCO_LIGHT_TOGGLE_FADE_TRIGGER:
-                self.start_task(self.remote.toggle_disco_light_fade())
-
-            elif event.code == NUMPAD_DISCO_LIGHT_OFF_TRIGGER:
-                self.start_task(self.remote.turn_disco_light_off())
-
-            elif event.code == NUMPAD_SPOTIFY_DARK_MODE_TRIGGER:
-                self.start_task(self.remote.toggle_spotify_dark_mode())
-
-            elif event.code == NUMPAD_TV_POWER_TRIGGER:
-                self.start_task(self.remote.toggle_tv_power())
-
-            elif event.code == NUMPAD_PAUSE_TRIGGER:
-                self.start_task(self.remote.pause())
-
-            elif event.code == NUMPAD_REACTIVE_MODE_TRIGGER:
-                self.start_task(self.remote.enable_reactive_mode())
-
-        # release key event
-        elif event.value == 0:
-            # maybe queue these? see if there are bugs with missing a key release
-            if (
-                event.code == MACROPAD_VOLUME_DOWN_TRIGGER
-                or event.code == NUMPAD_VOLUME_DOWN_TRIGGER
-            ):
-                if self.holding:
-                    self.remote.stop_holding_volume_button()
-                    self.holding = False
-
-            elif (
-                event.code == MACROPAD_VOLUME_UP_TRIGGER
-                or event.code == NUMPAD_VOLUME_UP_TRIGGER
-            ):
-                if self.holding:
-                    self.remote.stop_holding_volume_button()
-                    self.holding = False
+
+        self.policies = dict(ACTION_POLICIES)
+        for name in remote.home_assistant.services:
+            self.policies[HOME_ASSISTANT_ACTION_PREFIX + name] = ActionPolicy(
+                Priority.NORMAL
+            )
+        for name in ["volume", *remote.onkyo.levels]:
+            self.policies[RECEIVER_ACTION_PREFIX + name] = ActionPolicy(
+                Priority.NORMAL, Coalesce.LATEST, RECEIVER_ACTION_PREFIX + name
+            )
+        self.scenes = self.load_scenes(scenes or {})
+        for name in self.scenes:
+            self.policies[SCENE_ACTION_PREFIX + name] = ActionPolicy(
+                Priority.MACRO, Coalesce.LATEST, "scene"
+            )
+        self.scene_runner = SceneRunner(remote, self.make_coroutine)
+        self.scheduler = Scheduler(self.policies, self.make_coroutine)
+        self.gestures = GestureRecognizer(self.dispatch, self.policies)
+        # a LoopMonitor, when the service runs one
+        self.loop_monitor = None
+
+        # called with the new Keymap after each reload
+        self.keymap_listeners = []
+        self.keymap_watcher = KeymapWatcher(
+            keymap_file, BindableActions(self), self.set_keymap
+        )
+        self.keymap = self.keymap_watcher.load()
+
+    def load_scenes(self, scenes: dict) -> dict[str, Scene]:
+        loaded = {}
+        for name, steps in scenes.items():
+            unknown = [
+                step
+                for step in steps
+                if not isinstance(step, str)
+                or not self.is_known_action(step)
+                or step in NOT_IN_SCENES
+            ]
+            if unknown:
+                # a typo in one scene shouldn't keep the service from starting
+                steps = ", ".join(map(str, unknown))
+                logger.error(f"scene {name}: can't run {steps}, skipping it")
+                continue
+            loaded[name] = Scene(name, tuple(steps))
+        return loaded
+
+    @property
+    def current_task(self):
+        return self.scheduler.current_task
+
+    def set_keymap(self, keymap: Keymap):
+        # a single reference swap: handle_keyboard_event never awaits, so every
+        # event is dispatched entirely against either the old or the new table
+        self.keymap = keymap
+        for listener in self.keymap_listeners:
+            listener(keymap)
+
+    async def watch_keymap(self):
+        await self.keymap_watcher.watch()
+
+    async def run_queued_actions(self):
+        await self.scheduler.run()
+
+    def make_coroutine(self, name):
+        if name in ("start_holding_volume_down", "start_holding_volume_up"):
+            return self.start_holding_volume(name)
+        if name == "stop_holding_volume_button":
+            return self.stop_holding_volume_button()
+        if name.startswith(SCENE_ACTION_PREFIX):
+            return self.scene_runner.run(
+                self.scenes[name.removeprefix(SCENE_ACTION_PREFIX)]
+            )
+        if name.startswith(HOME_ASSISTANT_ACTION_PREFIX):
+            return self.remote.call_home_assistant(
+                name.removeprefix(HOME_ASSISTANT_ACTION_PREFIX)
+            )
+        if name.startswith(RECEIVER_ACTION_PREFIX):
+            setting, _, level = name.removeprefix(RECEIVER_ACTION_PREFIX).partition(
+                VALUE_SEPARATOR
+            )
+            return self.remote.set_receiver_level(setting, int(level))
+        return getattr(self.remote, name)()
+
+    def queue_stats(self):
+        return self.scheduler.stats()
+
+    def status(self) -> dict:
+        return {
+            "running": (
+                self.scheduler.current_name if self.scheduler.is_busy() else None
+            ),
+            "holding_volume": self.holding,
+            "ir": self.remote.client.stats(),
+            "receiver": self.remote.onkyo.stats(),
+            "loop": self.loop_monitor.stats() if self.loop_monitor else None,
+            "queues": self.queue_stats(),
+            "device_state": self.remote.state.values,
+            "scenes": {
+                name: report.summary()
+                for name, report in self.scene_runner.reports.items()
+            },
+        }
+
+    def is_known_action(self, name: str) -> bool:
+        setting, separator, level = name.partition(VALUE_SEPARATOR)
+        if setting.startswith(RECEIVER_ACTION_PREFIX):
+            # receiver settings always take a whole number the receiver accepts
+            digits = level.removeprefix("-")
+            if not (separator and setting in self.policies):
+                return False
+            if not (digits.isascii() and digits.isdigit()):
+                return False
+            setting = setting.removeprefix(RECEIVER_ACTION_PREFIX)
+            return int(level) in self.remote.onkyo.setting_range(setting)
+        if separator:
+            return False
+        return name in self.policies or name == CANCEL_ACTION
+
+    async def request(self, name: str, device: str) -> ActionResult:
+        """
+        Run an action as if a key bound to it had been pressed on `device`, and
+        wait for it to finish (or be merged away, dropped or cancelled).
+        """
+        if name == CANCEL_ACTION:
+            self.scheduler.cancel_all()
+            return ActionResult(name, Status.DONE)
+        waiter = asyncio.get_running_loop().create_future()
+        self.scheduler.submit(name, device, waiter=waiter)
+        return await waiter
+
+    # VOLUME CONTROLS
+    @property
+    def holding(self):
+        # the ramp can end on its own (watchdog), so ask it rather than keep a flag
+        return self.remote.volume.is_holding()
+
+    async def start_holding_volume(self, name):
+        if not self.holding:
+            await getattr(self.remote, name)()
+
+    async def stop_holding_volume_button(self):
+        if self.holding:
+            await self.remote.stop_holding_volume_button()
+
+    def device_detached(self, device):
+        self.gestures.device_detached(device)
+        # a device unplugged mid-hold will never send the key release
+        if self.holding:
+            self.scheduler.submit("stop_holding_volume_button", device)
+
+    def handle_keyboard_event(self, event, device=ANY_DEVICE):
+        pressed_at = event_time(event)
+        metrics.observe(
+            "key_input_seconds", time.monotonic() - pressed_at, device=device
+        )
+
+        action = self.keymap.lookup(device, event.code, event.value)
+        if action is None:
+            return
+        if action == GESTURE_ACTION:
+            # the recognizer dispatches once it knows which gesture this is
+            self.gestures.handle(
+                self.keymap, device, event.code, event.value, pressed_at
+            )
+            return
+        logger.debug(
+            "key event",
+            extra={"device": device, "key_code": event.code, "action": action},
+        )
+        self.dispatch(action, device, pressed_at)
+
+    def dispatch(self, action: str, device: str, pressed_at: float):
+        if action == KEEP_HOLDING_ACTION:
+            self.remote.volume.heartbeat()
+        elif action == CANCEL_ACTION:
+            self.scheduler.cancel_all()
+        else:
+            self.scheduler.submit(action, device, pressed_at)
@@ -0,0 +1,82 @@
+import json
+import os
+from enum import StrEnum
+from pathlib import Path
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+STATE_FILE = Path("~/.local/state/volume-control/device_state.json")
+
+
+class StateKey(StrEnum):
+    RECEIVER_INPUT = "receiver.input"
+    LISTENING_MODE = "receiver.listening_mode"
+    KITCHEN_SPEAKERS = "receiver.kitchen_speakers"
+    TV_POWER = "tv.power"
+    SPOTLIGHT = "spotlight.mode"
+    DISCO_BALL = "disco_ball.motor"
+
+
+class DeviceState:
+    """
+    What each device was last told to be, mirrored to a JSON file so it
+    survives restarts. A key that is missing is unknown: whatever is asked of
+    that device next has to be sent.
+
+    The devices can't be read back over IR, so this is only as good as the
+    assumption that nothing else changed them; Remote.resync_state sends the
+    whole model again when that assumption breaks.
+    """
+
+    def __init__(self, path: Path | None = None):
+        self.path = path
+        self.values: dict[str, str | bool] = {}
+
+    @classmethod
+    def load(cls, path: Path | None = STATE_FILE):
+        state = cls(path.expanduser() if path is not None else None)
+        if state.path is None or not state.path.exists():
+            return state
+        try:
+            with open(state.path, encoding="utf-8") as f:
+                loaded = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"ignoring device state in {state.path}: {e!r}")
+            return state
+        # keys from an older version are dropped rather than trusted
+        state.values = {
+            key: value for key, value in loaded.items() if key in set(StateKey)
+        }
+        logger.info(f"device state: {state.values}")
+        return state
+
+    def get(self, key: StateKey):
+        return self.values.get(key)
+
+    def set(self, key: StateKey, value: str | bool):
+        if self.values.get(key) != value:
+            self.values[key] = value
+            self.save()
+
+    def forget(self, key: StateKey):
+        if self.values.pop(key, None) is not None:
+            self.save()
+
+    def clear(self):
+        self.values.clear()
+        self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        # write-then-rename, so a crash mid-write leaves the previous state
+        temporary = self.path.with_suffix(".tmp")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(temporary, "w", encoding="utf-8") as f:
+                json.dump(self.values, f, indent=2, sort_keys=True)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            logger.error(f"saving device state to {self.path} failed: {e!r}")
@@ -0,0 +1,289 @@
+import asyncio
+import ctypes
+import fcntl
+import os
+import struct
+from fnmatch import fnmatch
+from pathlib import Path
+
+import evdev
+
+import inotify
+from coordinator import Coordinator
+from keymap import Keymap
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+BY_ID_DIR = Path("/dev/input/by-id")
+# udev can create the by-id link a moment before the node is readable by us
+OPEN_RETRY_SECONDS = 0.02
+OPEN_RETRY_LIMIT_SECONDS = 2.0
+# how often to rescan when inotify isn't available
+POLL_SECONDS = 1.0
+
+BY_ID_EVENTS = (
+    inotify.IN_CREATE
+    | inotify.IN_MOVED_TO
+    | inotify.IN_DELETE
+    | inotify.IN_MOVED_FROM
+    | inotify.IN_ATTRIB
+)
+PARENT_EVENTS = inotify.IN_CREATE | inotify.IN_DELETE | inotify.IN_ONLYDIR
+
+# struct input_mask { __u32 type; __u32 codes_size; __u64 codes_ptr; }
+INPUT_MASK = struct.Struct("IIQ")
+# _IOW('E', 0x93, struct input_mask), Linux 4.4+
+EVIOCSMASK = 0x40104593
+# type 0 masks event types rather than codes of one type
+EVENT_TYPES_MASK = 0
+
+
+def match_device(devices: dict[str, tuple[str, ...]], path: Path) -> str | None:
+    """The keymap device name whose patterns match a by-id path, if any."""
+    for name, patterns in devices.items():
+        for pattern in patterns:
+            target = str(path) if pattern.startswith("/") else path.name
+            if fnmatch(target, pattern):
+                return name
+    return None
+
+
+def set_event_mask(device: evdev.InputDevice, event_type: int, bits, count: int):
+    """Have the kernel queue only these codes of event_type for this file descriptor."""
+    # a bitmap of unsigned longs, which on little-endian is a plain bit string
+    mask = bytearray((count + 63) // 64 * 8)
+    for bit in bits:
+        mask[bit // 8] |= 1 << bit % 8
+    buffer = (ctypes.c_char * len(mask)).from_buffer(mask)
+    fcntl.ioctl(
+        device.fd,
+        EVIOCSMASK,
+        INPUT_MASK.pack(event_type, len(mask), ctypes.addressof(buffer)),
+    )
+
+
+def filter_key_events(device: evdev.InputDevice, codes):
+    """
+    Drop everything but EV_KEY events for the given codes in the kernel, so
+    mouse motion, MSC_SCAN and unbound keys never wake the reader. Frames left
+    empty lose their SYN_REPORT too.
+    """
+    set_event_mask(
+        device, EVENT_TYPES_MASK, (evdev.ecodes.EV_KEY,), evdev.ecodes.EV_CNT
+    )
+    set_event_mask(device, evdev.ecodes.EV_KEY, codes, evdev.ecodes.KEY_CNT)
+
+
+class DeviceSupervisor:
+    """
+    Attaches a reader to each input device named in the keymap as soon as it
+    shows up in /dev/input/by-id, and lets it go when it's unplugged. Every
+    device has its own task, so losing one never disturbs the others, and
+    nothing restarts the event loop, so Coordinator state carries over.
+
+    Readers ask the kernel for only the bound keys' events (unless
+    filter_events is off), drain everything queued in one wakeup, and can grab
+    their device so the keys don't also reach the console.
+    """
+
+    def __init__(
+        self,
+        coordinator: Coordinator,
+        directory=BY_ID_DIR,
+        grab=False,
+        filter_events=True,
+    ):
+        self.coordinator = coordinator
+        self.directory = Path(directory)
+        self.grab = grab
+        self.filter_events = filter_events
+        # device node (resolved by-id link) -> (device name, reader task)
+        self.readers: dict[str, tuple[str, asyncio.Task]] = {}
+        # device node -> open device, for updating event masks on reload
+        self.open_devices: dict[str, evdev.InputDevice] = {}
+        # device nodes found but not yet attached (or given up on)
+        self.attaching: set[str] = set()
+        self.settled = asyncio.Event()
+        # called with (device name, path) once a reader is attached
+        self.attach_listeners = []
+        self.running = False
+        coordinator.keymap_listeners.append(self.keymap_changed)
+
+    async def run(self):
+        self.running = True
+        try:
+            self.rescan()
+            if not self.attaching:
+                self.settled.set()
+            try:
+                await self.watch()
+            except inotify.InotifyError as e:
+                logger.error(f"inotify unavailable ({e}), polling {self.directory}")
+                while True:
+                    await asyncio.sleep(POLL_SECONDS)
+                    self.rescan()
+        finally:
+            self.running = False
+            for _, task in self.readers.values():
+                task.cancel()
+
+    async def watch(self):
+        watcher = inotify.Inotify()
+        try:
+            # /dev/input/by-id itself goes away when the last device it lists
+            # is unplugged, so watch for it being recreated too
+            watcher.add_watch(self.directory.parent, PARENT_EVENTS)
+            by_id_watch = None
+            while True:
+                if by_id_watch is None and self.directory.is_dir():
+                    by_id_watch = watcher.add_watch(self.directory, BY_ID_EVENTS)
+                    self.rescan()
+                wd, mask, _ = await watcher.get()
+                if wd == by_id_watch and mask & inotify.IN_IGNORED:
+                    by_id_watch = None
+                self.rescan()
+        finally:
+            watcher.close()
+
+    async def wait_attached(self, timeout: float):
+        """Wait (up to timeout) until every device present at startup is attached."""
+        try:
+            async with asyncio.timeout(timeout):
+                await self.settled.wait()
+        except TimeoutError:
+            pass
+
+    def attach_done(self, node: str):
+        self.attaching.discard(node)
+        if not self.attaching:
+            self.settled.set()
+
+    def keymap_changed(self, keymap: Keymap):
+        self.rescan()
+        for node, device in self.open_devices.items():
+            if node in self.readers:
+                self.apply_event_mask(device, self.readers[node][0], keymap)
+
+    def apply_event_mask(self, device: evdev.InputDevice, name: str, keymap: Keymap):
+        if not self.filter_events:
+            return
+        try:
+            filter_key_events(device, keymap.codes(name))
+        except OSError as e:
+            # kernels before 4.4 don't have EVIOCSMASK; filter in Python instead
+            logger.info(
+                f"{name}: can't set the kernel event mask ({e}), reading everything"
+            )
+
+    def rescan(self):
+        if not self.running:
+            return
+        devices = self.coordinator.keymap.devices
+        try:
+            entries = sorted(self.directory.iterdir())
+        except FileNotFoundError:
+            entries = []
+
+        wanted = {}
+        for path in entries:
+            name = match_device(devices, path)
+            if name is None:
+                continue
+            try:
+                node = os.path.realpath(path, strict=True)
+            except OSError:
+                continue
+            wanted.setdefault(node, (name, path))
+
+        for node, (name, task) in list(self.readers.items()):
+            if wanted.get(node, (None,))[0] != name:
+                # the keymap no longer names this device (or names it differently)
+                task.cancel()
+                del self.readers[node]
+                self.attach_done(node)
+
+        for node, (name, path) in wanted.items():
+            if node not in self.readers:
+                self.attaching.add(node)
+                task = asyncio.create_task(self.read_device(node, name, path))
+                self.readers[node] = (name, task)
+
+    async def open_device(self, path: Path, name: str) -> evdev.InputDevice | None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + OPEN_RETRY_LIMIT_SECONDS
+        while True:
+            try:
+                return evdev.InputDevice(str(path))
+            except PermissionError:
+                if loop.time() >= deadline:
+                    logger.error(f"{name}: no permission to open {path}")
+                    return None
+            except OSError as e:
+                # gone again before we got to it
+                logger.info(f"{name}: could not open {path}: {e}")
+                return None
+            await asyncio.sleep(OPEN_RETRY_SECONDS)
+
+    async def read_device(self, node: str, name: str, path: Path):
+        device = await self.open_device(path, name)
+        if device is None:
+            self.attach_done(node)
+            self.forget(node)
+            return
+
+        loop = asyncio.get_running_loop()
+        closed = loop.create_future()
+        self.open_devices[node] = device
+        try:
+            self.apply_event_mask(device, name, self.coordinator.keymap)
+            if self.grab:
+                try:
+                    device.grab()
+                except OSError as e:
+                    logger.error(f"{name}: could not grab {path}: {e}")
+            loop.add_reader(device.fd, self.drain, device, name, closed)
+            logger.info(f"{name}: attached {path}")
+            self.attach_done(node)
+            for listener in self.attach_listeners:
+                listener(name, path)
+            await closed
+        except OSError as e:
+            logger.info(f"{name}: detached ({e})")
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # a bug handling one device's events must not take the others down
+            logger.exception(f"{name}: reader failed: {e!r}")
+        finally:
+            self.attach_done(node)
+            loop.remove_reader(device.fd)
+            device.close()
+            self.open_devices.pop(node, None)
+            self.forget(node)
+            self.coordinator.device_detached(name)
+
+    def drain(self, device: evdev.InputDevice, name: str, closed: asyncio.Future):
+        """Dispatch every event queued for a device, in the wakeup that found it."""
+        handle_keyboard_event = self.coordinator.handle_keyboard_event
+        while True:
+            try:
+                events = list(device.read())
+            except BlockingIOError:
+                return
+            except OSError as e:
+                # unplugged (ENODEV): end this reader
+                if not closed.done():
+                    closed.set_exception(e)
+                return
+            for event in events:
+                if event.type != evdev.ecodes.EV_KEY:
+                    continue
+                try:
+                    handle_keyboard_event(event, name)
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    # a bug handling one press mustn't detach the keypad
+                    logger.exception(f"{name}: handling {event.code} failed: {e!r}")
+
+    def forget(self, node: str):
+        entry = self.readers.get(node)
+        if entry is not None and entry[1] is asyncio.current_task():
+            del self.readers[node]
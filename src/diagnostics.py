@@ -0,0 +1,109 @@
+import asyncio
+import cProfile
+import io
+import json
+import pstats
+import time
+import tracemalloc
+from pathlib import Path
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+DIAGNOSTICS_DIR = Path("/tmp")
+PROFILE_SECONDS = 10.0
+TOP_ENTRIES = 25
+
+
+class Diagnostics:
+    """
+    Writes what the service is doing to a timestamped file, while it keeps
+    running: every asyncio task's stack, the scheduler and backend state, a
+    cProfile of the event loop for the next profile_seconds, and the top
+    allocations made meanwhile (tracemalloc). Triggered by SIGUSR1 or
+    POST /diagnostics on the control API.
+
+    tracemalloc only sees allocations made while it runs, so unless it was
+    already on it is started for the profile window and stopped after.
+    """
+
+    def __init__(
+        self, status, directory=DIAGNOSTICS_DIR, profile_seconds=PROFILE_SECONDS
+    ):
+        # status() -> dict, the same as GET /status on the control API
+        self.status = status
+        self.directory = Path(directory)
+        self.profile_seconds = profile_seconds
+        self.running: asyncio.Task | None = None
+
+    @classmethod
+    def from_config(cls, status, diagnostics_config: dict):
+        return cls(
+            status,
+            diagnostics_config.get("directory", DIAGNOSTICS_DIR),
+            diagnostics_config.get("profile_seconds", PROFILE_SECONDS),
+        )
+
+    def request(self, profile_seconds=None) -> asyncio.Task:
+        """Start a dump, or return the one already running."""
+        if self.running is None or self.running.done():
+            self.running = asyncio.create_task(self.dump(profile_seconds))
+            # a failed write is already logged; from SIGUSR1 nobody awaits it
+            self.running.add_done_callback(
+                lambda task: task.cancelled() or task.exception()
+            )
+        return self.running
+
+    async def dump(self, profile_seconds=None) -> Path:
+        seconds = self.profile_seconds if profile_seconds is None else profile_seconds
+        path = self.directory / time.strftime("volume-control-%Y%m%d-%H%M%S.txt")
+        logger.info(f"writing diagnostics to {path} (profiling for {seconds}s)")
+        out = io.StringIO()
+
+        # snapshot first, before profiling changes what's running
+        out.write(
+            f"# volume-control diagnostics, {time.strftime('%Y-%m-%d %H:%M:%S')}\n"
+        )
+        out.write("\n## status\n")
+        out.write(json.dumps(self.status(), indent=2, default=str))
+        out.write("\n\n## asyncio tasks\n")
+        self.write_tasks(out)
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+            snapshot = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+
+        out.write(f"\n## cProfile, {seconds}s of the event loop, by cumulative time\n")
+        stats = pstats.Stats(profile, stream=out)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_ENTRIES)
+        out.write(f"\n## tracemalloc, top {TOP_ENTRIES} allocation sites\n")
+        for stat in snapshot.statistics("lineno")[:TOP_ENTRIES]:
+            out.write(f"{stat}\n")
+
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path.write_text(out.getvalue(), encoding="utf-8")
+        except OSError as e:
+            logger.error(f"writing diagnostics to {path} failed: {e!r}")
+            raise
+        logger.info(f"wrote diagnostics to {path}")
+        return path
+
+    @staticmethod
+    def write_tasks(out):
+        # not the dump itself
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        out.write(f"{len(tasks)} tasks\n")
+        for task in sorted(tasks, key=lambda task: task.get_name()):
+            out.write("\n")
+            task.print_stack(file=out)
@@ -0,0 +1,145 @@
+import asyncio
+import struct
+import time
+from typing import BinaryIO, Iterator, NamedTuple
+
+import evdev
+
+# Binary log of EV_KEY events:
+#
+#   header  "VCEV", version, first event's timestamp (µs since the epoch)
+#   D       device index, name length, name (utf-8): names a device
+#   K       device index, µs since the previous event, key code, key value
+#   T       µs to add before the next event, for gaps that don't fit in K
+#
+# A key event is 9 bytes.
+
+MAGIC = b"VCEV"
+VERSION = 1
+HEADER = struct.Struct("<4sBq")
+DEVICE = struct.Struct("<BB")
+KEY = struct.Struct("<BIHB")
+SKIP = struct.Struct("<Q")
+MAX_DELTA_US = 0xFFFFFFFF
+
+
+class EventLogError(Exception):
+    pass
+
+
+class LoggedEvent(NamedTuple):
+    # seconds since the epoch, as the kernel stamped it
+    timestamp: float
+    device: str
+    code: int
+    value: int
+
+
+def timestamp_us(event) -> int:
+    return event.sec * 1_000_000 + event.usec
+
+
+class EventLogWriter:
+    def __init__(self, file: BinaryIO):
+        self.file = file
+        self.devices: dict[str, int] = {}
+        self.last_us = None
+        self.count = 0
+
+    def write(self, device: str, event):
+        now_us = timestamp_us(event)
+        if self.last_us is None:
+            self.file.write(HEADER.pack(MAGIC, VERSION, now_us))
+            self.last_us = now_us
+
+        index = self.devices.get(device)
+        if index is None:
+            if len(self.devices) >= 0x100:
+                raise EventLogError("too many devices for one log")
+            index = self.devices[device] = len(self.devices)
+            # cut to the 255 bytes a name can have, on a character boundary
+            name = (
+                device.encode("utf-8")[:0xFF].decode("utf-8", "ignore").encode("utf-8")
+            )
+            self.file.write(b"D" + DEVICE.pack(index, len(name)) + name)
+
+        # events from different devices can arrive slightly out of order
+        delta = max(0, now_us - self.last_us)
+        if delta > MAX_DELTA_US:
+            self.file.write(b"T" + SKIP.pack(delta))
+            delta = 0
+        self.file.write(b"K" + KEY.pack(index, delta, event.code, event.value))
+        self.last_us = max(self.last_us, now_us)
+        self.count += 1
+
+    def flush(self):
+        self.file.flush()
+
+
+def read_exactly(file: BinaryIO, size: int) -> bytes:
+    data = file.read(size)
+    if len(data) != size:
+        raise EventLogError("truncated event log")
+    return data
+
+
+def read_event_log(file: BinaryIO) -> Iterator[LoggedEvent]:
+    header = file.read(HEADER.size)
+    if not header:
+        return
+    if len(header) != HEADER.size:
+        raise EventLogError("truncated event log")
+    magic, version, now_us = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise EventLogError(f"not a version {VERSION} event log")
+
+    devices = {}
+    while tag := file.read(1):
+        if tag == b"K":
+            index, delta, code, value = KEY.unpack(read_exactly(file, KEY.size))
+            now_us += delta
+            yield LoggedEvent(now_us / 1_000_000, devices[index], code, value)
+        elif tag == b"D":
+            index, length = DEVICE.unpack(read_exactly(file, DEVICE.size))
+            devices[index] = read_exactly(file, length).decode("utf-8")
+        elif tag == b"T":
+            (delta,) = SKIP.unpack(read_exactly(file, SKIP.size))
+            now_us += delta
+        else:
+            raise EventLogError(f"unknown record {tag!r}")
+
+
+async def replay(events, handle_keyboard_event, speed=1.0) -> int:
+    """
+    Feed logged events to handle_keyboard_event(event, device), keeping their
+    spacing divided by `speed`; speed 0 means as fast as possible. Events are
+    restamped with the time they are replayed at. Returns the number replayed.
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    start_wall = time.time()
+    first = None
+    count = 0
+    for logged in events:
+        if first is None:
+            first = logged.timestamp
+        offset = (logged.timestamp - first) / speed if speed else 0.0
+        delay = start + offset - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            # let the scheduler and backends run between events
+            await asyncio.sleep(0)
+
+        stamp = start_wall + offset if speed else time.time()
+        sec = int(stamp)
+        event = evdev.InputEvent(
+            sec,
+            int((stamp - sec) * 1_000_000),
+            evdev.ecodes.EV_KEY,
+            logged.code,
+            logged.value,
+        )
+        handle_keyboard_event(event, logged.device)
+        count += 1
+    return count
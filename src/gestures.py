@@ -0,0 +1,252 @@
+import asyncio
+import time
+
+from action_queue import Coalesce
+from keymap import KEY_PRESS, KEY_RELEASE, Gesture, GestureBinding, Keymap
+from logger import get_logger
+from metrics import metrics
+from scheduler import ActionPolicy
+
+logger = get_logger(__name__)
+
+
+class KeyState:
+    def __init__(self, down_at: float, consumed=False):
+        self.down_at = down_at
+        self.held = True
+        # a gesture already used this press; its release does nothing
+        self.consumed = consumed
+        # the tap already ran on key-down
+        self.speculated = False
+        # released once, waiting to see if a second tap follows
+        self.awaiting_second = False
+        self.timer: asyncio.TimerHandle | None = None
+
+    def cancel_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+
+class GestureRecognizer:
+    """
+    Turns key-downs and releases into taps, double taps, long presses and
+    two-key chords, for keys whose keymap binding uses them.
+
+    Telling gestures apart means waiting: a tap is only a tap once the key is
+    released before long_press_seconds, and no second tap or chord partner
+    followed. That wait is skipped when running the tap right away is safe:
+    when the tap and every other gesture on its key set the same state
+    (Coalesce.LATEST in one group), so whichever comes later wins anyway.
+    The delay each gesture added is recorded per binding.
+    """
+
+    def __init__(self, dispatch, policies: dict[str, ActionPolicy]):
+        # dispatch(action, device, pressed_at) runs an action
+        self.dispatch = dispatch
+        self.policies = policies
+        # (device, key code) -> the press being recognized
+        self.keys: dict[tuple[str, int], KeyState] = {}
+        # "device key gesture" -> [count, total seconds, max seconds] added
+        self.delays: dict[str, list] = {}
+
+    def handle(
+        self, keymap: Keymap, device: str, code: int, value: int, pressed_at: float
+    ):
+        binding = keymap.gesture_binding(device, code)
+        if binding is None:
+            return
+        if value == KEY_PRESS:
+            self.key_down(keymap, binding, device, code, pressed_at)
+        elif value == KEY_RELEASE:
+            self.key_up(keymap, binding, device, code)
+
+    def key_down(self, keymap, binding: GestureBinding, device, code, at):
+        timings = keymap.gesture_timings
+        loop = asyncio.get_running_loop()
+        key = (device, code)
+
+        state = self.keys.get(key)
+        if state is not None and state.awaiting_second:
+            state.cancel_timer()
+            self.keys[key] = KeyState(at, consumed=True)
+            self.fire(binding, device, binding.key, Gesture.DOUBLE_TAP, at)
+            return
+
+        for partner, chord, action in binding.chords:
+            other = self.keys.get((device, partner))
+            if (
+                other is not None
+                and other.held
+                and not other.consumed
+                and at - other.down_at <= timings.chord_seconds
+            ):
+                other.cancel_timer()
+                other.consumed = True
+                self.keys[key] = KeyState(at, consumed=True)
+                self.fire_action(
+                    binding.device, device, chord, Gesture.CHORD, action, at
+                )
+                return
+
+        if state is not None:
+            state.cancel_timer()
+        state = self.keys[key] = KeyState(at)
+        actions = binding.actions
+        if Gesture.TAP in actions and self.is_speculative(binding):
+            state.speculated = True
+            self.fire(binding, device, binding.key, Gesture.TAP, at)
+
+        if Gesture.LONG_PRESS in actions:
+            state.timer = loop.call_at(
+                at + timings.long_press_seconds,
+                self.long_press,
+                binding,
+                device,
+                code,
+                state,
+            )
+        elif (
+            binding.chords
+            and Gesture.TAP in actions
+            and Gesture.DOUBLE_TAP not in actions
+        ):
+            # nothing else to wait for once a chord partner can't follow
+            state.timer = loop.call_at(
+                at + timings.chord_seconds,
+                self.tap_unless_chord,
+                binding,
+                device,
+                code,
+                state,
+            )
+
+    def key_up(self, keymap, binding: GestureBinding, device, code):
+        key = (device, code)
+        state = self.keys.get(key)
+        if state is None or not state.held:
+            return
+        state.held = False
+        state.cancel_timer()
+        if state.consumed:
+            del self.keys[key]
+            return
+        if Gesture.DOUBLE_TAP in binding.actions:
+            state.awaiting_second = True
+            state.timer = asyncio.get_running_loop().call_later(
+                keymap.gesture_timings.double_tap_seconds,
+                self.single_tap,
+                binding,
+                device,
+                code,
+                state,
+            )
+            return
+        del self.keys[key]
+        if not state.speculated and Gesture.TAP in binding.actions:
+            self.fire(binding, device, binding.key, Gesture.TAP, state.down_at)
+
+    def long_press(self, binding, device, code, state: KeyState):
+        state.timer = None
+        if self.keys.get((device, code)) is state and state.held and not state.consumed:
+            state.consumed = True
+            self.fire(binding, device, binding.key, Gesture.LONG_PRESS, state.down_at)
+
+    def tap_unless_chord(self, binding, device, code, state: KeyState):
+        state.timer = None
+        if self.keys.get((device, code)) is state and state.held and not state.consumed:
+            state.consumed = True
+            if not state.speculated:
+                self.fire(binding, device, binding.key, Gesture.TAP, state.down_at)
+
+    def single_tap(self, binding, device, code, state: KeyState):
+        state.timer = None
+        if self.keys.get((device, code)) is not state:
+            return
+        del self.keys[(device, code)]
+        if not state.speculated and Gesture.TAP in binding.actions:
+            self.fire(binding, device, binding.key, Gesture.TAP, state.down_at)
+
+    def fire(
+        self, binding: GestureBinding, device, key: str, gesture: Gesture, pressed_at
+    ):
+        action = binding.actions.get(gesture)
+        if action is not None:
+            self.fire_action(binding.device, device, key, gesture, action, pressed_at)
+
+    def fire_action(
+        self, bound, device, key, gesture: Gesture, action: str, pressed_at
+    ):
+        added = max(0.0, time.monotonic() - pressed_at)
+        metrics.observe("gesture_delay_seconds", added, gesture=gesture)
+        delay = self.delays.setdefault(f"{bound} {key} {gesture}", [0, 0.0, 0.0])
+        delay[0] += 1
+        delay[1] += added
+        delay[2] = max(delay[2], added)
+        logger.debug(f"{device}: {key} {gesture} -> {action} (+{added * 1000:.0f} ms)")
+        # pressed_at is the key-down, so dispatch latency includes the wait
+        self.dispatch(action, device, pressed_at)
+
+    def is_speculative(self, binding: GestureBinding) -> bool:
+        """Whether the tap can run on key-down, before other gestures are ruled out."""
+        tap = self.policies.get(binding.actions[Gesture.TAP])
+        if tap is None or tap.coalesce is not Coalesce.LATEST or tap.group is None:
+            return False
+        others = [
+            action
+            for gesture, action in binding.actions.items()
+            if gesture != Gesture.TAP
+        ]
+        others += [action for _, _, action in binding.chords]
+        for action in others:
+            policy = self.policies.get(action)
+            if policy is None or policy.coalesce is not Coalesce.LATEST:
+                return False
+            if policy.group != tap.group:
+                return False
+        return True
+
+    def device_detached(self, device: str):
+        for key in [key for key in self.keys if key[0] == device]:
+            self.keys.pop(key).cancel_timer()
+
+    def latency_report(self, keymap: Keymap) -> dict:
+        """
+        Per gesture binding: the most recognition can add to it (ms, and
+        whether it waits for the key release first), and what it has added.
+        """
+        timings = keymap.gesture_timings
+        report = {}
+        for binding in keymap.gestures.values():
+            actions = binding.actions
+            for gesture, action in actions.items():
+                after_release = False
+                if gesture is Gesture.LONG_PRESS:
+                    budget = timings.long_press_seconds
+                elif gesture is Gesture.DOUBLE_TAP or self.is_speculative(binding):
+                    budget = 0.0
+                elif Gesture.DOUBLE_TAP in actions:
+                    budget, after_release = timings.double_tap_seconds, True
+                elif Gesture.LONG_PRESS in actions:
+                    budget, after_release = 0.0, True
+                else:
+                    budget = timings.chord_seconds
+                report[f"{binding.device} {binding.key} {gesture}"] = {
+                    "action": action,
+                    "budget_ms": round(budget * 1000, 1),
+                    "after_release": after_release,
+                }
+            for _, chord, action in binding.chords:
+                report[f"{binding.device} {chord} {Gesture.CHORD}"] = {
+                    "action": action,
+                    "budget_ms": 0.0,
+                    "after_release": False,
+                }
+        for name, (count, total, longest) in self.delays.items():
+            if name in report:
+                report[name]["observed"] = {
+                    "count": count,
+                    "mean_ms": round(total / count * 1000, 1),
+                    "max_ms": round(longest * 1000, 1),
+                }
+        return report
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import random
+import time
+
+from http_client import ConnectError, HttpClient, HttpError, StaleConnectionError
+from logger import get_logger
+from metrics import metrics
+
+logger = get_logger(__name__)
+
+RETRY_BASE_SECONDS = 0.2
+# Home Assistant answers 503 while it starts, before running anything; a 502 or
+# 504 from a proxy can come after the call already ran
+RETRYABLE_STATUSES = (503,)
+
+
+class HomeAssistantError(Exception):
+    pass
+
+
+class HomeAssistant:
+    """
+    Home Assistant service calls over a shared keep-alive connection.
+
+    Calls are retried with jittered backoff only when they can't have reached
+    Home Assistant (connect failures, a 503 while it starts). A call that timed
+    out, got a gateway error or lost its connection may already have run, and
+    service calls like switch.toggle aren't idempotent, so those are reported
+    rather than retried.
+    """
+
+    def __init__(self, url: str, token: str, services: dict, timeout=3.0, retries=2):
+        self.http = HttpClient(url, timeout)
+        self.token = token
+        # named service calls from config, bindable to keys
+        self.services = services
+        self.retries = retries
+
+    @classmethod
+    def from_config(cls, ha_config: dict):
+        token = ha_config.get("token") or os.environ.get("HOME_ASSISTANT_TOKEN", "")
+        if not token:
+            logger.error(
+                "no Home Assistant token: set token under [home_assistant] in"
+                " src/config.local.toml or HOME_ASSISTANT_TOKEN"
+            )
+        return cls(
+            ha_config["url"],
+            token,
+            ha_config.get("services", {}),
+            ha_config.get("timeout", 3.0),
+            ha_config.get("retries", 2),
+        )
+
+    async def call_service(self, domain: str, service: str, data: dict | None = None):
+        headers = {"Authorization": f"Bearer {self.token}"}
+        path = f"/api/services/{domain}/{service}"
+
+        for attempt in range(self.retries + 1):
+            retry_reason = None
+            started = time.monotonic()
+            try:
+                response = await self.http.post_json(path, data or {}, headers)
+            except TimeoutError as e:
+                raise HomeAssistantError(f"{domain}.{service} timed out") from e
+            except asyncio.IncompleteReadError as e:
+                raise HomeAssistantError(
+                    f"{domain}.{service}: truncated response"
+                ) from e
+            except (ConnectError, StaleConnectionError) as e:
+                # nothing reached Home Assistant
+                retry_reason = repr(e)
+            except (OSError, HttpError) as e:
+                # sent on a fresh connection, so it may have run
+                raise HomeAssistantError(f"{domain}.{service} failed: {e!r}") from e
+            else:
+                metrics.observe(
+                    "backend_seconds",
+                    time.monotonic() - started,
+                    backend="home_assistant",
+                    command=f"{domain}.{service}",
+                )
+                if response.status in RETRYABLE_STATUSES:
+                    retry_reason = f"HTTP {response.status}"
+                elif response.status >= 400:
+                    raise HomeAssistantError(
+                        f"{domain}.{service} failed: HTTP {response.status}"
+                        f" {response.body[:200]!r}"
+                    )
+                else:
+                    try:
+                        return response.json()
+                    except ValueError as e:
+                        raise HomeAssistantError(
+                            f"{domain}.{service}: invalid JSON response: {e}"
+                        ) from e
+
+            if attempt == self.retries:
+                raise HomeAssistantError(f"{domain}.{service} failed: {retry_reason}")
+            delay = RETRY_BASE_SECONDS * 2**attempt * random.uniform(0.5, 1.5)
+            logger.info(
+                f"{domain}.{service} failed ({retry_reason}), retrying in {delay:.2f}s"
+            )
+            await asyncio.sleep(delay)
+
+    async def call(self, name: str):
+        """Run one of the named service calls from [home_assistant.services]."""
+        spec = self.services[name]
+        domain, service = spec["service"].split(".", 1)
+        return await self.call_service(domain, service, spec.get("data"))
+
+    async def turn(self, name: str, on: bool):
+        """Run a named `<domain>.toggle` call as its turn_on / turn_off counterpart."""
+        spec = self.services[name]
+        domain, service = spec["service"].split(".", 1)
+        if service != "toggle":
+            raise HomeAssistantError(f"{name} is {spec['service']}, not a toggle")
+        return await self.call_service(
+            domain, "turn_on" if on else "turn_off", spec.get("data")
+        )
+
+    async def entity_state(self, name: str) -> str:
+        """The state ("on", "off", ...) of the entity a named service call targets."""
+        entity_id = (self.services[name].get("data") or {}).get("entity_id")
+        if not entity_id:
+            raise HomeAssistantError(f"{name} doesn't name an entity_id")
+        headers = {"Authorization": f"Bearer {self.token}"}
+        try:
+            response = await self.http.request(
+                "GET", f"/api/states/{entity_id}", headers
+            )
+        except (OSError, TimeoutError, HttpError, asyncio.IncompleteReadError) as e:
+            raise HomeAssistantError(f"reading {entity_id} failed: {e!r}") from e
+        if response.status >= 400:
+            raise HomeAssistantError(
+                f"reading {entity_id} failed: HTTP {response.status}"
+            )
+        try:
+            return response.json()["state"]
+        except (ValueError, TypeError, KeyError) as e:
+            raise HomeAssistantError(
+                f"reading {entity_id}: unexpected response: {e!r}"
+            ) from e
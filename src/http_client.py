@@ -0,0 +1,180 @@
+import asyncio
+import json
+from collections import deque
+from urllib.parse import urlsplit
+
+# just enough HTTP/1.1 for small JSON API calls over keep-alive connections
+
+MAX_HEADER_BYTES = 64 * 1024
+
+
+class HttpError(Exception):
+    pass
+
+
+class ConnectError(HttpError):
+    """Couldn't open a connection, so nothing was sent."""
+
+
+class StaleConnectionError(HttpError):
+    """A reused keep-alive connection was closed before any response arrived."""
+
+
+class HttpResponse:
+    def __init__(self, status: int, headers: dict[str, str], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body) if self.body else None
+
+
+class HttpClient:
+    """
+    Keep-alive HTTP/1.1 client for one origin. Connections are reused between
+    requests, up to max_connections at a time.
+    """
+
+    def __init__(self, base_url: str, timeout=5.0, max_connections=2):
+        url = urlsplit(base_url)
+        self.host = url.hostname
+        self.port = url.port or (443 if url.scheme == "https" else 80)
+        self.ssl = None
+        if url.scheme == "https":
+            # imported here: ssl is slow to load and most setups are plain http
+            import ssl  # pylint: disable=import-outside-toplevel
+
+            self.ssl = ssl.create_default_context()
+        self.base_path = url.path.rstrip("/")
+        self.timeout = timeout
+        self.max_connections = max_connections
+
+        self.idle: deque[tuple[asyncio.StreamReader, asyncio.StreamWriter]] = deque()
+        self.slots = None
+        self.loop = None
+        self.connections_opened = 0
+
+    def _check_loop(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # connections from a previous event loop can't be used on this one
+            self.idle.clear()
+            self.loop = loop
+            self.slots = asyncio.Semaphore(self.max_connections)
+
+    async def _open(self):
+        self.connections_opened += 1
+        try:
+            return await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        except OSError as e:
+            raise ConnectError(repr(e)) from e
+
+    async def request(
+        self, method: str, path: str, headers=None, body=b"", timeout=None
+    ):
+        self._check_loop()
+        async with self.slots:
+            async with asyncio.timeout(self.timeout if timeout is None else timeout):
+                while self.idle:
+                    reader, writer = self.idle.pop()
+                    if writer.is_closing() or reader.at_eof():
+                        writer.close()
+                        continue
+                    try:
+                        return await self._exchange(
+                            reader, writer, method, path, headers, body, reused=True
+                        )
+                    except StaleConnectionError:
+                        # the server timed out the idle connection; nothing was
+                        # processed, so just try the next one
+                        continue
+
+                reader, writer = await self._open()
+                return await self._exchange(
+                    reader, writer, method, path, headers, body, reused=False
+                )
+
+    async def post_json(self, path: str, data, headers=None, timeout=None):
+        headers = {"Content-Type": "application/json", **(headers or {})}
+        body = json.dumps(data).encode("utf-8")
+        return await self.request("POST", path, headers, body, timeout)
+
+    async def _exchange(self, reader, writer, method, path, headers, body, reused):
+        keep = False
+        try:
+            lines = [
+                f"{method} {self.base_path}{path} HTTP/1.1",
+                f"Host: {self.host}:{self.port}",
+                "Connection: keep-alive",
+                f"Content-Length: {len(body)}",
+            ]
+            lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+            try:
+                await writer.drain()
+                status_line = await reader.readline()
+            except ConnectionError as e:
+                if reused:
+                    raise StaleConnectionError(str(e)) from e
+                raise
+            if not status_line:
+                if reused:
+                    raise StaleConnectionError("connection closed before response")
+                raise HttpError("connection closed before response")
+
+            response = await self._read_response(status_line, reader)
+            keep = response.headers.get("connection", "").lower() != "close"
+            return response
+        finally:
+            if keep:
+                self.idle.append((reader, writer))
+            else:
+                writer.close()
+
+    async def _read_response(self, status_line: bytes, reader) -> HttpResponse:
+        parts = status_line.decode("latin-1").split(" ", 2)
+        if len(parts) < 2 or not parts[1].isdigit():
+            raise HttpError(f"malformed status line: {status_line!r}")
+        status = int(parts[1])
+
+        headers = {}
+        header_bytes = 0
+        while True:
+            line = await reader.readline()
+            header_bytes += len(line)
+            if header_bytes > MAX_HEADER_BYTES:
+                raise HttpError("response headers too large")
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = await self._read_chunked(reader)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        elif status in (204, 304) or 100 <= status < 200:
+            body = b""
+        else:
+            body = await reader.read()
+            headers["connection"] = "close"
+        return HttpResponse(status, headers, body)
+
+    async def _read_chunked(self, reader) -> bytes:
+        chunks = []
+        while True:
+            size_line = await reader.readline()
+            size = int(size_line.split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                # trailers, if any, end with an empty line
+                while (await reader.readline()) not in (b"\r\n", b""):
+                    pass
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+    async def close(self):
+        while self.idle:
+            _, writer = self.idle.pop()
+            writer.close()
@@ -0,0 +1,85 @@
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+
+# just enough of inotify(7) to watch a directory for entries coming and going
+
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+EVENT_HEADER = struct.Struct("iIII")
+
+_libc = None
+
+
+class InotifyError(OSError):
+    pass
+
+
+def libc():
+    global _libc  # pylint: disable=global-statement
+    if _libc is None:
+        name = ctypes.util.find_library("c")
+        if name is None:
+            raise InotifyError("libc not found")
+        _libc = ctypes.CDLL(name, use_errno=True)
+        if not hasattr(_libc, "inotify_init1"):
+            raise InotifyError("inotify is not available on this platform")
+    return _libc
+
+
+class Inotify:
+    """
+    An inotify instance read from the event loop. get() returns
+    (watch descriptor, mask, name) for each event, name being the directory
+    entry it concerns.
+    """
+
+    def __init__(self):
+        self.fd = libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise InotifyError(errno, os.strerror(errno))
+        self.events: asyncio.Queue = asyncio.Queue()
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(self.fd, self._read)
+
+    def add_watch(self, path, mask) -> int:
+        wd = libc().inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise InotifyError(errno, os.strerror(errno), str(path))
+        return wd
+
+    def _read(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            self.events.put_nowait((wd, mask, os.fsdecode(name)))
+
+    async def get(self):
+        return await self.events.get()
+
+    def close(self):
+        if self.fd >= 0:
+            self.loop.remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = -1
@@ -0,0 +1,202 @@
+import asyncio
+import time
+from collections import deque
+
+from lircd import AsyncLircClient
+from logger import get_logger
+from macros import SendKind
+
+logger = get_logger(__name__)
+
+
+class IrRequest:
+    def __init__(self, kind: SendKind, remote: str, button: str, repeat_count=0):
+        self.kind = kind
+        self.remote = remote
+        self.button = button
+        self.repeat_count = repeat_count
+        self.queued_at = time.monotonic()
+        # had to wait for a held button to be released
+        self.blocked = False
+        self.future = asyncio.get_running_loop().create_future()
+
+    def __repr__(self):
+        return f"{self.kind.name} {self.remote} {self.button}"
+
+
+class IrArbiter:
+    """
+    The one writer to lircd. Everything that transmits IR goes through here,
+    with the client's send_once / send_start / send_stop signature.
+
+    lircd repeats one button at a time and the Onkyo/ADJ repeat code doesn't
+    say which button it repeats, so while a button is held:
+
+    - another hold waits for it to be released;
+    - a short send to a different remote is interleaved: the hold is paused
+      (SEND_STOP), the send goes out, and the hold resumes (SEND_START), so
+      neither device sees a frame that isn't meant for it;
+    - a short send to the same remote waits, since the receiver would take the
+      repeat frames after it as holding the new button;
+    - SEND_STOP only ends the button it names.
+
+    Requests are dispatched in the order they arrive, skipping only ones that
+    must wait for a release, and are written without waiting for the previous
+    reply, so the client's pipelining is kept.
+    """
+
+    def __init__(self, client: AsyncLircClient):
+        self.client = client
+        self.waiting: deque[IrRequest] = deque()
+        # (remote, button) being repeated by lircd, if any
+        self.held: tuple[str, str] | None = None
+
+        self.sent = 0
+        self.interleaved = 0
+        self.deferred = 0
+        self.ignored_stops = 0
+        self.max_wait = 0.0
+
+    # same surface as AsyncLircClient, for Remote, MacroRunner and VolumeRamp
+    async def connect(self):
+        await self.client.connect()
+
+    async def close(self):
+        await self.client.close()
+
+    def is_connected(self):
+        return self.client.is_connected()
+
+    async def send_once(self, remote: str, key: str, repeat_count: int = 0):
+        await self.request(IrRequest(SendKind.ONCE, remote, key, repeat_count))
+
+    async def send_start(self, remote: str, key: str):
+        await self.request(IrRequest(SendKind.START, remote, key))
+
+    async def send_stop(self, remote: str, key: str):
+        await self.request(IrRequest(SendKind.STOP, remote, key))
+
+    async def request(self, request: IrRequest):
+        self.waiting.append(request)
+        self.dispatch()
+        try:
+            return await request.future
+        except asyncio.CancelledError:
+            # never written: just forget it, unless it's a STOP, which still has
+            # to go out or lircd would repeat the button for good
+            if request.kind is not SendKind.STOP and request in self.waiting:
+                self.waiting.remove(request)
+            raise
+
+    def dispatch(self):
+        """Write every request that can go out now, oldest first."""
+        while True:
+            for request in self.waiting:
+                if self.ready(request):
+                    break
+                request.blocked = True
+            else:
+                return
+            # issuing can change what's held, so look again from the oldest
+            self.waiting.remove(request)
+            self.issue(request)
+
+    def ready(self, request: IrRequest) -> bool:
+        if self.held is None or request.kind is SendKind.STOP:
+            return True
+        if request.kind is SendKind.START:
+            return False
+        return request.remote != self.held[0]
+
+    def issue(self, request: IrRequest):
+        if request.blocked:
+            wait = time.monotonic() - request.queued_at
+            self.max_wait = max(self.max_wait, wait)
+            self.deferred += 1
+            logger.debug(f"{request} waited {wait * 1000:.0f} ms for a held button")
+
+        if request.kind is SendKind.STOP:
+            if self.held != (request.remote, request.button):
+                # a STOP for a START that's still waiting cancels it instead
+                wanted = (request.remote, request.button)
+                for queued in self.waiting:
+                    if (
+                        queued.kind is SendKind.START
+                        and (queued.remote, queued.button) == wanted
+                    ):
+                        self.waiting.remove(queued)
+                        queued.future.set_result(None)
+                        break
+                else:
+                    self.ignored_stops += 1
+                    logger.debug(f"ignoring {request}: holding {self.held_name()}")
+                request.future.set_result(None)
+                return
+            self.held = None
+            self.write(request, self.client.send_stop(request.remote, request.button))
+
+        elif request.kind is SendKind.START:
+            self.held = (request.remote, request.button)
+            self.write(
+                request,
+                self.client.send_start(request.remote, request.button),
+                hold=self.held,
+            )
+
+        elif self.held is not None:
+            remote, button = self.held
+            self.interleaved += 1
+            self.write(None, self.client.send_stop(remote, button))
+            self.write(
+                request,
+                self.client.send_once(
+                    request.remote, request.button, request.repeat_count
+                ),
+            )
+            self.write(None, self.client.send_start(remote, button), hold=self.held)
+
+        else:
+            self.write(
+                request,
+                self.client.send_once(
+                    request.remote, request.button, request.repeat_count
+                ),
+            )
+
+    def write(self, request: IrRequest | None, coroutine, hold=None):
+        """`hold` is the button a SEND_START makes lircd repeat."""
+        # tasks start in creation order and write before their first await,
+        # so commands reach lircd in the order they were issued
+        sent = asyncio.ensure_future(coroutine)
+        self.sent += 1
+        sent.add_done_callback(lambda done: self.written(request, hold, done))
+
+    def written(self, request: IrRequest | None, hold, done: asyncio.Future):
+        error = None if done.cancelled() else done.exception()
+        if error is not None and hold is not None and self.held == hold:
+            # lircd isn't repeating it after all
+            self.held = None
+            self.dispatch()
+        if request is None:
+            # the pause or resume around an interleaved send
+            if error is not None:
+                logger.error(f"interleaving around a held button failed: {error}")
+        elif not request.future.done():
+            if error is not None:
+                request.future.set_exception(error)
+            else:
+                request.future.set_result(None)
+
+    def held_name(self) -> str:
+        return " ".join(self.held) if self.held else "nothing"
+
+    def stats(self) -> dict:
+        return {
+            "held": self.held_name(),
+            "waiting": len(self.waiting),
+            "sent": self.sent,
+            "interleaved": self.interleaved,
+            "deferred": self.deferred,
+            "ignored_stops": self.ignored_stops,
+            "max_wait": self.max_wait,
+        }
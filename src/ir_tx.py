@@ -0,0 +1,326 @@
+import asyncio
+import fcntl
+import os
+import stat
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from lirc.exceptions import LircdCommandFailureError, LircdConnectionError
+
+from lircd_conf import LircdConfError, LircRemote
+from logger import get_logger
+from metrics import metrics
+
+logger = get_logger(__name__)
+
+LIRC_TX_DEVICE = "/dev/lirc0"
+# _IOW('i', 0x13, __u32)
+LIRC_SET_SEND_CARRIER = 0x40046913
+# flags the renderer doesn't handle; everything in remotes/ is plain SPACE_ENC
+UNSUPPORTED_FLAGS = {
+    "RC5",
+    "RC6",
+    "RCMM",
+    "SHIFT_ENC",
+    "SPACE_FIRST",
+    "GRUNDIG",
+    "BO",
+    "XMP",
+}
+
+
+class PulseBuilder:
+    """Alternating pulse/space durations, merging runs of the same kind like lircd."""
+
+    def __init__(self):
+        self.durations = array("I")
+
+    def add(self, pulse: bool, us: int):
+        if us <= 0:
+            return
+        # even indexes are pulses
+        if self.durations and (len(self.durations) % 2 == 1) == pulse:
+            self.durations[-1] += us
+        elif not self.durations and not pulse:
+            raise LircdConfError("a frame can't start with a space")
+        else:
+            self.durations.append(us)
+
+    def add_pair(self, pair: tuple[int, int]):
+        self.add(True, pair[0])
+        self.add(False, pair[1])
+
+    def extend(self, frame: array):
+        for i, us in enumerate(frame):
+            self.add(i % 2 == 0, us)
+
+
+class Frame:
+    """
+    One transmission: pulse/space durations ending on a pulse, then the gap
+    before the next.
+    """
+
+    __slots__ = ("durations", "gap")
+
+    def __init__(self, durations: array, gap: int):
+        self.durations = durations
+        self.gap = gap
+
+    def on_air(self) -> int:
+        return sum(self.durations)
+
+
+class RenderedRemote:
+    """
+    Every button of a lircd.conf remote as pulse/space buffers, rendered once
+    the way lircd's transmit code renders them: header, pre_data, data bits
+    (MSB first), post_data, ptrail, then the gap; a CONST_LENGTH gap counts
+    from the start of the frame. Buttons with several codes send one frame per
+    code. A toggle_bit_mask alternates between presses, so those buttons are
+    kept in both states.
+    """
+
+    def __init__(self, remote: LircRemote):
+        unsupported = remote.flags & UNSUPPORTED_FLAGS
+        if unsupported:
+            raise LircdConfError(
+                f"{remote.name}: can't render {', '.join(sorted(unsupported))}"
+            )
+        self.name = remote.name
+        self.remote = remote
+        self.carrier = remote.value("frequency") or 38000
+        toggle = remote.value("toggle_bit_mask")
+        # button -> frames per toggle state
+        self.presses: dict[str, tuple[tuple[Frame, ...], ...]] = {}
+        for button, codes in remote.codes.items():
+            states = (0, toggle) if toggle else (0,)
+            self.presses[button] = tuple(
+                tuple(self.code_frame(code ^ state) for code in codes)
+                for state in states
+            )
+        for button, durations in remote.raw_codes.items():
+            frame = PulseBuilder()
+            frame.extend(array("I", durations))
+            self.presses[button] = ((self.frame(frame.durations),),)
+        self.repeat = self.repeat_frame()
+        # lircd flips the toggle bits before every press, the first one too
+        self.toggle_state = 1
+
+    def frame(self, durations: array, gap=None) -> Frame:
+        remote = self.remote
+        gap = remote.value("gap") if gap is None else gap
+        if "CONST_LENGTH" in remote.flags:
+            gap = max(0, gap - sum(durations))
+        if len(durations) % 2 == 0:
+            # a trailing space (no ptrail) is part of the gap
+            gap += durations.pop()
+        return Frame(durations, gap)
+
+    def add_bits(self, frame: PulseBuilder, data: int, bits: int):
+        order = (
+            range(bits) if "REVERSE" in self.remote.flags else range(bits - 1, -1, -1)
+        )
+        for bit in order:
+            frame.add_pair(self.remote.pair("one" if data >> bit & 1 else "zero"))
+
+    def code_frame(self, code: int) -> Frame:
+        remote = self.remote
+        frame = PulseBuilder()
+        frame.add_pair(remote.pair("header"))
+        frame.add(True, remote.value("plead"))
+        if remote.value("pre_data_bits"):
+            self.add_bits(
+                frame, remote.value("pre_data"), remote.value("pre_data_bits")
+            )
+            frame.add(False, remote.value("pre"))
+        self.add_bits(frame, code, remote.value("bits"))
+        if remote.value("post_data_bits"):
+            frame.add(False, remote.value("post"))
+            self.add_bits(
+                frame, remote.value("post_data"), remote.value("post_data_bits")
+            )
+        frame.add(True, remote.value("ptrail"))
+        frame.add_pair(remote.pair("foot"))
+        return self.frame(frame.durations)
+
+    def repeat_frame(self) -> Frame | None:
+        remote = self.remote
+        if "repeat" not in remote.pairs:
+            return None
+        frame = PulseBuilder()
+        frame.add(True, remote.value("plead"))
+        frame.add_pair(remote.pair("repeat"))
+        frame.add(True, remote.value("ptrail"))
+        return self.frame(frame.durations, remote.value("repeat_gap") or None)
+
+    def press(self, button: str) -> tuple[Frame, ...]:
+        """The frames for one press, flipping the toggle bits for the next one."""
+        states = self.presses[button]
+        frames = states[self.toggle_state % len(states)]
+        self.toggle_state ^= 1
+        return frames
+
+    def repeats(self, frames: tuple[Frame, ...]) -> tuple[Frame, ...]:
+        # without a repeat code lircd resends the whole button, same toggle
+        return (self.repeat,) if self.repeat is not None else frames
+
+    def send_once(self, button: str, repeat_count=0) -> list[Frame]:
+        frames = self.press(button)
+        repeats = max(repeat_count, self.remote.value("min_repeat"))
+        return [*frames, *self.repeats(frames) * repeats]
+
+
+def join_frames(frames) -> Frame:
+    """One buffer for several frames, with each gap but the last written as a space."""
+    joined = PulseBuilder()
+    for i, frame in enumerate(frames):
+        if i:
+            joined.add(False, frames[i - 1].gap)
+        joined.extend(frame.durations)
+    return Frame(joined.durations, frames[-1].gap)
+
+
+def render_remotes(remotes: dict[str, LircRemote]) -> dict[str, RenderedRemote]:
+    rendered = {}
+    for name, remote in remotes.items():
+        try:
+            rendered[name] = RenderedRemote(remote)
+        except LircdConfError as e:
+            logger.error(f"not rendering {name} for direct IR: {e}")
+    return rendered
+
+
+class DirectIrClient:
+    """
+    Sends IR without lircd: pre-rendered buffers are written straight to the
+    LIRC TX device in pulse mode (a plain file works too, for tests). Same
+    surface as AsyncLircClient, so it sits behind the IrArbiter unchanged.
+
+    Writes block until the frame is on air, so they run on one worker thread,
+    in order; the gap after a frame is waited out before the next write.
+    """
+
+    def __init__(self, remotes: dict[str, RenderedRemote], device=LIRC_TX_DEVICE):
+        self.remotes = remotes
+        self.device = device
+        self.fd = None
+        # writing to a regular file rather than a transmitter
+        self.plain_file = False
+        self.carrier = None
+        self.ready_at = 0.0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ir-tx")
+        # held button -> its repeat task
+        self.held: dict[tuple[str, str], asyncio.Task] = {}
+
+    def is_connected(self):
+        return self.fd is not None
+
+    async def connect(self):
+        self.open()
+
+    def open(self):
+        if self.fd is not None:
+            return
+        try:
+            self.fd = os.open(self.device, os.O_WRONLY | os.O_APPEND)
+        except OSError as e:
+            raise LircdConnectionError(f"could not open {self.device}: {e}") from e
+        self.plain_file = stat.S_ISREG(os.fstat(self.fd).st_mode)
+        self.carrier = None
+        logger.info(f"sending IR directly to {self.device}")
+
+    async def close(self):
+        for task in self.held.values():
+            task.cancel()
+        self.held.clear()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def rendered(self, remote: str, key: str) -> RenderedRemote:
+        rendered = self.remotes.get(remote)
+        if rendered is None or key not in rendered.presses:
+            # what lircd answers for a button it doesn't know
+            raise LircdCommandFailureError(f"unknown remote or button: {remote} {key}")
+        return rendered
+
+    def transmit(self, carrier: int, frame: Frame):
+        """On the worker thread: wait out the previous gap, then write one buffer."""
+        if self.carrier != carrier:
+            try:
+                fcntl.ioctl(self.fd, LIRC_SET_SEND_CARRIER, array("I", [carrier]))
+            except OSError as e:
+                # a plain file, or a transmitter with a fixed carrier
+                logger.debug(f"{self.device}: can't set the carrier: {e}")
+            self.carrier = carrier
+        delay = self.ready_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        started = time.monotonic()
+        data = frame.durations
+        if self.plain_file:
+            # the gap too, so the file stays alternating pulse/space across writes
+            data = data + array("I", [frame.gap])
+        os.write(self.fd, data.tobytes())
+        # a file returns at once; the transmitter returns once it's on air
+        on_air = started + frame.on_air() / 1e6
+        self.ready_at = max(time.monotonic(), on_air) + frame.gap / 1e6
+
+    def submit(self, rendered: RenderedRemote, frames) -> asyncio.Future:
+        """
+        Queue frames for the worker. Not a coroutine: the arbiter issues commands
+        without waiting for each other, and they must reach the worker in that order.
+        """
+        self.open()
+        return asyncio.get_running_loop().run_in_executor(
+            self.executor, self.transmit, rendered.carrier, join_frames(frames)
+        )
+
+    async def wait(self, sent: asyncio.Future, command: str):
+        started = time.monotonic()
+        try:
+            await sent
+        except OSError as e:
+            raise LircdConnectionError(f"writing to {self.device} failed: {e}") from e
+        metrics.observe(
+            "backend_seconds",
+            time.monotonic() - started,
+            backend="ir_tx",
+            command=command,
+        )
+
+    async def send_once(self, remote: str, key: str, repeat_count: int = 0):
+        rendered = self.rendered(remote, key)
+        await self.wait(
+            self.submit(rendered, rendered.send_once(key, repeat_count)), "SEND_ONCE"
+        )
+
+    async def send_start(self, remote: str, key: str):
+        rendered = self.rendered(remote, key)
+        if (remote, key) in self.held:
+            return
+        frames = rendered.press(key)
+        sent = self.submit(rendered, frames)
+        self.held[(remote, key)] = asyncio.create_task(
+            self.repeat(rendered, rendered.repeats(frames), sent)
+        )
+        await self.wait(sent, "SEND_START")
+
+    async def repeat(self, rendered: RenderedRemote, frames, first: asyncio.Future):
+        # asyncio.wait rather than await: stopping mustn't cancel the first frame
+        await asyncio.wait([first])
+        try:
+            while True:
+                await self.wait(self.submit(rendered, frames), "repeat")
+        except LircdConnectionError as e:
+            logger.error(f"repeating {rendered.name} stopped: {e}")
+
+    async def send_stop(self, remote: str, key: str):
+        task = self.held.pop((remote, key), None)
+        if task is None:
+            raise LircdCommandFailureError(f"not repeating {remote} {key}")
+        task.cancel()
+        # a frame already queued still goes out whole, like lircd's
+        await asyncio.wait([task])
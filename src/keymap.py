@@ -0,0 +1,294 @@
+import asyncio
+import os
+import tomllib
+from enum import StrEnum
+from pathlib import Path
+from typing import NamedTuple
+
+from evdev import ecodes
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+KEYMAP_FILE = Path(__file__).parent / "keymap.toml"
+KEYMAP_POLL_SECONDS = 1.0
+
+# bindings under this device name match key events from every device
+ANY_DEVICE = "any"
+
+# evdev EV_KEY values
+KEY_RELEASE = 0
+KEY_PRESS = 1
+KEY_REPEAT = 2
+
+EVENT_VALUES = {
+    "release": KEY_RELEASE,
+    "press": KEY_PRESS,
+    "repeat": KEY_REPEAT,
+}
+
+# table entry for a key handled by the gesture recognizer, for every key value
+GESTURE_ACTION = "<gesture>"
+CHORD_SEPARATOR = "+"
+
+
+class Gesture(StrEnum):
+    TAP = "tap"
+    DOUBLE_TAP = "double_tap"
+    LONG_PRESS = "long_press"
+    CHORD = "chord"
+
+
+class GestureTimings(NamedTuple):
+    # held this long, a key is a long press
+    long_press_seconds: float = 0.5
+    # a second key-down within this long after a release is a double tap
+    double_tap_seconds: float = 0.25
+    # the two keys of a chord go down within this long of each other
+    chord_seconds: float = 0.08
+
+
+class GestureBinding(NamedTuple):
+    device: str
+    key: str
+    actions: dict[Gesture, str]
+    # (other key code, chord name, action) for each chord this key is in
+    chords: tuple[tuple[int, str, str], ...]
+
+
+class KeymapError(Exception):
+    pass
+
+
+class Keymap:
+    """
+    Precompiled dispatch table from (device, key code, key value) to an action name.
+
+    Instances are never mutated after construction, so a reload swaps in a whole
+    new Keymap and an event that is mid-dispatch keeps using the table it started with.
+    """
+
+    def __init__(
+        self,
+        devices: dict[str, tuple[str, ...]],
+        table: dict[tuple, str],
+        stamp=None,
+        gestures: dict[tuple[str, int], GestureBinding] | None = None,
+        gesture_timings=GestureTimings(),
+    ):
+        self.devices = devices
+        self.table = table
+        self.stamp = stamp
+        # (device, key code) -> gestures, for keys bound to GESTURE_ACTION
+        self.gestures = gestures or {}
+        self.gesture_timings = gesture_timings
+
+    def lookup(self, device: str, code: int, value: int) -> str | None:
+        action = self.table.get((device, code, value))
+        if action is None:
+            action = self.table.get((ANY_DEVICE, code, value))
+        return action
+
+    def gesture_binding(self, device: str, code: int) -> GestureBinding | None:
+        binding = self.gestures.get((device, code))
+        if binding is None:
+            binding = self.gestures.get((ANY_DEVICE, code))
+        return binding
+
+    def codes(self, device: str) -> frozenset[int]:
+        """Every key code bound for a device, including the bindings for any device."""
+        return frozenset(
+            code for bound, code, _ in self.table if bound in (device, ANY_DEVICE)
+        )
+
+
+def parse_key_code(key) -> int:
+    if isinstance(key, int):
+        return key
+    if key.isdigit():
+        return int(key)
+    try:
+        return ecodes.ecodes[key]
+    except KeyError as e:
+        raise KeymapError(f"unknown key name: {key}") from e
+
+
+def key_name(code: int) -> str:
+    name = ecodes.KEY.get(code, str(code))
+    # some codes have several names
+    return name[0] if isinstance(name, list) else name
+
+
+def compile_gesture_timings(raw: dict) -> GestureTimings:
+    unknown = set(raw) - set(GestureTimings._fields)
+    if unknown:
+        raise KeymapError(f"gestures: unknown settings {', '.join(sorted(unknown))}")
+    if not all(isinstance(value, (int, float)) and value > 0 for value in raw.values()):
+        raise KeymapError("gestures: timings must be positive numbers of seconds")
+    return GestureTimings(**raw)
+
+
+def compile_gestures(table: dict, gestures: dict, chords: dict) -> dict:
+    """
+    Turn per-key gestures and chords into GestureBindings, and point the keys
+    they use at GESTURE_ACTION. A key with only a tap, in no chord, stays a
+    plain key-down binding, so it fires without any recognition delay.
+    """
+    # keys in a chord take their own key-down binding as their tap
+    for device, codes in chords:
+        for code in codes:
+            if (device, code, KEY_RELEASE) in table or (
+                device,
+                code,
+                KEY_REPEAT,
+            ) in table:
+                raise KeymapError(
+                    f"{device}.{key_name(code)}: a key in a chord can't bind"
+                    " release or repeat"
+                )
+            actions = gestures.setdefault((device, code), {})
+            press = table.pop((device, code, KEY_PRESS), None)
+            if press is not None:
+                actions.setdefault(Gesture.TAP, press)
+
+    partners = {}
+    for (device, codes), action in chords.items():
+        first, second = sorted(codes)
+        name = f"{key_name(first)}{CHORD_SEPARATOR}{key_name(second)}"
+        partners.setdefault((device, first), []).append((second, name, action))
+        partners.setdefault((device, second), []).append((first, name, action))
+
+    bindings = {}
+    for (device, code), actions in gestures.items():
+        if set(actions) == {Gesture.TAP} and (device, code) not in partners:
+            table[(device, code, KEY_PRESS)] = actions[Gesture.TAP]
+            continue
+        bindings[(device, code)] = GestureBinding(
+            device, key_name(code), actions, tuple(partners.get((device, code), ()))
+        )
+        for value in EVENT_VALUES.values():
+            table[(device, code, value)] = GESTURE_ACTION
+    return bindings
+
+
+def compile_keymap(raw: dict, known_actions, stamp=None) -> Keymap:
+    # each device is one or more glob patterns for its /dev/input/by-id entry
+    devices = {}
+    for device, patterns in raw.get("devices", {}).items():
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        if not patterns or not all(isinstance(p, str) for p in patterns):
+            raise KeymapError(
+                f"devices.{device}: expected a pattern or list of patterns"
+            )
+        devices[device] = tuple(patterns)
+    table = {}
+    gestures = {}
+    chords = {}
+
+    for device, bindings in raw.get("bindings", {}).items():
+        if device != ANY_DEVICE and device not in devices:
+            raise KeymapError(f"bindings for undeclared device: {device}")
+
+        for key, binding in bindings.items():
+            if CHORD_SEPARATOR in key:
+                parts = key.split(CHORD_SEPARATOR)
+                codes = frozenset(parse_key_code(part.strip()) for part in parts)
+                if len(codes) != 2:
+                    raise KeymapError(f"{device}.{key}: a chord is two different keys")
+                if not isinstance(binding, str) or binding not in known_actions:
+                    raise KeymapError(f"{device}.{key}: unknown action {binding}")
+                chords[(device, codes)] = binding
+                continue
+            code = parse_key_code(key)
+
+            # a bare action name is shorthand for binding the key-down
+            if isinstance(binding, str):
+                binding = {"press": binding}
+            if not isinstance(binding, dict):
+                raise KeymapError(
+                    f"{device}.{key}: expected an action or a table of events"
+                )
+
+            for event_name, action in binding.items():
+                if event_name not in EVENT_VALUES and event_name not in set(Gesture):
+                    raise KeymapError(f"{device}.{key}: unknown event {event_name}")
+                if event_name == Gesture.CHORD:
+                    raise KeymapError(f'{device}.{key}: bind chords as "KEY_A+KEY_B"')
+                if not isinstance(action, str) or action not in known_actions:
+                    raise KeymapError(f"{device}.{key}: unknown action {action}")
+                if event_name in EVENT_VALUES:
+                    table[(device, code, EVENT_VALUES[event_name])] = action
+                else:
+                    gestures.setdefault((device, code), {})[
+                        Gesture(event_name)
+                    ] = action
+            if (device, code) in gestures and any(
+                (device, code, value) in table for value in EVENT_VALUES.values()
+            ):
+                raise KeymapError(
+                    f"{device}.{key}: bind either gestures or press/release/repeat,"
+                    " not both"
+                )
+
+    gesture_bindings = compile_gestures(table, gestures, chords)
+    timings = compile_gesture_timings(raw.get("gestures", {}))
+    return Keymap(devices, table, stamp, gesture_bindings, timings)
+
+
+def keymap_stamp(path: Path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def load_keymap(path: Path, known_actions) -> Keymap:
+    stamp = keymap_stamp(path)
+    try:
+        with open(path, "rb") as f:
+            raw = tomllib.load(f)
+    except tomllib.TOMLDecodeError as e:
+        raise KeymapError(f"could not parse {path}: {e}") from e
+    return compile_keymap(raw, known_actions, stamp)
+
+
+class KeymapWatcher:
+    """
+    Polls the keymap file and hands a freshly compiled Keymap to on_reload whenever
+    it changes on disk. A file that fails to load is logged and the previous keymap
+    stays active.
+    """
+
+    def __init__(self, path: Path, known_actions, on_reload):
+        self.path = path
+        self.known_actions = known_actions
+        self.on_reload = on_reload
+        self.stamp = None
+
+    def load(self) -> Keymap:
+        keymap = load_keymap(self.path, self.known_actions)
+        self.stamp = keymap.stamp
+        return keymap
+
+    def poll(self):
+        try:
+            stamp = keymap_stamp(self.path)
+            if stamp == self.stamp:
+                return
+            keymap = self.load()
+        except (OSError, KeymapError) as e:
+            logger.error(f"keeping previous keymap, reload failed: {e}")
+            # don't retry the same broken file every poll
+            try:
+                self.stamp = keymap_stamp(self.path)
+            except OSError:
+                pass
+            return
+
+        logger.info(f"reloaded keymap from {self.path} ({len(keymap.table)} bindings)")
+        self.on_reload(keymap)
+
+    async def watch(self, interval=KEYMAP_POLL_SECONDS):
+        while True:
+            await asyncio.sleep(interval)
+            self.poll()
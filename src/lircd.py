@@ -0,0 +1,212 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+from lirc.exceptions import (
+    LircdCommandFailureError,
+    LircdConnectionError,
+    LircdInvalidReplyPacketError,
+    LircdSocketError,
+)
+from lirc.reply_packet_parser import ReplyPacketParser
+
+from logger import get_logger
+from metrics import metrics
+
+logger = get_logger(__name__)
+
+LIRCD_SOCKET = os.environ.get("LIRCD_SOCKET", "/var/run/lirc/lircd")
+# same default as lirc.Client's socket timeout
+COMMAND_TIMEOUT_SECONDS = 5.0
+
+
+class AsyncLircClient:
+    """
+    asyncio drop-in for lirc.Client: the same methods, as coroutines.
+
+    Commands are pipelined over one lircd socket. Each one is written as soon as
+    it is issued and lircd answers them in order, so replies are matched to the
+    oldest outstanding command. The connection is opened on first use and
+    reopened after lircd goes away or a command times out.
+    """
+
+    def __init__(self, address=LIRCD_SOCKET, timeout=COMMAND_TIMEOUT_SECONDS):
+        self.address = address
+        self.timeout = timeout
+
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._loop = None
+        self._connect_lock = None
+        self._pending: deque[asyncio.Future] = deque()
+
+        # used for send_stop without arguments, like lirc.Client
+        self._last_send_start_remote = None
+        self._last_send_start_key = None
+
+    def is_connected(self):
+        return (
+            self._writer is not None
+            and not self._writer.is_closing()
+            and self._loop is asyncio.get_running_loop()
+        )
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # main() restarts the event loop after errors; streams from the old
+            # loop are unusable, so start over
+            self._forget_connection()
+            self._loop = loop
+            self._connect_lock = asyncio.Lock()
+
+        async with self._connect_lock:
+            if self.is_connected():
+                return
+            try:
+                self._reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_unix_connection(self.address), self.timeout
+                )
+            except (OSError, asyncio.TimeoutError) as e:
+                raise LircdConnectionError(
+                    f"Could not connect to lircd at {self.address}: {e}"
+                ) from e
+            self._read_task = asyncio.create_task(self._read_replies())
+            logger.info(f"connected to lircd at {self.address}")
+
+    async def close(self):
+        writer = self._writer
+        self._disconnect(LircdConnectionError("lircd connection closed"))
+        if writer is not None:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    def _forget_connection(self):
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._pending.clear()
+
+    def _disconnect(self, error: Exception):
+        if self._writer is not None:
+            self._writer.close()
+        if (
+            self._read_task is not None
+            and self._read_task is not asyncio.current_task()
+        ):
+            self._read_task.cancel()
+        pending = self._pending
+        self._forget_connection()
+        while pending:
+            future = pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+    async def _read_replies(self):
+        parser = ReplyPacketParser()
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    raise LircdConnectionError("lircd closed the connection")
+
+                parser.feed(line.decode("utf-8"))
+                if not parser.is_finished:
+                    continue
+
+                if self._pending:
+                    future = self._pending.popleft()
+                    if not future.done():
+                        future.set_result((parser.success, parser.data))
+                parser = ReplyPacketParser()
+
+        except (OSError, LircdConnectionError, LircdInvalidReplyPacketError) as e:
+            logger.error(f"lircd connection lost: {e}")
+            self._disconnect(
+                e
+                if isinstance(e, LircdInvalidReplyPacketError)
+                else LircdConnectionError(str(e))
+            )
+
+    async def _send_command(self, command: str, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        started = time.monotonic()
+
+        # a dead connection is only discovered once the command is written, so
+        # reconnect and retry once if it fails before lircd could have seen it
+        for attempt in range(2):
+            if not self.is_connected():
+                await self.connect()
+            # queued before writing so a fast reply always finds its command
+            future = asyncio.get_running_loop().create_future()
+            self._pending.append(future)
+            try:
+                self._writer.write(f"{command}\n".encode("utf-8"))
+                await self._writer.drain()
+                break
+            except OSError as e:
+                self._disconnect(LircdConnectionError(str(e)))
+                future.exception()
+                if attempt:
+                    raise LircdConnectionError(str(e)) from e
+
+        try:
+            success, data = await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError as e:
+            # the reply may still arrive and would be matched to the wrong command
+            self._disconnect(LircdSocketError(f"`{command}` timed out"))
+            raise LircdSocketError(
+                f"lircd did not answer `{command}` within {timeout}s"
+            ) from e
+
+        metrics.observe(
+            "backend_seconds",
+            time.monotonic() - started,
+            backend="lircd",
+            command=command.split(" ", 1)[0],
+        )
+        data = data[0] if len(data) == 1 else data
+        if not success:
+            raise LircdCommandFailureError(
+                f"The `{command}` command sent to lircd failed: {data}"
+            )
+        return data
+
+    async def send_once(
+        self, remote: str, key: str, repeat_count: int = 0, timeout=None
+    ):
+        await self._send_command(f"SEND_ONCE {remote} {key} {repeat_count}", timeout)
+
+    async def send_start(self, remote: str, key: str, timeout=None):
+        self._last_send_start_remote = remote
+        self._last_send_start_key = key
+        await self._send_command(f"SEND_START {remote} {key}", timeout)
+
+    async def send_stop(self, remote: str = "", key: str = "", timeout=None):
+        if not remote and self._last_send_start_remote:
+            remote = self._last_send_start_remote
+        if not key and self._last_send_start_key:
+            key = self._last_send_start_key
+        await self._send_command(f"SEND_STOP {remote} {key}", timeout)
+
+    async def list_remotes(self):
+        return await self._send_command("LIST")
+
+    async def list_remote_keys(self, remote: str):
+        return await self._send_command(f"LIST {remote}")
+
+    async def version(self):
+        return await self._send_command("VERSION")
+
+    async def set_transmitters(self, transmitters: int | list[int]):
+        mask = transmitters
+        if isinstance(transmitters, list):
+            mask = 0
+            for transmitter in transmitters:
+                mask |= 1 << (int(transmitter) - 1)
+        await self._send_command(f"SET_TRANSMITTERS {mask}")
@@ -0,0 +1,216 @@
+from pathlib import Path
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+REMOTES_DIR = Path(__file__).parent.parent / "remotes"
+# spacing for remotes or buttons we have no lircd.conf for
+DEFAULT_SPACING_SECONDS = 0.2
+# slack on top of the on-air time, for lircd and scheduler jitter
+SPACING_MARGIN_SECONDS = 0.01
+
+# (pulse, space) pairs in lircd.conf
+PAIR_FIELDS = ("header", "one", "zero", "two", "three", "repeat", "foot")
+# single durations or numbers
+NUMBER_FIELDS = (
+    "bits",
+    "plead",
+    "ptrail",
+    "pre_data_bits",
+    "pre_data",
+    "post_data_bits",
+    "post_data",
+    "pre",
+    "post",
+    "gap",
+    "repeat_gap",
+    "min_repeat",
+    "frequency",
+    "toggle_bit_mask",
+)
+
+
+class LircdConfError(Exception):
+    pass
+
+
+class LircRemote:
+    """One `begin remote` block: its timings (in microseconds) and its codes."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.flags: set[str] = set()
+        self.values: dict[str, int] = {}
+        self.pairs: dict[str, tuple[int, int]] = {}
+        # button -> codes sent for one press, in order
+        self.codes: dict[str, tuple[int, ...]] = {}
+        # button -> pulse/space durations, for raw_codes remotes
+        self.raw_codes: dict[str, tuple[int, ...]] = {}
+
+    def value(self, field: str) -> int:
+        return self.values.get(field, 0)
+
+    def pair(self, field: str) -> tuple[int, int]:
+        return self.pairs.get(field, (0, 0))
+
+    def buttons(self):
+        return [*self.codes, *self.raw_codes]
+
+    def bits_us(self, data: int, bits: int) -> int:
+        one, zero = sum(self.pair("one")), sum(self.pair("zero"))
+        if "SPACE_ENC" not in self.flags and "SPACE_FIRST" not in self.flags:
+            # bi-phase and friends: every bit is roughly one symbol long
+            return bits * max(one, zero)
+        total = 0
+        for bit in range(bits - 1, -1, -1):
+            total += one if data >> bit & 1 else zero
+        return total
+
+    def frame_us(self, code: int) -> int:
+        """On-air length of one frame carrying `code`, without the gap."""
+        total = self.value("plead") + sum(self.pair("header"))
+        if self.value("pre_data_bits"):
+            total += self.bits_us(self.value("pre_data"), self.value("pre_data_bits"))
+            total += self.value("pre")
+        total += self.bits_us(code, self.value("bits"))
+        if self.value("post_data_bits"):
+            total += self.value("post")
+            total += self.bits_us(self.value("post_data"), self.value("post_data_bits"))
+        return total + self.value("ptrail") + sum(self.pair("foot"))
+
+    def repeat_frame_us(self) -> int | None:
+        if "repeat" not in self.pairs:
+            return None
+        return self.value("plead") + sum(self.pair("repeat")) + self.value("ptrail")
+
+    def period_us(self, frame: int, gap=None) -> int:
+        """Time from the start of one frame to the earliest start of the next."""
+        gap = self.value("gap") if gap is None else gap
+        if "CONST_LENGTH" in self.flags:
+            return max(gap, frame)
+        return frame + gap
+
+    def press_us(self, button: str, repeat_count=0) -> int:
+        """Time to send `SEND_ONCE remote button repeat_count`, including gaps."""
+        if button in self.raw_codes:
+            frames = [sum(self.raw_codes[button])]
+        elif button in self.codes:
+            frames = [self.frame_us(code) for code in self.codes[button]]
+        else:
+            raise KeyError(button)
+
+        press = sum(self.period_us(frame) for frame in frames)
+        total = press
+        repeats = max(repeat_count, self.value("min_repeat"))
+        if repeats:
+            repeat_frame = self.repeat_frame_us()
+            repeat_gap = self.value("repeat_gap") or None
+            if repeat_frame is None:
+                # without a repeat code lircd resends the whole button
+                total += repeats * press
+            else:
+                total += repeats * self.period_us(repeat_frame, repeat_gap)
+        return total
+
+    def release_us(self) -> int:
+        """Worst case for lircd to finish a held button after SEND_STOP."""
+        repeat_frame = self.repeat_frame_us()
+        if repeat_frame is not None:
+            return self.period_us(repeat_frame, self.value("repeat_gap") or None)
+        return max((self.press_us(button) for button in self.buttons()), default=0)
+
+
+def parse_lircd_conf(text: str) -> dict[str, LircRemote]:
+    remotes = {}
+    remote = None
+    section = None
+    raw_button = None
+
+    for number, line in enumerate(text.splitlines(), 1):
+        words = line.split("#", 1)[0].split()
+        if not words:
+            continue
+        try:
+            if words[0] == "begin":
+                section = words[1]
+                if section == "remote":
+                    remote = LircRemote("")
+                continue
+            if words[0] == "end":
+                if words[1] == "remote":
+                    if not remote.name:
+                        raise LircdConfError("remote without a name")
+                    remotes[remote.name] = remote
+                    remote = None
+                section = "remote" if remote is not None else None
+                raw_button = None
+                continue
+            if remote is None:
+                continue
+
+            if section == "codes":
+                remote.codes[words[0]] = tuple(int(word, 0) for word in words[1:])
+            elif section == "raw_codes":
+                if words[0] == "name":
+                    raw_button = words[1]
+                    remote.raw_codes[raw_button] = ()
+                elif raw_button is not None:
+                    remote.raw_codes[raw_button] += tuple(int(word) for word in words)
+            elif words[0] == "name":
+                remote.name = words[1]
+            elif words[0] == "flags":
+                remote.flags = set(words[1].split("|"))
+            elif words[0] in PAIR_FIELDS:
+                remote.pairs[words[0]] = (int(words[1], 0), int(words[2], 0))
+            elif words[0] in NUMBER_FIELDS:
+                remote.values[words[0]] = int(words[1], 0)
+        except (IndexError, ValueError, AttributeError) as e:
+            raise LircdConfError(f"line {number}: {line.strip()!r}: {e}") from e
+
+    return remotes
+
+
+class RemoteTimings:
+    """
+    Per-remote, per-button spacing between IR commands, derived from the
+    lircd.conf timings, with DEFAULT_SPACING_SECONDS for anything unknown.
+    """
+
+    def __init__(self, remotes: dict[str, LircRemote]):
+        self.remotes = remotes
+        self.cache: dict[tuple[str, str, int], float] = {}
+
+    def spacing(self, remote: str, button: str, repeat_count=0) -> float:
+        """Seconds from issuing a SEND_ONCE until the next command may start."""
+        key = (remote, button, repeat_count)
+        seconds = self.cache.get(key)
+        if seconds is None:
+            try:
+                on_air = self.remotes[remote].press_us(button, repeat_count) / 1e6
+                seconds = on_air + SPACING_MARGIN_SECONDS
+            except KeyError:
+                seconds = DEFAULT_SPACING_SECONDS * (repeat_count + 1)
+            self.cache[key] = seconds
+        return seconds
+
+    def release(self, remote: str) -> float:
+        """Seconds after SEND_STOP until the next command may start."""
+        if remote not in self.remotes:
+            return DEFAULT_SPACING_SECONDS
+        return self.remotes[remote].release_us() / 1e6 + SPACING_MARGIN_SECONDS
+
+
+def load_remote_timings(directory=REMOTES_DIR) -> RemoteTimings:
+    remotes = {}
+    for path in sorted(Path(directory).glob("*.lircd.conf")):
+        try:
+            remotes.update(parse_lircd_conf(path.read_text(encoding="utf-8")))
+        except (OSError, LircdConfError) as e:
+            logger.error(f"could not read {path}: {e}")
+    for remote in remotes.values():
+        logger.info(
+            f"{remote.name}: {len(remote.buttons())} buttons,"
+            f" release {remote.release_us() / 1000:.0f} ms"
+        )
+    return RemoteTimings(remotes)
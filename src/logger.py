@@ -1,5 +1,7 @@
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 from lirc.exceptions import (
     LircdCommandFailureError,
@@ -20,10 +22,50 @@ CompoundException = (
 )
 
 LOG_FILE = "/tmp/volume_controller.log"
+
+# structured fields a record can carry via extra={...}; they are appended to
+# the line as key=value
+RECORD_FIELDS = ("device", "key_code", "action", "latency_ms")
+
+
+class StructuredFormatter(logging.Formatter):
+    def format(self, record):
+        message = super().format(record)
+        fields = [
+            f"{name}={getattr(record, name)}"
+            for name in RECORD_FIELDS
+            if getattr(record, name, None) is not None
+        ]
+        return " ".join([message, *fields]) if fields else message
+
+
 MY_HANDLER = RotatingFileHandler(
     LOG_FILE, mode="a", maxBytes=5 * 1024 * 1024, backupCount=2, encoding=None, delay=0
 )
 MY_HANDLER.setLevel(logging.DEBUG)
+MY_HANDLER.setFormatter(StructuredFormatter())
+
+# the event loop only puts records on this queue; the listener's thread owns the
+# file, so writes and rotation never block a key press
+LOG_QUEUE = queue.SimpleQueue()
+LISTENER = QueueListener(LOG_QUEUE, MY_HANDLER, respect_handler_level=True)
+LISTENER.start()
+atexit.register(LISTENER.stop)
+
 logger = logging.getLogger("root")
 logger.setLevel(logging.DEBUG)
-logger.addHandler(MY_HANDLER)
+logger.addHandler(QueueHandler(LOG_QUEUE))
+
+
+def get_logger(name: str) -> logging.Logger:
+    """A named child of the root logger, so its level can be set on its own."""
+    return logging.getLogger(name)
+
+
+def configure_levels(levels: dict[str, str]):
+    """Apply [logging.levels] from config.toml: logger name -> level name."""
+    for name, level in levels.items():
+        try:
+            get_logger(name).setLevel(level.upper())
+        except (ValueError, AttributeError):
+            logger.error(f"invalid log level for {name}: {level!r}")
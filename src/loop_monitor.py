@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import re
+
+from logger import get_logger
+from metrics import metrics
+from scheduler import Scheduler
+
+logger = get_logger(__name__)
+
+SAMPLE_SECONDS = 0.1
+STALL_SECONDS = 0.05
+# what asyncio logs, in debug mode, for a callback over slow_callback_duration
+SLOW_CALLBACK_MESSAGE = "Executing %s took %.3f seconds"
+# a task's repr names it: <Task pending name='Task-12' coro=<...>>
+TASK_NAME = re.compile(r"<Task \w+ name='([^']*)'")
+
+
+def coroutine_names(task: asyncio.Task) -> list[str]:
+    """Qualified names of the coroutines a task is suspended in, outermost first."""
+    names = []
+    coroutine = task.get_coro()
+    while coroutine is not None and hasattr(coroutine, "cr_code"):
+        names.append(coroutine.cr_code.co_qualname)
+        coroutine = coroutine.cr_await
+    return names
+
+
+class LoopMonitor:
+    """
+    Watches for the event loop being blocked, two ways:
+
+    - a sampler sleeps sample_seconds at a time and records how late it wakes
+      up (loop_lag_seconds), which catches a stall whatever caused it;
+    - with callbacks on, the loop runs in asyncio debug mode, which times every
+      callback and reports those past slow_callback_duration; each report is
+      blamed on its task: the Coordinator action the scheduler is running, and
+      the Remote method it is in.
+
+    Stalls of either kind above stall_seconds are logged and counted. Debug mode
+    has a cost of its own (every callback records where it was scheduled from),
+    so callback timing can be turned off and the sampler left on.
+    """
+
+    def __init__(
+        self,
+        scheduler: Scheduler,
+        sample_seconds=SAMPLE_SECONDS,
+        stall_seconds=STALL_SECONDS,
+        callbacks=True,
+    ):
+        self.scheduler = scheduler
+        self.sample_seconds = sample_seconds
+        self.stall_seconds = stall_seconds
+        self.callbacks = callbacks
+        self.max_lag = 0.0
+        self.lag_stalls = 0
+        # (action, method) -> [count, max seconds]
+        self.slow_callbacks: dict[tuple[str, str], list] = {}
+        # the loop's debug settings from before install()
+        self.restore = None
+
+    @classmethod
+    def from_config(cls, scheduler: Scheduler, monitor_config: dict):
+        return cls(
+            scheduler,
+            monitor_config.get("sample_seconds", SAMPLE_SECONDS),
+            monitor_config.get("stall_seconds", STALL_SECONDS),
+            monitor_config.get("callbacks", True),
+        )
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        if self.callbacks:
+            self.install(loop)
+        try:
+            while True:
+                expected = loop.time() + self.sample_seconds
+                await asyncio.sleep(self.sample_seconds)
+                lag = max(0.0, loop.time() - expected)
+                metrics.observe("loop_lag_seconds", lag)
+                self.max_lag = max(self.max_lag, lag)
+                if lag >= self.stall_seconds:
+                    self.lag_stalls += 1
+                    logger.warning(f"event loop woke up {lag * 1000:.0f} ms late")
+        finally:
+            self.uninstall(loop)
+
+    def install(self, loop: asyncio.AbstractEventLoop):
+        """Have the loop time its callbacks, and take its slow-callback warnings."""
+        if self.restore is not None:
+            return
+        self.restore = (loop.get_debug(), loop.slow_callback_duration)
+        loop.slow_callback_duration = self.stall_seconds
+        loop.set_debug(True)
+        logging.getLogger("asyncio").addFilter(self.filter)
+
+    def uninstall(self, loop: asyncio.AbstractEventLoop):
+        if self.restore is None:
+            return
+        logging.getLogger("asyncio").removeFilter(self.filter)
+        debug, loop.slow_callback_duration = self.restore
+        loop.set_debug(debug)
+        self.restore = None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Count asyncio's slow-callback warnings, and log them as ours instead."""
+        if record.msg != SLOW_CALLBACK_MESSAGE:
+            return True
+        description, took = record.args
+        self.slow_callback(description, took)
+        return False
+
+    def find_task(self, description: str) -> asyncio.Task | None:
+        match = TASK_NAME.match(description)
+        if match is None:
+            return None
+        current = self.scheduler.current_task
+        if current is not None and current.get_name() == match[1]:
+            return current
+        return next((t for t in asyncio.all_tasks() if t.get_name() == match[1]), None)
+
+    def blame(self, description: str) -> tuple[str, str]:
+        """(Coordinator action, Remote method or callback) a slow callback is in."""
+        task = self.find_task(description)
+        if task is None:
+            # a plain callback: <Handle name(args) at file:line>
+            return "-", description.removeprefix("<Handle ").split("(", 1)[0]
+        action = "-"
+        if task is self.scheduler.current_task:
+            action = self.scheduler.current_name
+        names = coroutine_names(task)
+        # it may have returned from the method that blocked; the outermost
+        # Remote method it is in is still the best lead
+        method = next((name for name in names if name.startswith("Remote.")), None)
+        if method is None:
+            method = names[-1] if names else task.get_name()
+        return action, method
+
+    def slow_callback(self, description: str, took: float):
+        action, method = self.blame(description)
+        metrics.observe("slow_callback_seconds", took, action=action, method=method)
+        entry = self.slow_callbacks.setdefault((action, method), [0, 0.0])
+        entry[0] += 1
+        entry[1] = max(entry[1], took)
+        logger.warning(
+            f"blocked the event loop for {took * 1000:.0f} ms: {method}",
+            extra={"action": action, "latency_ms": round(took * 1000, 1)},
+        )
+
+    def stats(self) -> dict:
+        return {
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "lag_stalls": self.lag_stalls,
+            "slow_callbacks": {
+                f"{action} {method}": {
+                    "count": count,
+                    "max_ms": round(longest * 1000, 1),
+                }
+                for (action, method), (count, longest) in self.slow_callbacks.items()
+            },
+        }
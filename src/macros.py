@@ -0,0 +1,183 @@
+import asyncio
+import traceback
+from enum import Enum
+from typing import NamedTuple
+
+from lircd_conf import RemoteTimings
+from logger import CompoundException, get_logger
+
+logger = get_logger(__name__)
+
+
+# MACRO STEPS
+class Press(NamedTuple):
+    remote: str
+    button: str
+    times: int = 1
+    # send the extra presses as lircd repeat frames of one SEND_ONCE instead of
+    # separate presses. Only for buttons where the device treats a held key the
+    # same as repeated presses: for remotes with a repeat code the device sees
+    # one long press, not `times` short ones.
+    as_repeats: bool = False
+
+
+class Hold(NamedTuple):
+    remote: str
+    button: str
+    seconds: float
+
+
+class Wait(NamedTuple):
+    seconds: float
+
+
+class Macro(NamedTuple):
+    name: str
+    steps: tuple
+    # run after the macro is cancelled, to leave the device in a known state
+    on_cancel: tuple = ()
+
+
+# COMPILED SCHEDULE
+class SendKind(Enum):
+    ONCE = "SEND_ONCE"
+    START = "SEND_START"
+    STOP = "SEND_STOP"
+
+
+class Send(NamedTuple):
+    # seconds from the start of the macro
+    at: float
+    kind: SendKind
+    remote: str
+    button: str
+    repeat_count: int = 0
+
+
+class Schedule(NamedTuple):
+    sends: tuple[Send, ...]
+    # expected wall-clock time, including the gap after the last command
+    duration: float
+
+
+def compile_steps(steps, timings: RemoteTimings) -> Schedule:
+    sends = []
+    at = 0.0
+    for step in steps:
+        if isinstance(step, Press):
+            if step.as_repeats:
+                repeat_count = step.times - 1
+                sends.append(
+                    Send(at, SendKind.ONCE, step.remote, step.button, repeat_count)
+                )
+                at += timings.spacing(step.remote, step.button, repeat_count)
+            else:
+                for _ in range(step.times):
+                    sends.append(Send(at, SendKind.ONCE, step.remote, step.button))
+                    at += timings.spacing(step.remote, step.button)
+        elif isinstance(step, Hold):
+            sends.append(Send(at, SendKind.START, step.remote, step.button))
+            at += step.seconds
+            sends.append(Send(at, SendKind.STOP, step.remote, step.button))
+            at += timings.release(step.remote)
+        elif isinstance(step, Wait):
+            at += step.seconds
+        else:
+            raise TypeError(f"unknown macro step: {step!r}")
+    return Schedule(tuple(sends), at)
+
+
+def log_failure(send: Send, future: asyncio.Future):
+    if future.cancelled() or future.exception() is None:
+        return
+    logger.error(
+        f"{send.kind.value} {send.remote} {send.button} failed: {future.exception()!r}"
+    )
+
+
+class MacroRunner:
+    """
+    Plays compiled macros through an AsyncLircClient.
+
+    Each command goes out at its scheduled offset without waiting for lircd to
+    answer the previous one; lircd handles a connection's commands in order, so
+    the sequence on air is unchanged but lircd round trips no longer add to the
+    macro's wall-clock time. Failed commands are logged, like
+    Remote.send_to_remote does, without stopping the rest of the macro.
+    """
+
+    def __init__(self, client, timings: RemoteTimings):
+        self.client = client
+        self.timings = timings
+        self.compiled: dict[str, Schedule] = {}
+
+    def schedule(self, macro: Macro) -> Schedule:
+        schedule = self.compiled.get(macro.name)
+        if schedule is None:
+            schedule = self.compiled[macro.name] = compile_steps(
+                macro.steps, self.timings
+            )
+        return schedule
+
+    def expected_duration(self, macro: Macro) -> float:
+        return self.schedule(macro).duration
+
+    def issue(self, send: Send) -> asyncio.Future:
+        if send.kind is SendKind.ONCE:
+            coroutine = self.client.send_once(
+                send.remote, send.button, send.repeat_count
+            )
+        elif send.kind is SendKind.START:
+            coroutine = self.client.send_start(send.remote, send.button)
+        else:
+            coroutine = self.client.send_stop(send.remote, send.button)
+        future = asyncio.ensure_future(coroutine)
+        future.add_done_callback(lambda done: log_failure(send, done))
+        return future
+
+    async def play(self, schedule: Schedule) -> bool:
+        """Returns whether every command was sent successfully."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        in_flight = []
+        held = None
+        try:
+            for send in schedule.sends:
+                delay = start + send.at - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                in_flight.append(self.issue(send))
+                held = send if send.kind is SendKind.START else None
+
+            remaining = start + schedule.duration - loop.time()
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+            results = await asyncio.gather(*in_flight, return_exceptions=True)
+            return not any(isinstance(result, BaseException) for result in results)
+
+        except asyncio.CancelledError:
+            if held is not None:
+                try:
+                    await self.client.send_stop(held.remote, held.button)
+                except CompoundException:
+                    logger.error(traceback.format_exc())
+            raise
+
+    async def run(self, macro: Macro) -> bool:
+        schedule = self.schedule(macro)
+        logger.info(
+            f"{macro.name}: {len(schedule.sends)} IR commands,"
+            f" expected {schedule.duration:.1f}s"
+        )
+        try:
+            succeeded = await self.play(schedule)
+        except asyncio.CancelledError:
+            logger.info(f"{macro.name} was cancelled")
+            if macro.on_cancel:
+                try:
+                    await self.play(compile_steps(macro.on_cancel, self.timings))
+                except asyncio.CancelledError:
+                    logger.info(f"cleanup after {macro.name} was cancelled")
+            raise
+        logger.info(f"done with {macro.name}")
+        return succeeded
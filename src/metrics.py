@@ -0,0 +1,164 @@
+import asyncio
+import bisect
+import time
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+HISTOGRAMS = {
+    "key_input_seconds": (
+        "Kernel evdev timestamp to Coordinator.handle_keyboard_event."
+    ),
+    "key_dispatch_seconds": (
+        "Kernel evdev timestamp to the action's coroutine starting."
+    ),
+    "key_done_seconds": (
+        "Kernel evdev timestamp to the action finishing, backend replies included."
+    ),
+    "gesture_delay_seconds": (
+        "Key-down to a tap, double tap, long press or chord being dispatched:"
+        " the wait to tell gestures apart."
+    ),
+    "backend_seconds": (
+        "Request to acknowledgement per backend: lircd reply, QLC+ function status"
+        " read back, Home Assistant response."
+    ),
+    "loop_lag_seconds": (
+        "How late the event loop woke a sleeping task: time it was blocked."
+    ),
+    "slow_callback_seconds": (
+        "Event loop callbacks that ran past the stall threshold, by Coordinator action"
+        " and Remote method."
+    ),
+}
+
+
+def event_time(event) -> float:
+    """An evdev event's timestamp (CLOCK_REALTIME) on the time.monotonic() clock."""
+    age = time.time() - event.timestamp()
+    return time.monotonic() - max(0.0, age)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # per bucket, not cumulative; the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels)
+        + "}"
+    )
+
+
+class Metrics:
+    """Latency histograms keyed by name and labels, rendered as Prometheus text."""
+
+    def __init__(self):
+        self.histograms: dict[str, dict[tuple, Histogram]] = {
+            name: {} for name in HISTOGRAMS
+        }
+
+    def observe(self, name: str, seconds: float, **labels):
+        series = self.histograms[name]
+        key = tuple(sorted(labels.items()))
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(seconds)
+
+    def render(self) -> str:
+        lines = []
+        for name, series in self.histograms.items():
+            lines.append(f"# HELP {name} {HISTOGRAMS[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series.items():
+                cumulative = 0
+                bounds = [*map(str, histogram.buckets), "+Inf"]
+                for bound, count in zip(bounds, histogram.counts):
+                    cumulative += count
+                    bucket_labels = format_labels((*labels, ("le", bound)))
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+async def handle_scrape(reader, writer):
+    try:
+        # any request gets the metrics; read and ignore its head
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        body = metrics.render().encode("utf-8")
+        writer.write(
+            b"HTTP/1.0 200 OK\r\n"
+            b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            + f"Content-Length: {len(body)}\r\n\r\n".encode("ascii")
+            + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_metrics(metrics_config: dict):
+    """Serve /metrics on a localhost port or a unix socket, per [metrics] in config."""
+    try:
+        if metrics_config.get("socket"):
+            where = metrics_config["socket"]
+            server = await asyncio.start_unix_server(handle_scrape, where)
+        elif metrics_config.get("port"):
+            host = metrics_config.get("host", "127.0.0.1")
+            where = f"{host}:{metrics_config['port']}"
+            server = await asyncio.start_server(
+                handle_scrape, host, metrics_config["port"]
+            )
+        else:
+            return
+    except OSError as e:
+        # metrics are optional; never take key handling down with them
+        logger.error(f"could not serve metrics on {where}: {e}")
+        return
+    logger.info(f"serving metrics on {where}")
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,322 @@
+import asyncio
+import random
+import struct
+import time
+from collections import deque
+
+from logger import get_logger
+from metrics import metrics
+
+logger = get_logger(__name__)
+
+EISCP_PORT = 60128
+# "ISCP", header size, data size, version 1, 3 reserved bytes
+HEADER = struct.Struct(">4sIIB3x")
+# unit type 1: a receiver
+START = "!1"
+QUESTION = "QSTN"
+# answer to a command the receiver doesn't support, or can't run right now
+NOT_AVAILABLE = "N/A"
+RECONNECT_MIN_SECONDS = 0.5
+RECONNECT_MAX_SECONDS = 30.0
+# always read on connect, besides everything the config sets
+QUERIED = ("PWR", "MVL")
+# main, zone 2, 3 and 4 volumes count up from 0; channel levels are +/- around 0
+VOLUME_COMMANDS = {"MVL", "ZVL", "VL3", "VL4"}
+# volumes are two hex digits, and no receiver goes past 100
+MAX_VOLUME = 100
+# a channel level is a sign and one hex digit
+MAX_LEVEL = 0xF
+
+
+class OnkyoError(Exception):
+    pass
+
+
+def encode_message(message: str, end="\r") -> bytes:
+    """One ISCP message ("MVL2A") in an eISCP packet."""
+    data = f"{START}{message}{end}".encode("ascii")
+    return HEADER.pack(b"ISCP", HEADER.size, len(data), 1) + data
+
+
+async def read_message(reader: asyncio.StreamReader) -> str:
+    """The next ISCP message from an eISCP stream, without "!1" and end characters."""
+    magic, header_size, data_size, _ = HEADER.unpack(
+        await reader.readexactly(HEADER.size)
+    )
+    if magic != b"ISCP" or header_size < HEADER.size:
+        raise OnkyoError(f"not an eISCP packet: {magic!r}")
+    await reader.readexactly(header_size - HEADER.size)
+    data = (await reader.readexactly(data_size)).decode("ascii", "replace")
+    # receivers end with EOF, CR, LF or some of those; requests with CR
+    data = data.rstrip("\x1a\r\n")
+    if not data.startswith("!"):
+        raise OnkyoError(f"not an ISCP message: {data!r}")
+    return data[2:]
+
+
+def level_value(value: str) -> int:
+    """A volume or level parameter as a number: "2A" is 42, "+A" is 10, "-C" is -12."""
+    return int(value, 16)
+
+
+def level_range(command: str) -> range:
+    if command in VOLUME_COMMANDS:
+        return range(MAX_VOLUME + 1)
+    return range(-MAX_LEVEL, MAX_LEVEL + 1)
+
+
+def level_parameter(level: int, signed=False) -> str:
+    if not signed:
+        return f"{level:02X}"
+    if level == 0:
+        return "00"
+    return f"{'+' if level > 0 else '-'}{abs(level):X}"
+
+
+class OnkyoSession:
+    """
+    One long-lived eISCP (ISCP over TCP) connection to the receiver.
+
+    Every command is answered with the value it left ("MVL2A"), and the
+    receiver also reports changes made from its own remote or front panel, so
+    `values` follows the receiver while connected; listeners are called with
+    each report. Inputs, listening modes and the kitchen speakers are
+    configured as the ISCP commands that set them, which also tells which one
+    the receiver is in.
+
+    Not connected, or without a host, commands raise OnkyoError straight away
+    and Remote sends IR instead.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port=EISCP_PORT,
+        inputs: dict | None = None,
+        listening_modes: dict | None = None,
+        kitchen_speakers: dict | None = None,
+        levels: dict | None = None,
+        keepalive=30.0,
+        timeout=2.0,
+    ):
+        self.host = host
+        self.port = port
+        # name -> the commands that select it
+        self.inputs = {name: [f"SLI{code}"] for name, code in (inputs or {}).items()}
+        self.listening_modes = {
+            name: [f"LMD{code}"] for name, code in (listening_modes or {}).items()
+        }
+        # "on" / "off" -> commands, e.g. ["ZPW01", "ZVL28"]
+        self.kitchen_speakers = kitchen_speakers or {}
+        # name -> level command, e.g. zone2 = "ZVL", subwoofer = "SWL"
+        self.levels = levels or {}
+        self.keepalive = keepalive
+        self.timeout = timeout
+
+        self.writer = None
+        # command -> the receiver's last report, e.g. "MVL" -> "2A"
+        self.values: dict[str, str] = {}
+        # command -> futures waiting for its answer, oldest first
+        self.replies: dict[str, deque[asyncio.Future]] = {}
+        # called with (command, value) for every report
+        self.listeners = []
+        self.reconnects = 0
+        self.sent = 0
+
+    @classmethod
+    def from_config(cls, onkyo_config: dict):
+        return cls(
+            onkyo_config.get("host", ""),
+            onkyo_config.get("port", EISCP_PORT),
+            onkyo_config.get("inputs"),
+            onkyo_config.get("listening_modes"),
+            onkyo_config.get("kitchen_speakers"),
+            onkyo_config.get("levels"),
+            onkyo_config.get("keepalive", 30.0),
+            onkyo_config.get("timeout", 2.0),
+        )
+
+    def is_connected(self):
+        return self.writer is not None
+
+    def queried(self) -> set[str]:
+        configured = [
+            *self.inputs.values(),
+            *self.listening_modes.values(),
+            *self.kitchen_speakers.values(),
+        ]
+        commands = {message[:3] for messages in configured for message in messages}
+        return commands | set(self.levels.values()) | set(QUERIED)
+
+    async def run(self):
+        if not self.host:
+            return
+        backoff = RECONNECT_MIN_SECONDS
+        while True:
+            try:
+                async with asyncio.timeout(self.timeout):
+                    reader, self.writer = await asyncio.open_connection(
+                        self.host, self.port
+                    )
+                logger.info(f"connected to the receiver at {self.host}:{self.port}")
+                backoff = RECONNECT_MIN_SECONDS
+                await self.serve(reader)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                # like QlcSession: anything that ends the session means reconnect
+                logger.error(f"receiver session error: {e!r}")
+            finally:
+                await self.disconnect()
+
+            delay = backoff * random.uniform(0.5, 1.0)
+            logger.info(f"reconnecting to the receiver in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            backoff = min(backoff * 2, RECONNECT_MAX_SECONDS)
+            self.reconnects += 1
+
+    async def disconnect(self):
+        writer, self.writer = self.writer, None
+        for futures in self.replies.values():
+            for future in futures:
+                if not future.done():
+                    future.set_exception(OnkyoError("receiver connection lost"))
+                    # nobody may be waiting any more
+                    future.exception()
+        self.replies.clear()
+        # what the receiver was in is unknown until it reports again
+        self.values.clear()
+        if writer is not None:
+            writer.close()
+
+    async def serve(self, reader):
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(self.read_messages(reader))
+            tg.create_task(self.keep_alive())
+            await self.refresh()
+
+    async def refresh(self):
+        """Ask for everything configured, so `values` doesn't wait for changes."""
+        for command in sorted(self.queried()):
+            try:
+                await self.query(command)
+            except OnkyoError as e:
+                logger.warning(f"receiver: can't read {command}: {e}")
+
+    async def read_messages(self, reader):
+        while True:
+            message = await read_message(reader)
+            command, value = message[:3], message[3:]
+            logger.debug(f"receiver: {message}")
+            if value != NOT_AVAILABLE:
+                self.values[command] = value
+                for listener in self.listeners:
+                    listener(command, value)
+            waiting = self.replies.get(command)
+            if waiting:
+                future = waiting.popleft()
+                if not future.done():
+                    future.set_result(value)
+
+    async def keep_alive(self):
+        # eISCP has no ping; a question it has to answer will do
+        while True:
+            await asyncio.sleep(self.keepalive)
+            try:
+                await self.query("PWR")
+            except OnkyoError as e:
+                # N/A still means it answered
+                if self.writer is None:
+                    raise
+                logger.debug(f"receiver keepalive: {e}")
+
+    async def send(self, message: str) -> str:
+        """Send one ISCP command ("SLI12", "MVLQSTN"); returns the receiver's answer."""
+        if self.writer is None:
+            raise OnkyoError("not connected to the receiver")
+        command, parameter = message[:3], message[3:]
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self.replies.setdefault(command, deque()).append(future)
+        self.writer.write(encode_message(message))
+        self.sent += 1
+        try:
+            # asyncio.timeout rather than wait_for, as in QlcSession.call
+            async with asyncio.timeout(self.timeout):
+                value = await future
+        except TimeoutError as e:
+            raise OnkyoError(f"{message}: no answer from the receiver") from e
+        if value == NOT_AVAILABLE:
+            raise OnkyoError(f"{message}: not available")
+        if parameter != QUESTION:
+            metrics.observe(
+                "backend_seconds",
+                time.monotonic() - started,
+                backend="onkyo",
+                command=command,
+            )
+        return value
+
+    async def send_all(self, messages: list[str]):
+        for message in messages:
+            await self.send(message)
+
+    async def query(self, command: str) -> str:
+        return await self.send(command + QUESTION)
+
+    def reported(self, choices: dict[str, list[str]]) -> str | None:
+        """The choice whose commands all match what the receiver last reported."""
+        for name, messages in choices.items():
+            if messages and all(
+                self.values.get(message[:3]) == message[3:] for message in messages
+            ):
+                return name
+        return None
+
+    def setting_range(self, name: str) -> range:
+        """Levels the volume ("volume") or a level from [onkyo.levels] can be set to."""
+        return level_range("MVL" if name == "volume" else self.levels[name])
+
+    async def volume(self) -> int:
+        return level_value(await self.query("MVL"))
+
+    async def set_volume(self, volume: int) -> int:
+        return await self.set_level_command("MVL", volume)
+
+    async def level(self, name: str) -> int:
+        return level_value(await self.query(self.levels[name]))
+
+    async def set_level(self, name: str, level: int) -> int:
+        return await self.set_level_command(self.levels[name], level)
+
+    async def set_level_command(self, command: str, level: int) -> int:
+        allowed = level_range(command)
+        if level not in allowed:
+            raise OnkyoError(
+                f"{command}: {level} is outside {allowed.start}..{allowed[-1]}"
+            )
+        signed = command not in VOLUME_COMMANDS
+        return level_value(await self.send(command + level_parameter(level, signed)))
+
+    def report(self) -> dict:
+        """What the receiver last reported, with configured codes by name."""
+        values = self.values
+        return {
+            "power": values["PWR"] == "01" if "PWR" in values else None,
+            "volume": level_value(values["MVL"]) if "MVL" in values else None,
+            "input": self.reported(self.inputs) or values.get("SLI"),
+            "listening_mode": self.reported(self.listening_modes) or values.get("LMD"),
+            "kitchen_speakers": self.reported(self.kitchen_speakers),
+            "levels": {
+                name: level_value(values[command])
+                for name, command in self.levels.items()
+                if command in values
+            },
+        }
+
+    def stats(self) -> dict:
+        return {
+            "connected": self.is_connected(),
+            "sent": self.sent,
+            "reconnects": self.reconnects,
+            "values": dict(self.values),
+        }
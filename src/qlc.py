@@ -0,0 +1,217 @@
+import asyncio
+import random
+import time
+from collections import deque
+
+import ws_client
+from logger import get_logger
+from metrics import metrics
+from ws_client import WebSocketError
+
+logger = get_logger(__name__)
+
+RECONNECT_MIN_SECONDS = 0.5
+RECONNECT_MAX_SECONDS = 30.0
+# recent key-press-to-ack latencies kept for stats()
+LATENCY_HISTORY = 200
+
+
+class SpotlightRequest:
+    def __init__(self, mode: str, requested_at=None):
+        self.mode = mode
+        self.requested_at = time.monotonic() if requested_at is None else requested_at
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class QlcSession:
+    """
+    One long-lived WebSocket session to QLC+ for spotlight modes.
+
+    set_mode() never waits on the network: it records the wanted mode and the
+    session sends it when it can. Only the latest request matters, so a mode
+    that hasn't been sent yet is replaced rather than queued behind. Each change
+    is acknowledged by reading the function status back, and the time from
+    request to ack is kept as the spotlight latency.
+    """
+
+    def __init__(self, host, port, path, modes: dict, keepalive=20.0, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.modes = modes
+        self.keepalive = keepalive
+        self.timeout = timeout
+
+        self.websocket = None
+        # QLC+ function name -> id, loaded on every connect
+        self.functions: dict[str, int] = {}
+        # outbound queue: at most the one latest mode change
+        self.pending: SpotlightRequest | None = None
+        self.wakeup = None
+        # API call name -> futures waiting for its reply, oldest first
+        self.replies: dict[str, deque[asyncio.Future]] = {}
+
+        self.latencies = deque(maxlen=LATENCY_HISTORY)
+        self.acked = 0
+        self.superseded = 0
+        self.reconnects = 0
+
+    def is_connected(self):
+        return self.websocket is not None
+
+    def set_mode(self, mode: str, requested_at=None) -> asyncio.Future | None:
+        """Queue a spotlight mode change. Returns None for an unknown mode."""
+        if mode not in self.modes:
+            return None
+
+        if self.pending is not None and not self.pending.future.done():
+            self.pending.future.set_result(False)
+            self.superseded += 1
+        self.pending = SpotlightRequest(mode, requested_at)
+        if self.wakeup is not None:
+            self.wakeup.set()
+        return self.pending.future
+
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        backoff = RECONNECT_MIN_SECONDS
+        while True:
+            try:
+                self.websocket = await ws_client.connect(
+                    self.host, self.port, self.path, self.timeout
+                )
+                logger.info(f"connected to QLC+ at {self.host}:{self.port}")
+                backoff = RECONNECT_MIN_SECONDS
+                await self.serve()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                # anything that ends the session (including an ExceptionGroup
+                # from serve's tasks) means reconnect; it must never take the
+                # rest of the service down with it
+                logger.error(f"QLC+ session error: {e!r}")
+            finally:
+                await self.disconnect()
+
+            # jitter so a restarting QLC+ isn't hit in lockstep
+            delay = backoff * random.uniform(0.5, 1.0)
+            logger.info(f"reconnecting to QLC+ in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            backoff = min(backoff * 2, RECONNECT_MAX_SECONDS)
+            self.reconnects += 1
+
+    async def disconnect(self):
+        websocket, self.websocket = self.websocket, None
+        for futures in self.replies.values():
+            for future in futures:
+                if not future.done():
+                    future.set_exception(WebSocketError("QLC+ connection lost"))
+                    # nobody may be waiting any more
+                    future.exception()
+        self.replies.clear()
+        if websocket is not None:
+            await websocket.close()
+
+    async def serve(self):
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(self.read_messages())
+            tg.create_task(self.keep_alive())
+            await self.load_functions()
+            # a change that was requested while disconnected, or cut off by the
+            # last disconnect, goes out as soon as we're back
+            if self.pending is not None and not self.pending.future.done():
+                self.wakeup.set()
+            tg.create_task(self.send_modes())
+
+    async def read_messages(self):
+        while True:
+            message = await self.websocket.recv()
+            fields = message.split("|")
+            if len(fields) < 2 or fields[0] != "QLC+API":
+                continue
+            waiting = self.replies.get(fields[1])
+            if waiting:
+                future = waiting.popleft()
+                if not future.done():
+                    future.set_result(fields[2:])
+
+    async def keep_alive(self):
+        while True:
+            await asyncio.sleep(self.keepalive)
+            await self.websocket.ping()
+            try:
+                async with asyncio.timeout(self.timeout):
+                    await self.websocket.pong_received.wait()
+            except TimeoutError as e:
+                raise WebSocketError("QLC+ stopped answering pings") from e
+
+    async def call(self, api: str, *args):
+        future = asyncio.get_running_loop().create_future()
+        self.replies.setdefault(api, deque()).append(future)
+        await self.websocket.send_text("|".join(["QLC+API", api, *map(str, args)]))
+        # not wait_for: on 3.11 it drops a cancellation that lands as the reply
+        # arrives, and send_modes would then wait forever in a cancelled TaskGroup
+        async with asyncio.timeout(self.timeout):
+            return await future
+
+    async def load_functions(self):
+        fields = await self.call("getFunctionsList")
+        self.functions = {
+            name: int(function_id)
+            for function_id, name in zip(fields[0::2], fields[1::2])
+        }
+
+    def function_id(self, mode: str) -> int | None:
+        target = self.modes[mode]
+        if isinstance(target, int):
+            return target
+        return self.functions.get(target)
+
+    async def send_modes(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            request = self.pending
+            if request is None or request.future.done():
+                continue
+            await self.apply(request)
+
+    async def apply(self, request: SpotlightRequest):
+        started = time.monotonic()
+        function_id = self.function_id(request.mode)
+        if function_id is None:
+            logger.error(f"Unknown spotlight mode: {request.mode}")
+            request.future.set_result(False)
+            return
+
+        # modes are exclusive: stop every other mode's function first
+        for mode in self.modes:
+            other = self.function_id(mode)
+            if other is not None and other != function_id:
+                await self.websocket.send_text(f"QLC+API|setFunctionStatus|{other}|0")
+        await self.websocket.send_text(f"QLC+API|setFunctionStatus|{function_id}|1")
+
+        # reading the status back confirms QLC+ has processed the change
+        await self.call("getFunctionStatus", function_id)
+        metrics.observe(
+            "backend_seconds",
+            time.monotonic() - started,
+            backend="qlc",
+            command="set_mode",
+        )
+        latency = time.monotonic() - request.requested_at
+        self.latencies.append(latency)
+        self.acked += 1
+        logger.info(f"spotlight: {request.mode} (acked after {latency * 1000:.1f} ms)")
+        if not request.future.done():
+            request.future.set_result(True)
+
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "connected": self.is_connected(),
+            "acked": self.acked,
+            "superseded": self.superseded,
+            "reconnects": self.reconnects,
+            "last_latency": self.latencies[-1] if self.latencies else None,
+            "p50_latency": latencies[len(latencies) // 2] if latencies else None,
+            "max_latency": latencies[-1] if latencies else None,
+        }
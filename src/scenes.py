@@ -0,0 +1,145 @@
+import asyncio
+from typing import NamedTuple
+
+from logger import get_logger
+from remote import Remote, Transport
+
+logger = get_logger(__name__)
+
+
+class Scene(NamedTuple):
+    name: str
+    # action names, as bound in keymap.toml
+    steps: tuple[str, ...]
+
+
+class StepTiming(NamedTuple):
+    action: str
+    transport: Transport
+    # seconds after the scene started
+    started: float
+    seconds: float
+    ok: bool
+
+    @property
+    def ended(self):
+        return self.started + self.seconds
+
+
+class SceneReport(NamedTuple):
+    scene: str
+    seconds: float
+    steps: tuple[StepTiming, ...]
+    # the chain of steps that decided how long the scene took
+    critical_path: tuple[StepTiming, ...]
+
+    def sequential_seconds(self):
+        return sum(step.seconds for step in self.steps)
+
+    def summary(self) -> dict:
+        return {
+            "seconds": round(self.seconds, 3),
+            "sequential_seconds": round(self.sequential_seconds(), 3),
+            "critical_path": [step.action for step in self.critical_path],
+            "steps": [
+                {
+                    "action": step.action,
+                    "transport": step.transport,
+                    "started_ms": round(step.started * 1000, 1),
+                    "ms": round(step.seconds * 1000, 1),
+                    "ok": step.ok,
+                }
+                for step in self.steps
+            ],
+        }
+
+
+def critical_path(chains: list[list[StepTiming]]) -> tuple[StepTiming, ...]:
+    finished = [chain for chain in chains if chain]
+    if not finished:
+        return ()
+    return tuple(max(finished, key=lambda chain: chain[-1].ended))
+
+
+class SceneRunner:
+    """
+    Runs a scene's steps across backends at once. IR steps share one emitter,
+    so they run one after another in a single chain, and so do receiver steps
+    that go over eISCP; each QLC+ or Home Assistant step runs alongside those
+    chains on its own, and a spotlight step counts as done when QLC+ acks it
+    (or fails after the QLC+ timeout). A scene takes about as long as its
+    longest chain, instead of the sum of every step.
+    """
+
+    def __init__(self, remote: Remote, make_coroutine):
+        self.remote = remote
+        self.make_coroutine = make_coroutine
+        # scene name -> report from its last complete run
+        self.reports: dict[str, SceneReport] = {}
+
+    async def run(self, scene: Scene) -> SceneReport:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+
+        async def step(name: str, transport: Transport) -> StepTiming:
+            begun = loop.time()
+            fallbacks = self.remote.receiver_fallbacks
+            try:
+                # actions return False when a send failed; None is fine, and a
+                # spotlight change returns the ack for this step's own request
+                result = await self.make_coroutine(name)
+                ok = result is not False
+                if isinstance(result, asyncio.Future):
+                    # shielded: giving up here mustn't withdraw the change
+                    async with asyncio.timeout(self.remote.qlc.timeout):
+                        ok = await asyncio.shield(result)
+            except TimeoutError:
+                logger.error(f"scene {scene.name}: {name}: no ack from QLC+")
+                ok = False
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                # one backend failing shouldn't stop the others
+                logger.error(f"scene {scene.name}: {name} failed: {e!r}")
+                ok = False
+            if (
+                transport is Transport.ONKYO
+                and self.remote.receiver_fallbacks != fallbacks
+            ):
+                # eISCP failed and it went over IR
+                transport = Transport.IR
+            return StepTiming(name, transport, begun - start, loop.time() - begun, ok)
+
+        async def chain(steps) -> list[StepTiming]:
+            return [await step(name, transport) for name, transport in steps]
+
+        planned = [(name, self.remote.transport(name)) for name in scene.steps]
+        # one device each, in scene order
+        serial = [
+            [(name, transport) for name, transport in planned if transport is shared]
+            for shared in (Transport.IR, Transport.ONKYO)
+        ]
+        logger.info(f"scene {scene.name}: {', '.join(scene.steps)}")
+        async with asyncio.TaskGroup() as tg:
+            chains = [tg.create_task(chain(steps)) for steps in serial if steps]
+            chains += [
+                tg.create_task(chain([(name, transport)]))
+                for name, transport in planned
+                if transport not in (Transport.IR, Transport.ONKYO)
+            ]
+        chains = [task.result() for task in chains]
+
+        steps = tuple(
+            sorted((timing for c in chains for timing in c), key=lambda t: t.started)
+        )
+        report = SceneReport(
+            scene.name, loop.time() - start, steps, critical_path(chains)
+        )
+        self.reports[scene.name] = report
+        logger.info(
+            f"scene {scene.name}: {report.seconds:.2f}s"
+            f" ({report.sequential_seconds():.2f}s one after another), critical path: "
+            + " -> ".join(
+                f"{t.action} ({t.transport}, {t.seconds * 1000:.0f} ms)"
+                for t in report.critical_path
+            )
+        )
+        return report
@@ -0,0 +1,203 @@
+import asyncio
+import time
+from enum import IntEnum
+from typing import NamedTuple
+
+from action_queue import (
+    PRESSED_AT,
+    ActionQueue,
+    ActionResult,
+    Coalesce,
+    Status,
+    resolve,
+)
+from logger import get_logger
+from metrics import metrics
+
+logger = get_logger(__name__)
+
+# pending key presses per input device and lane, beyond the one that is running
+QUEUE_MAX_LENGTH = 8
+# the interactive lane carries key releases, which must never be dropped
+INTERACTIVE_QUEUE_MAX_LENGTH = 64
+# an action can carry a value after this ("receiver:volume=40"); it's scheduled
+# by the policy of the name before it, so a newer value supersedes a queued one
+VALUE_SEPARATOR = "="
+
+
+class Priority(IntEnum):
+    # volume and pause: run next, and preempt a running macro
+    INTERACTIVE = 0
+    # short one-shot commands
+    NORMAL = 1
+    # long IR menu navigation
+    MACRO = 2
+
+
+class ActionPolicy(NamedTuple):
+    priority: Priority
+    coalesce: Coalesce = Coalesce.NONE
+    group: str | None = None
+    # only applies to the interactive lane
+    preempt: bool = True
+
+
+class Scheduler:
+    """
+    Runs queued actions one at a time, lowest priority lane first and oldest press
+    first within a lane. An interactive action arriving while a macro runs cancels
+    the macro; the macro's own CancelledError handling is responsible for leaving
+    the equipment in a sane state.
+    """
+
+    def __init__(self, policies: dict[str, ActionPolicy], make_coroutine):
+        self.policies = policies
+        self.make_coroutine = make_coroutine
+        self.lanes: dict[Priority, dict[str, ActionQueue]] = {
+            priority: {} for priority in Priority
+        }
+        self.current_task = None
+        self.current_name = None
+        self.current_priority = None
+        # created by run, since main() may restart the event loop
+        self.ready = None
+
+    def is_busy(self):
+        return self.current_task is not None and not self.current_task.done()
+
+    def queue(self, priority: Priority, device: str) -> ActionQueue:
+        queues = self.lanes[priority]
+        queue = queues.get(device)
+        if queue is None:
+            max_length = (
+                INTERACTIVE_QUEUE_MAX_LENGTH
+                if priority is Priority.INTERACTIVE
+                else QUEUE_MAX_LENGTH
+            )
+            queue = queues[device] = ActionQueue(device, max_length)
+        return queue
+
+    def submit(
+        self,
+        name: str,
+        device: str,
+        pressed_at=None,
+        waiter: asyncio.Future | None = None,
+    ) -> bool:
+        """Queue an action; `waiter`, if given, gets its ActionResult."""
+        policy = self.policies[name.partition(VALUE_SEPARATOR)[0]]
+        if not self.queue(policy.priority, device).push(
+            name, policy.coalesce, policy.group, pressed_at, waiter
+        ):
+            logger.info(
+                f"{device} {policy.priority.name} queue is full, dropping {name}"
+            )
+            return False
+
+        if (
+            policy.priority is Priority.INTERACTIVE
+            and policy.preempt
+            and self.current_priority is Priority.MACRO
+        ):
+            self.cancel_current(f"preempted by {name}")
+
+        if self.ready is not None:
+            self.ready.set()
+        return True
+
+    def cancel_current(self, reason="cancelled"):
+        # a second cancel would interrupt the task's own cleanup
+        if self.is_busy() and not self.current_task.cancelling():
+            logger.info(f"cancelling {self.current_name}: {reason}")
+            self.current_task.cancel()
+
+    def cancel_all(self):
+        """Cancel the running action and forget queued ones. Key releases still run."""
+        for priority in (Priority.NORMAL, Priority.MACRO):
+            for queue in self.lanes[priority].values():
+                queue.clear()
+        self.cancel_current()
+
+    def next_action(self):
+        for priority in Priority:
+            heads = [queue for queue in self.lanes[priority].values() if queue]
+            if heads:
+                # oldest pending press across all devices
+                return priority, min(heads, key=lambda queue: queue.peek().enqueued_at)
+        return None, None
+
+    async def run(self):
+        self.ready = asyncio.Event()
+        while True:
+            priority, queue = self.next_action()
+            if queue is None:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+
+            item = queue.pop()
+            logger.info(
+                f"running {item.name} ({len(queue)} still queued)",
+                extra={
+                    "device": item.device,
+                    "action": item.name,
+                    "latency_ms": round(queue.last_wait * 1000, 1),
+                },
+            )
+            metrics.observe(
+                "key_dispatch_seconds",
+                time.monotonic() - item.pressed_at,
+                action=item.name,
+            )
+            self.current_name = item.name
+            self.current_priority = priority
+            started = time.monotonic()
+            error = None
+            PRESSED_AT.set(item.pressed_at)
+            try:
+                coroutine = self.make_coroutine(item.name)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                # a bad action fails its press instead of stopping the scheduler
+                error = e
+            else:
+                self.current_task = asyncio.create_task(coroutine)
+                await asyncio.wait([self.current_task])
+                if not self.current_task.cancelled():
+                    error = self.current_task.exception()
+            self.current_priority = None
+
+            if error is not None:
+                status = Status.FAILED
+                logger.error(f"{item.name} failed: {error!r}", exc_info=error)
+            elif self.current_task.cancelled():
+                status = Status.CANCELLED
+                logger.info(f"{item.name} was cancelled")
+            else:
+                status = Status.DONE
+                # from key press to done, including time spent queued
+                latency = time.monotonic() - item.pressed_at
+                metrics.observe("key_done_seconds", latency, action=item.name)
+                logger.debug(
+                    f"finished {item.name}",
+                    extra={
+                        "device": item.device,
+                        "action": item.name,
+                        "latency_ms": round(latency * 1000, 1),
+                    },
+                )
+            resolve(
+                item.waiters,
+                ActionResult(
+                    item.name,
+                    status,
+                    started - item.pressed_at,
+                    time.monotonic() - started,
+                ),
+            )
+
+    def stats(self):
+        return {
+            f"{priority.name.lower()}/{device}": queue.stats()
+            for priority, queues in self.lanes.items()
+            for device, queue in queues.items()
+        }
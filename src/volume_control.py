@@ -1,121 +1,203 @@
-import asyncio
 import time
 
-import evdev
-import lirc
+# before anything else is imported, for --profile-startup
+STARTED = time.perf_counter()
+
+# pylint: disable=wrong-import-position
+import argparse
+import asyncio
+import signal
+from pathlib import Path
+
+from config import config
+from control_api import serve_control
 from coordinator import Coordinator
-from logger import logger
+from device_state import STATE_FILE, DeviceState
+from devices import DeviceSupervisor
+from diagnostics import Diagnostics
+from home_assistant import HomeAssistant
+from ir_tx import LIRC_TX_DEVICE, DirectIrClient, render_remotes
+from lircd import AsyncLircClient
+from lircd_conf import load_remote_timings
+from loop_monitor import LoopMonitor
+from logger import CompoundException, configure_levels, logger
+from metrics import serve_metrics
+from onkyo import OnkyoSession
+from qlc import QlcSession
 from remote import Remote
 
-# other constants
-RETRY_TIME_SECONDS = 5
+IMPORTED = time.perf_counter()
 
+# how long backends wait for the input devices present at startup to attach
+ATTACH_WAIT_SECONDS = 1.0
 
-def custom_exception_handler(loop, context):
-    # first, handle with default handler
-    loop.default_exception_handler(context)
 
-    exception = context.get("exception")
-    logger.info("IN THE HANDLER, HERE'S THE EXCEPTION (type first, then exception):")
-    logger.info(type(exception))
-    logger.exception(exception)
+class StartupProfile:
+    """
+    --profile-startup: seconds from process start to each startup milestone,
+    reported when the first key event is read.
+    """
 
-    if isinstance(exception, OSError):
-        logger.info(context)
-        logger.info(
-            "the above printed error is an OSError,"
-            + " which is probably the keyboard being disconnected"
-        )
-        loop.stop()
+    def __init__(self):
+        self.marks = {"imports": IMPORTED - STARTED}
+        self.first_event = asyncio.Event()
 
-    logger.info("DONE WITH HANDLER")
+    def mark(self, name: str):
+        self.marks.setdefault(name, time.perf_counter() - STARTED)
 
+    def watch(self, coordinator: Coordinator, supervisor: DeviceSupervisor):
+        supervisor.attach_listeners.append(
+            lambda name, path: self.mark("first device attached")
+        )
+        handle_keyboard_event = coordinator.handle_keyboard_event
 
-async def handle_events(device: evdev.InputDevice, coordinator: Coordinator):
-    async for event in device.async_read_loop():
-        if event.type == evdev.ecodes.ecodes["EV_KEY"]:
-            coordinator.handle_keyboard_event(event)
+        def first_event(event, device):
+            self.mark("first key event")
+            self.first_event.set()
+            handle_keyboard_event(event, device)
 
+        coordinator.handle_keyboard_event = first_event
 
-async def listen_to_keyboard_events(coordinator):
+    def report(self):
+        lines = ["startup profile (seconds since process start):"]
+        lines += [f"  {name:<24}{seconds:8.3f}" for name, seconds in self.marks.items()]
+        connect = self.marks.get(
+            "lircd connect failed", self.marks.get("lircd connected")
+        )
+        if connect is not None:
+            took = connect - self.marks["lircd connecting"]
+            lines.append(
+                f"  lircd connect took {took:.3f}s, alongside the device readers"
+            )
+        print("\n".join(lines), flush=True)
+
+
+async def warm_backends(coordinator, supervisor, profile=None):
+    """Connect the backends once the keypads are attached, so they come up first."""
+    await supervisor.wait_attached(ATTACH_WAIT_SECONDS)
+    if profile:
+        profile.mark("startup devices settled")
+        profile.mark("lircd connecting")
+    # connect before the first key press needs it; if lircd isn't up yet, the
+    # client retries on the first send
+    try:
+        await coordinator.remote.client.connect()
+    except CompoundException as e:
+        logger.error(e)
+        if profile:
+            profile.mark("lircd connect failed")
+    else:
+        if profile:
+            profile.mark("lircd connected")
+
+
+async def listen_to_keyboard_events(coordinator, profile=None):
     logger.info("starting asyncio event loop")
+    if profile:
+        profile.mark("event loop")
+
+    # input devices are named in keymap.toml and attached as they appear
+    grab = config.get("input", {}).get("grab", False)
+    supervisor = DeviceSupervisor(coordinator, grab=grab)
+    if profile:
+        profile.watch(coordinator, supervisor)
+    # `kill -USR1 <pid>` writes a diagnostics file without stopping anything
+    diagnostics = Diagnostics.from_config(
+        coordinator.status, config.get("diagnostics", {})
+    )
+    asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, diagnostics.request)
+
+    monitor_config = config.get("loop_monitor", {})
+    if monitor_config.get("enabled", True):
+        coordinator.loop_monitor = LoopMonitor.from_config(
+            coordinator.scheduler, monitor_config
+        )
 
     async with asyncio.TaskGroup() as tg:
-        for path_to_device in [
-            # old 6 key
-            # "/dev/input/by-id/usb-1189_8890-event-if02",
-            # "/dev/input/by-id/usb-1189_8890-if02-event-kbd",
-            # "/dev/input/by-id/usb-1189_8890-event-kbd",
-            # "/dev/input/by-id/usb-1189_8890-if03-event-mouse",
-            # wireless numpad
-            "/dev/input/by-id/usb-MOSART_Semi._2.4G_Keyboard_Mouse-event-kbd",  # good
-            # "/dev/input/by-id/usb-MOSART_Semi._2.4G_Keyboard_Mouse-if01-event-mouse",  # good (probably unnecessary)
-            # "/dev/input/by-id/usb-MOSART_Semi._2.4G_Keyboard_Mouse-event-if01",  # good (probably unnecessary)
-            # "/dev/input/by-id/usb-MOSART_Semi._2.4G_Keyboard_Mouse-if01-mouse", # breaks
-            # new 2 key macropad
-            "/dev/input/by-id/usb-5131_FQ-K002_RGB-event-kbd",
-            # "/dev/input/by-id/usb-5131_FQ-K002_RGB-if01-event-mouse",
-            # "/dev/input/by-id/usb-5131_FQ-K002_RGB-if01-mouse",
-            # "/dev/input/by-id/usb-5131_FQ-K002_RGB-if02-event-joystick",
-            # "/dev/input/by-id/usb-5131_FQ-K002_RGB-if02-joystick",
-        ]:
-            tg.create_task(
-                handle_events(evdev.InputDevice(path_to_device), coordinator)
-            )
+        # readers first: a press queues until lircd is connected, which beats
+        # the keypad being dead while the backends start
+        tg.create_task(supervisor.run())
+        tg.create_task(coordinator.run_queued_actions())
+        tg.create_task(warm_backends(coordinator, supervisor, profile))
+        tg.create_task(coordinator.remote.qlc.run())
+        tg.create_task(coordinator.remote.onkyo.run())
+        tg.create_task(coordinator.watch_keymap())
+        tg.create_task(serve_metrics(config.get("metrics", {})))
+        tg.create_task(
+            serve_control(coordinator, config.get("control", {}), diagnostics)
+        )
+        if coordinator.loop_monitor:
+            tg.create_task(coordinator.loop_monitor.run())
 
-    # loop = asyncio.get_event_loop()
-    # loop.set_exception_handler(custom_exception_handler)
-    # loop.run_forever()
-    logger.info(
-        "if we get here, that means we gracefully caught an exception in"
-        + "custom_exception_handler. we can let this function return"
-    )
+
+async def profile_startup(coordinator, profile: StartupProfile):
+    service = asyncio.create_task(listen_to_keyboard_events(coordinator, profile))
+    print("press a bound key to finish the startup profile", flush=True)
+    waiting = asyncio.create_task(profile.first_event.wait())
+    await asyncio.wait([service, waiting], return_when=asyncio.FIRST_COMPLETED)
+    waiting.cancel()
+    service.cancel()
+    await asyncio.gather(service, return_exceptions=True)
+    profile.report()
 
 
 def main():
+    parser = argparse.ArgumentParser(
+        description="Keypad to IR/lighting control service"
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="report how long startup took up to the first key event, then exit",
+    )
+    args = parser.parse_args()
+
+    configure_levels(config.get("logging", {}).get("levels", {}))
     logger.info("--------------------------------------------")
     logger.info("starting up volume control server")
-    lirc_client = lirc.Client()
-    remote = Remote(lirc_client)
-    coordinator = Coordinator(remote)
-
-    while True:
-        try:
-            asyncio.run(listen_to_keyboard_events(coordinator))
-        except ExceptionGroup as e_group:
-            logger.info("caught ExceptionGroup. parsing")
-
-            if len(e_group.exceptions) < 1:
-                logger.info("caught empty ExceptionGroup. quitting")
-                logger.exception(e_group)
-                break
-
-            e = e_group.exceptions[0]  # pylint: disable=unsubscriptable-object
-
-            if isinstance(e, FileNotFoundError):
-                logger.info(
-                    "caught FileNotFoundError, that probably means"
-                    + "the keyboard was unplugged at startup:"
-                )
-                logger.exception(e)
-                logger.info(
-                    f"waiting {RETRY_TIME_SECONDS} seconds and then trying again"
-                )
-                time.sleep(RETRY_TIME_SECONDS)
-            if isinstance(e, OSError):
-                logger.info(
-                    "caught OSError, that probably means the keyboard got unplugged:"
-                )
-                logger.exception(e)
-                logger.info(
-                    f"waiting {RETRY_TIME_SECONDS} seconds and then trying again"
-                )
-                time.sleep(RETRY_TIME_SECONDS)
-            else:
-                logger.info(e)
-                logger.info("caught some other type of error. quitting")
-                logger.exception(e)
-                break
+    timings = load_remote_timings()
+    ir_config = config.get("ir", {})
+    if ir_config.get("backend", "lircd") == "direct":
+        lirc_client = DirectIrClient(
+            render_remotes(timings.remotes), ir_config.get("device", LIRC_TX_DEVICE)
+        )
+    else:
+        lirc_client = AsyncLircClient()
+    qlc_config = config["qlcplus"]
+    qlc = QlcSession(
+        qlc_config["host"],
+        qlc_config["port"],
+        qlc_config["path"],
+        qlc_config["modes"],
+        qlc_config["keepalive"],
+        qlc_config["timeout"],
+    )
+    home_assistant = HomeAssistant.from_config(config["home_assistant"])
+    state = DeviceState.load(Path(config.get("state", {}).get("file", STATE_FILE)))
+    remote = Remote(
+        lirc_client,
+        qlc,
+        home_assistant,
+        timings,
+        config.get("volume", {}),
+        state,
+        OnkyoSession.from_config(config.get("onkyo", {})),
+    )
+    coordinator = Coordinator(remote, scenes=config.get("scenes", {}))
+
+    if args.profile_startup:
+        profile = StartupProfile()
+        profile.mark("setup")
+        asyncio.run(profile_startup(coordinator, profile))
+        return
+
+    # devices coming and going are handled inside the loop; anything that
+    # escapes it is a bug, so log it and let systemd restart the service
+    try:
+        asyncio.run(listen_to_keyboard_events(coordinator))
+    except Exception as e:
+        logger.exception(e)
+        raise
 
 
 if __name__ == "__main__":
@@ -0,0 +1,156 @@
+import asyncio
+from typing import NamedTuple
+
+from lircd_conf import RemoteTimings
+from logger import CompoundException, get_logger
+
+logger = get_logger(__name__)
+
+
+class RampCurve(NamedTuple):
+    # seconds between the first and second step; later gaps shrink by
+    # `acceleration` per step, down to min_interval
+    initial_interval: float = 0.4
+    min_interval: float = 0.12
+    acceleration: float = 0.7
+    # after holding this long, switch to lircd's continuous repeat, the fastest
+    # ramp the receiver does; 0 never switches
+    continuous_after: float = 2.0
+
+
+class VolumeRamp:
+    """
+    Turns a held volume key into IR: one step on key-down, more steps at a
+    quickening pace, then a continuous SEND_START once the curve is at speed.
+
+    The ramp runs in its own task, so the key release (or anything else) can
+    stop it at any point. A watchdog ends it if the key stops autorepeating
+    without a release arriving, and max_hold_seconds caps any single hold.
+    """
+
+    def __init__(
+        self,
+        client,
+        timings: RemoteTimings,
+        curve=RampCurve(),
+        watchdog_seconds=0.75,
+        max_hold_seconds=10.0,
+    ):
+        self.client = client
+        self.timings = timings
+        self.curve = curve
+        self.watchdog_seconds = watchdog_seconds
+        self.max_hold_seconds = max_hold_seconds
+
+        self.task = None
+        self.button = None
+        self.last_heartbeat = 0.0
+        self.watchdog_releases = 0
+
+    @classmethod
+    def from_config(cls, client, timings: RemoteTimings, volume_config: dict):
+        curve = RampCurve(
+            **{
+                field: volume_config[field]
+                for field in RampCurve._fields
+                if field in volume_config
+            }
+        )
+        return cls(
+            client,
+            timings,
+            curve,
+            volume_config.get("watchdog_seconds", 0.75),
+            volume_config.get("max_hold_seconds", 10.0),
+        )
+
+    def is_holding(self):
+        return self.task is not None and not self.task.done()
+
+    def start(self, remote: str, button: str):
+        if self.is_holding():
+            return
+        self.button = (remote, button)
+        self.last_heartbeat = asyncio.get_running_loop().time()
+        self.task = asyncio.create_task(self.ramp(remote, button))
+
+    def heartbeat(self):
+        """The held key is still down (an autorepeat event arrived)."""
+        if self.is_holding():
+            self.last_heartbeat = asyncio.get_running_loop().time()
+
+    async def stop(self):
+        task = self.task
+        if task is None or task.done():
+            return
+        task.cancel()
+        # wait for the ramp to release the button before anything else is sent
+        await asyncio.wait([task])
+
+    def watchdog_deadline(self):
+        if not self.watchdog_seconds:
+            return None
+        return self.last_heartbeat + self.watchdog_seconds
+
+    async def ramp(self, remote: str, button: str):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        spacing = self.timings.spacing(remote, button)
+        interval = max(self.curve.initial_interval, spacing)
+        continuous = False
+        steps = 0
+        try:
+            while True:
+                now = loop.time()
+                deadline = self.watchdog_deadline()
+                if deadline is not None and now >= deadline:
+                    self.watchdog_releases += 1
+                    logger.warning(
+                        f"no repeat or release for {button}"
+                        f" in {self.watchdog_seconds}s, releasing it"
+                    )
+                    return
+                if now - started >= self.max_hold_seconds:
+                    logger.warning(
+                        f"held {button} for {self.max_hold_seconds}s, releasing it"
+                    )
+                    return
+
+                if continuous:
+                    wake = started + self.max_hold_seconds
+                elif (
+                    self.curve.continuous_after
+                    and now - started >= self.curve.continuous_after
+                ):
+                    # before awaiting: cancelled while lircd answers the START,
+                    # the STOP must still go out (the arbiter drops it if the
+                    # START never did)
+                    continuous = True
+                    await self.client.send_start(remote, button)
+                    continue
+                else:
+                    await self.client.send_once(remote, button)
+                    steps += 1
+                    wake = now + interval
+                    interval = max(
+                        self.curve.min_interval,
+                        spacing,
+                        interval * self.curve.acceleration,
+                    )
+
+                if deadline is not None:
+                    wake = min(wake, deadline)
+                await asyncio.sleep(max(0.0, wake - loop.time()))
+
+        except CompoundException as e:
+            logger.error(f"volume ramp for {button} failed: {e}")
+        finally:
+            if continuous:
+                try:
+                    await self.client.send_stop(remote, button)
+                except CompoundException as e:
+                    logger.error(f"releasing {button} failed: {e}")
+            logger.info(
+                f"released {button} after {loop.time() - started:.2f}s"
+                f" ({steps} steps{', then continuous' if continuous else ''})"
+            )
@@ -0,0 +1,161 @@
+import asyncio
+import base64
+import hashlib
+import os
+import struct
+
+# just enough of RFC 6455 for a client talking to QLC+: text messages, ping/pong
+# and close, no extensions
+
+HANDSHAKE_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+class WebSocketError(Exception):
+    pass
+
+
+class WebSocketClosed(WebSocketError):
+    pass
+
+
+def mask_payload(payload: bytes, mask: bytes) -> bytes:
+    if not payload:
+        return payload
+    repeated = (mask * (len(payload) // 4 + 1))[: len(payload)]
+    masked = int.from_bytes(payload, "big") ^ int.from_bytes(repeated, "big")
+    return masked.to_bytes(len(payload), "big")
+
+
+def encode_frame(opcode: int, payload: bytes, masked=True) -> bytes:
+    header = bytearray([0x80 | opcode])
+    mask_bit = 0x80 if masked else 0
+    length = len(payload)
+    if length < 126:
+        header.append(mask_bit | length)
+    elif length < 1 << 16:
+        header.append(mask_bit | 126)
+        header += struct.pack("!H", length)
+    else:
+        header.append(mask_bit | 127)
+        header += struct.pack("!Q", length)
+
+    if not masked:
+        return bytes(header) + payload
+    mask = os.urandom(4)
+    return bytes(header) + mask + mask_payload(payload, mask)
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    first, second = await reader.readexactly(2)
+    fin = bool(first & 0x80)
+    opcode = first & 0x0F
+    length = second & 0x7F
+    if length == 126:
+        (length,) = struct.unpack("!H", await reader.readexactly(2))
+    elif length == 127:
+        (length,) = struct.unpack("!Q", await reader.readexactly(8))
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = mask_payload(payload, mask)
+    return fin, opcode, payload
+
+
+class WebSocket:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        # set by recv() whenever a pong arrives, for keepalive checks
+        self.pong_received = asyncio.Event()
+
+    async def send(self, opcode: int, payload: bytes):
+        if self.writer.is_closing():
+            raise WebSocketClosed("connection is closed")
+        self.writer.write(encode_frame(opcode, payload))
+        await self.writer.drain()
+
+    async def send_text(self, text: str):
+        await self.send(OP_TEXT, text.encode("utf-8"))
+
+    async def ping(self, payload=b""):
+        self.pong_received.clear()
+        await self.send(OP_PING, payload)
+
+    async def recv(self) -> str:
+        """Return the next text message, answering pings along the way."""
+        fragments = []
+        while True:
+            try:
+                fin, opcode, payload = await read_frame(self.reader)
+            except asyncio.IncompleteReadError as e:
+                raise WebSocketClosed("connection closed by server") from e
+
+            if opcode == OP_PING:
+                await self.send(OP_PONG, payload)
+            elif opcode == OP_PONG:
+                self.pong_received.set()
+            elif opcode == OP_CLOSE:
+                self.writer.close()
+                raise WebSocketClosed("server closed the websocket")
+            else:
+                fragments.append(payload)
+                if fin:
+                    return b"".join(fragments).decode("utf-8", errors="replace")
+
+    async def close(self):
+        if not self.writer.is_closing():
+            try:
+                await self.send(OP_CLOSE, b"")
+            except (OSError, WebSocketError):
+                pass
+            self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+
+async def connect(host: str, port: int, path="/", timeout=5.0) -> WebSocket:
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(host, port), timeout
+    )
+    key = base64.b64encode(os.urandom(16)).decode("ascii")
+    request = (
+        f"GET {path} HTTP/1.1\r\n"
+        f"Host: {host}:{port}\r\n"
+        "Upgrade: websocket\r\n"
+        "Connection: Upgrade\r\n"
+        f"Sec-WebSocket-Key: {key}\r\n"
+        "Sec-WebSocket-Version: 13\r\n"
+        "\r\n"
+    )
+    try:
+        writer.write(request.encode("ascii"))
+        await writer.drain()
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+    except BaseException:
+        writer.close()
+        raise
+
+    status, *header_lines = head.decode("latin-1").split("\r\n")
+    headers = {}
+    for line in header_lines:
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    expected = base64.b64encode(
+        hashlib.sha1((key + HANDSHAKE_GUID).encode("ascii")).digest()
+    ).decode("ascii")
+    status_code = status.split(" ")[1] if " " in status else ""
+    if status_code != "101" or headers.get("sec-websocket-accept") != expected:
+        writer.close()
+        raise WebSocketError(f"websocket handshake with {host}:{port} failed: {status}")
+
+    return WebSocket(reader, writer)
@@ -0,0 +1,69 @@
+import asyncio
+
+from action_queue import ActionQueue, Coalesce, Status
+
+
+def test_fifo():
+    queue = ActionQueue("remote", 4)
+    for name in ["a", "b", "c"]:
+        assert queue.push(name)
+    assert [queue.pop().name for _ in range(3)] == ["a", "b", "c"]
+    assert queue.stats()["max_depth"] == 3
+
+
+def test_full_queue_drops():
+    async def main():
+        queue = ActionQueue("remote", 1)
+        waiter = asyncio.get_running_loop().create_future()
+        assert queue.push("a")
+        assert not queue.push("b", waiter=waiter)
+        assert waiter.result().status is Status.DROPPED
+        assert queue.dropped == 1
+        assert len(queue) == 1
+
+    asyncio.run(main())
+
+
+def test_toggle_cancels_queued_press():
+    async def main():
+        loop = asyncio.get_running_loop()
+        first, second = loop.create_future(), loop.create_future()
+        queue = ActionQueue("remote", 4)
+        queue.push("mute", Coalesce.TOGGLE, waiter=first)
+        queue.push("mute", Coalesce.TOGGLE, waiter=second)
+        assert len(queue) == 0
+        assert first.result().status is Status.COALESCED
+        assert second.result().status is Status.COALESCED
+        assert queue.coalesced == 2
+
+    asyncio.run(main())
+
+
+def test_latest_replaces_in_place():
+    async def main():
+        loop = asyncio.get_running_loop()
+        first, second = loop.create_future(), loop.create_future()
+        queue = ActionQueue("remote", 4)
+        queue.push("input_tv", Coalesce.LATEST, "input", waiter=first)
+        queue.push("other")
+        queue.push("input_cd", Coalesce.LATEST, "input", waiter=second)
+        assert first.result().status is Status.SUPERSEDED
+        assert not second.done()
+        item = queue.pop()
+        assert item.name == "input_cd"
+        assert item.waiters == [second]
+        assert queue.pop().name == "other"
+
+    asyncio.run(main())
+
+
+def test_clear_cancels_waiters():
+    async def main():
+        waiter = asyncio.get_running_loop().create_future()
+        queue = ActionQueue("remote", 4)
+        queue.push("a", waiter=waiter)
+        queue.clear()
+        assert waiter.result().status is Status.CANCELLED
+        assert queue.peek() is None
+
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from action_queue import Status
+from coordinator import Coordinator
+from home_assistant import HomeAssistant
+from keymap import KeymapError
+from lircd import AsyncLircClient
+from lircd_conf import RemoteTimings
+from onkyo import OnkyoSession
+from qlc import QlcSession
+from remote import Remote
+
+
+def make_coordinator(tmp_path, keymap="", scenes=None) -> Coordinator:
+    keymap_file = tmp_path / "keymap.toml"
+    keymap_file.write_text(keymap)
+    remote = Remote(
+        AsyncLircClient(str(tmp_path / "lircd")),
+        QlcSession("127.0.0.1", 9999, "/qlcplusWS", {}),
+        HomeAssistant("http://127.0.0.1:8123", "token", {}),
+        RemoteTimings({}),
+        onkyo=OnkyoSession.from_config({"levels": {"subwoofer": "SWL"}}),
+    )
+    return Coordinator(remote, keymap_file, scenes)
+
+
+def test_receiver_actions_need_a_level_in_range(tmp_path):
+    coordinator = make_coordinator(tmp_path)
+    for name in ["receiver:volume=0", "receiver:volume=100", "receiver:subwoofer=-15"]:
+        assert coordinator.is_known_action(name), name
+    for name in [
+        "receiver:volume",
+        "receiver:volume=",
+        "receiver:volume=101",
+        "receiver:volume=-1",
+        "receiver:volume=ten",
+        "receiver:subwoofer=16",
+        "receiver:treble=1",
+    ]:
+        assert not coordinator.is_known_action(name), name
+
+
+def test_keymap_rejects_receiver_action_without_a_level(tmp_path):
+    keymap = """
+[devices]
+remote = "usb-remote*"
+
+[bindings.remote]
+KEY_A = "receiver:volume"
+"""
+    with pytest.raises(KeymapError):
+        make_coordinator(tmp_path, keymap)
+
+
+def test_scene_with_receiver_action_without_a_level_is_skipped(tmp_path):
+    coordinator = make_coordinator(
+        tmp_path, scenes={"party": ["receiver:volume"], "quiet": ["receiver:volume=20"]}
+    )
+    assert list(coordinator.scenes) == ["quiet"]
+
+
+def test_bad_receiver_action_fails_its_press(tmp_path):
+    coordinator = make_coordinator(tmp_path)
+
+    async def main():
+        runner = asyncio.create_task(coordinator.run_queued_actions())
+        try:
+            async with asyncio.timeout(1):
+                return await coordinator.request("receiver:volume", "control")
+        finally:
+            runner.cancel()
+
+    result = asyncio.run(main())
+    assert result.status is Status.FAILED
+    assert not coordinator.scheduler.is_busy()
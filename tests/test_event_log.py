@@ -0,0 +1,74 @@
+import io
+
+import pytest
+from evdev import InputEvent, ecodes
+
+from event_log import EventLogError, EventLogWriter, LoggedEvent, read_event_log
+
+START = 1_700_000_000
+
+
+def key_event(seconds: float, code=ecodes.KEY_A, value=1):
+    sec = START + int(seconds)
+    return InputEvent(sec, round(seconds % 1 * 1_000_000), ecodes.EV_KEY, code, value)
+
+
+def round_trip(events) -> list[LoggedEvent]:
+    file = io.BytesIO()
+    writer = EventLogWriter(file)
+    for device, event in events:
+        writer.write(device, event)
+    file.seek(0)
+    return list(read_event_log(file))
+
+
+def test_round_trip():
+    logged = round_trip(
+        [
+            ("remote", key_event(0.0)),
+            ("keyboard", key_event(0.25, ecodes.KEY_B, 0)),
+            ("remote", key_event(0.5, value=2)),
+        ]
+    )
+    assert logged == [
+        LoggedEvent(START, "remote", ecodes.KEY_A, 1),
+        LoggedEvent(START + 0.25, "keyboard", ecodes.KEY_B, 0),
+        LoggedEvent(START + 0.5, "remote", ecodes.KEY_A, 2),
+    ]
+
+
+def test_long_gap():
+    # more than the 4295 s a key record's delta holds
+    logged = round_trip([("remote", key_event(0.0)), ("remote", key_event(10_000.0))])
+    assert logged[1].timestamp == START + 10_000
+
+
+def test_out_of_order_events_keep_time_moving_forward():
+    logged = round_trip([("a", key_event(1.0)), ("b", key_event(0.5))])
+    assert [event.timestamp for event in logged] == [START + 1, START + 1]
+
+
+def test_long_name_is_cut_on_a_character_boundary():
+    name = "é" * 200
+    (logged,) = round_trip([(name, key_event(0.0))])
+    assert logged.device == "é" * 127
+
+
+def test_too_many_devices():
+    writer = EventLogWriter(io.BytesIO())
+    for index in range(0x100):
+        writer.write(f"device {index}", key_event(0.0))
+    with pytest.raises(EventLogError):
+        writer.write("one more", key_event(0.0))
+
+
+def test_truncated_log():
+    file = io.BytesIO()
+    EventLogWriter(file).write("remote", key_event(0.0))
+    with pytest.raises(EventLogError):
+        list(read_event_log(io.BytesIO(file.getvalue()[:-1])))
+
+
+def test_not_an_event_log():
+    with pytest.raises(EventLogError):
+        list(read_event_log(io.BytesIO(b"something else entirely")))
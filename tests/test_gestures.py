@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+from action_queue import Coalesce
+from evdev import ecodes
+from gestures import GestureRecognizer
+from keymap import KEY_PRESS, KEY_RELEASE, compile_keymap
+from scheduler import ActionPolicy, Priority
+
+ACTIONS = {"tap", "double", "long", "chord", "b_tap"}
+TIMINGS = {"long_press_seconds": 0.05, "double_tap_seconds": 0.03}
+
+
+def make_keymap(bindings: dict):
+    return compile_keymap(
+        {
+            "devices": {"remote": "usb-remote*"},
+            "bindings": {"remote": bindings},
+            "gestures": TIMINGS,
+        },
+        ACTIONS,
+    )
+
+
+def run(keymap, presses, policies=None):
+    """Play (seconds to wait, key, value) presses; returns the actions dispatched."""
+    dispatched = []
+
+    async def main():
+        recognizer = GestureRecognizer(
+            lambda action, device, pressed_at: dispatched.append(action),
+            policies or {},
+        )
+        for wait, key, value in presses:
+            await asyncio.sleep(wait)
+            code = ecodes.ecodes[key]
+            recognizer.handle(keymap, "remote", code, value, time.monotonic())
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+    return dispatched
+
+
+ALL_GESTURES = {"KEY_A": {"tap": "tap", "double_tap": "double", "long_press": "long"}}
+
+
+def test_tap_waits_out_double_tap():
+    keymap = make_keymap(ALL_GESTURES)
+    assert run(keymap, [(0, "KEY_A", KEY_PRESS), (0, "KEY_A", KEY_RELEASE)]) == ["tap"]
+
+
+def test_double_tap():
+    keymap = make_keymap(ALL_GESTURES)
+    presses = [
+        (0, "KEY_A", KEY_PRESS),
+        (0, "KEY_A", KEY_RELEASE),
+        (0.01, "KEY_A", KEY_PRESS),
+        (0, "KEY_A", KEY_RELEASE),
+    ]
+    assert run(keymap, presses) == ["double"]
+
+
+def test_long_press_swallows_release():
+    keymap = make_keymap(ALL_GESTURES)
+    presses = [(0, "KEY_A", KEY_PRESS), (0.08, "KEY_A", KEY_RELEASE)]
+    assert run(keymap, presses) == ["long"]
+
+
+def test_chord():
+    keymap = make_keymap({"KEY_A": "tap", "KEY_B": "b_tap", "KEY_A+KEY_B": "chord"})
+    presses = [
+        (0, "KEY_A", KEY_PRESS),
+        (0, "KEY_B", KEY_PRESS),
+        (0, "KEY_A", KEY_RELEASE),
+        (0, "KEY_B", KEY_RELEASE),
+    ]
+    assert run(keymap, presses) == ["chord"]
+
+
+def test_key_in_chord_still_taps():
+    keymap = make_keymap({"KEY_A": "tap", "KEY_B": "b_tap", "KEY_A+KEY_B": "chord"})
+    presses = [(0, "KEY_A", KEY_PRESS), (0.01, "KEY_A", KEY_RELEASE)]
+    assert run(keymap, presses) == ["tap"]
+
+
+def test_same_group_tap_runs_on_key_down():
+    keymap = make_keymap(ALL_GESTURES)
+    policies = {
+        action: ActionPolicy(Priority.NORMAL, Coalesce.LATEST, "level")
+        for action in ("tap", "double", "long")
+    }
+    dispatched = []
+
+    async def main():
+        recognizer = GestureRecognizer(
+            lambda action, device, pressed_at: dispatched.append(action), policies
+        )
+        code = ecodes.KEY_A
+        recognizer.handle(keymap, "remote", code, KEY_PRESS, time.monotonic())
+        assert dispatched == ["tap"]
+        recognizer.handle(keymap, "remote", code, KEY_RELEASE, time.monotonic())
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+    assert dispatched == ["tap"]
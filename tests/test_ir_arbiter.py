@@ -0,0 +1,93 @@
+import asyncio
+
+from ir_arbiter import IrArbiter
+
+
+class FakeClient:
+    def __init__(self):
+        self.sent = []
+
+    async def send_once(self, remote, key, repeat_count=0):
+        self.sent.append(("once", remote, key))
+
+    async def send_start(self, remote, key):
+        self.sent.append(("start", remote, key))
+
+    async def send_stop(self, remote, key):
+        self.sent.append(("stop", remote, key))
+
+
+def run(scenario):
+    client = FakeClient()
+
+    async def main():
+        arbiter = IrArbiter(client)
+        await scenario(arbiter)
+        return arbiter
+
+    return client, asyncio.run(main())
+
+
+def test_other_remote_interleaves_with_hold():
+    async def scenario(arbiter):
+        await arbiter.send_start("onkyo", "VOL_UP")
+        await arbiter.send_once("adj", "BLACKOUT")
+        assert arbiter.held == ("onkyo", "VOL_UP")
+        await arbiter.send_stop("onkyo", "VOL_UP")
+
+    client, arbiter = run(scenario)
+    assert client.sent == [
+        ("start", "onkyo", "VOL_UP"),
+        ("stop", "onkyo", "VOL_UP"),
+        ("once", "adj", "BLACKOUT"),
+        ("start", "onkyo", "VOL_UP"),
+        ("stop", "onkyo", "VOL_UP"),
+    ]
+    assert arbiter.interleaved == 1
+    assert arbiter.held is None
+
+
+def test_same_remote_waits_for_release():
+    async def scenario(arbiter):
+        await arbiter.send_start("onkyo", "VOL_UP")
+        mute = asyncio.create_task(arbiter.send_once("onkyo", "MUTE"))
+        await asyncio.sleep(0)
+        assert not mute.done()
+        await arbiter.send_stop("onkyo", "VOL_UP")
+        await mute
+
+    client, arbiter = run(scenario)
+    assert client.sent == [
+        ("start", "onkyo", "VOL_UP"),
+        ("stop", "onkyo", "VOL_UP"),
+        ("once", "onkyo", "MUTE"),
+    ]
+    assert arbiter.deferred == 1
+
+
+def test_stop_for_another_button_is_ignored():
+    async def scenario(arbiter):
+        await arbiter.send_start("onkyo", "VOL_UP")
+        await arbiter.send_stop("onkyo", "VOL_DOWN")
+        assert arbiter.held == ("onkyo", "VOL_UP")
+
+    client, arbiter = run(scenario)
+    assert client.sent == [("start", "onkyo", "VOL_UP")]
+    assert arbiter.ignored_stops == 1
+
+
+def test_stop_cancels_waiting_start():
+    async def scenario(arbiter):
+        await arbiter.send_start("onkyo", "VOL_UP")
+        down = asyncio.create_task(arbiter.send_start("onkyo", "VOL_DOWN"))
+        await asyncio.sleep(0)
+        await arbiter.send_stop("onkyo", "VOL_DOWN")
+        await down
+        await arbiter.send_stop("onkyo", "VOL_UP")
+
+    client, arbiter = run(scenario)
+    assert client.sent == [
+        ("start", "onkyo", "VOL_UP"),
+        ("stop", "onkyo", "VOL_UP"),
+    ]
+    assert not arbiter.waiting
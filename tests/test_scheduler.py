@@ -0,0 +1,63 @@
+import asyncio
+
+from action_queue import Coalesce, Status
+from scheduler import ActionPolicy, Priority, Scheduler
+
+POLICIES = {
+    "volume_up": ActionPolicy(Priority.INTERACTIVE),
+    "input": ActionPolicy(Priority.NORMAL, Coalesce.LATEST, "input"),
+    "macro": ActionPolicy(Priority.MACRO),
+    "broken": ActionPolicy(Priority.NORMAL),
+}
+
+
+def run(make_coroutine, submitted: list[str]) -> list:
+    """Submit actions in order and return their ActionResults."""
+
+    async def main():
+        scheduler = Scheduler(POLICIES, make_coroutine)
+        runner = asyncio.create_task(scheduler.run())
+        loop = asyncio.get_running_loop()
+        waiters = []
+        for name in submitted:
+            waiters.append(loop.create_future())
+            scheduler.submit(name, "remote", waiter=waiters[-1])
+            await asyncio.sleep(0)
+        try:
+            async with asyncio.timeout(1):
+                return await asyncio.gather(*waiters)
+        finally:
+            runner.cancel()
+
+    return asyncio.run(main())
+
+
+def test_bad_action_fails_without_stopping_the_scheduler():
+    ran = []
+
+    def make_coroutine(name):
+        if name == "broken":
+            raise ValueError("no such action")
+        ran.append(name)
+        return asyncio.sleep(0)
+
+    results = run(make_coroutine, ["broken", "input"])
+    assert [result.status for result in results] == [Status.FAILED, Status.DONE]
+    assert ran == ["input"]
+
+
+def test_failing_coroutine():
+    async def fail():
+        raise OSError("lircd is gone")
+
+    (result,) = run(lambda name: fail(), ["input"])
+    assert result.status is Status.FAILED
+
+
+def test_interactive_press_preempts_macro():
+    async def action(name):
+        if name == "macro":
+            await asyncio.sleep(10)
+
+    results = run(action, ["macro", "volume_up"])
+    assert [result.status for result in results] == [Status.CANCELLED, Status.DONE]
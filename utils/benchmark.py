@@ -0,0 +1,468 @@
+"""
+Benchmarks the key-to-emit path: synthetic evdev events go through the real
+Coordinator, scheduler and Remote, talking to the local stand-ins for lircd,
+QLC+ and Home Assistant.
+
+    python utils/benchmark.py
+    python utils/benchmark.py --quick --lircd-delay 0.1 --ha-fail-rate 0.2
+    python utils/benchmark.py --compare .benchmarks/<earlier run>.json
+
+With --onkyo the receiver is driven over eISCP, against a stand-in receiver,
+with IR only as the fallback.
+
+Reports p50/p99 key-to-send latency per backend, macro wall time, the highest
+event rate the loop keeps up with, and event loop stalls. Each run is saved as
+JSON under .benchmarks/ (named by time and commit) so runs can be compared
+across commits.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import evdev  # noqa: E402
+from config import config  # noqa: E402
+from coordinator import Coordinator  # noqa: E402
+from fake_eiscp import FakeOnkyo  # noqa: E402
+from fake_home_assistant import FakeHomeAssistant  # noqa: E402
+from fake_lircd import FakeLircd  # noqa: E402
+from fake_qlcplus import FakeQlcPlus  # noqa: E402
+from home_assistant import HomeAssistant  # noqa: E402
+from lircd import AsyncLircClient  # noqa: E402
+from lircd_conf import load_remote_timings  # noqa: E402
+from logger import configure_levels  # noqa: E402
+from loop_monitor import LoopMonitor  # noqa: E402
+from onkyo import OnkyoSession  # noqa: E402
+from qlc import QlcSession  # noqa: E402
+from remote import Remote  # noqa: E402
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = REPO_DIR / ".benchmarks"
+DEVICE = "bench"
+
+# bindings used by the benchmark, independent of src/keymap.toml
+BENCH_KEYMAP = f"""
+[devices]
+{DEVICE} = "{DEVICE}"
+
+[bindings.{DEVICE}]
+KEY_P = "pause"
+KEY_R = "turn_disco_light_red"
+KEY_W = "turn_disco_light_white"
+KEY_D = "home_assistant:disco_ball"
+KEY_S = "toggle_surround_mode"
+KEY_T = "toggle_spotify_dark_mode"
+KEY_K = "turn_kitchen_speakers_on"
+KEY_L = "turn_kitchen_speakers_off"
+
+[bindings.{DEVICE}.KEY_UP]
+press = "start_holding_volume_up"
+repeat = "keep_holding_volume_button"
+release = "stop_holding_volume_button"
+"""
+
+MACRO_KEYS = {
+    "toggle_surround_mode (to all channel stereo)": "KEY_S",
+    "toggle_surround_mode (to direct)": "KEY_S",
+    "toggle_spotify_dark_mode": "KEY_T",
+    "turn_kitchen_speakers_on": "KEY_K",
+    "turn_kitchen_speakers_off": "KEY_L",
+}
+QUICK_MACROS = (
+    "toggle_surround_mode (to all channel stereo)",
+    "toggle_surround_mode (to direct)",
+)
+
+# [onkyo] for --onkyo; the kitchen speakers as if they were on zone 2
+BENCH_ONKYO = {
+    **config.get("onkyo", {}),
+    "host": "127.0.0.1",
+    "kitchen_speakers": {"on": ["ZPW01", "ZVL28"], "off": ["ZPW00"]},
+}
+
+# event rates tried for the sustained-rate test, per second
+EVENT_RATES = (100, 250, 500, 1000, 2500, 5000, 10000, 25000)
+# an event rate is sustained if handling lags the event's timestamp by less than this
+MAX_EVENT_LAG_SECONDS = 0.01
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(latencies):
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        "max_ms": round(max(latencies) * 1000, 3) if latencies else None,
+    }
+
+
+def key_event(name: str, value: int, timestamp=None):
+    timestamp = time.time() if timestamp is None else timestamp
+    sec = int(timestamp)
+    usec = int((timestamp - sec) * 1_000_000)
+    return evdev.InputEvent(
+        sec, usec, evdev.ecodes.EV_KEY, evdev.ecodes.ecodes[name], value
+    )
+
+
+def is_volume_step(command: str) -> bool:
+    # the first IR command of a held volume key, whichever way the ramp sends it
+    return command.startswith(
+        ("SEND_ONCE onkyo KEY_VOLUMEUP", "SEND_START onkyo KEY_VOLUMEUP")
+    )
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+class Bench:
+    """
+    The real Coordinator, scheduler and Remote wired to the stand-in servers.
+    keymap_file defaults to BENCH_KEYMAP.
+    """
+
+    def __init__(self, args, keymap_file=None):
+        self.args = args
+        self.keymap_file = keymap_file
+        self.tasks = []
+
+    async def start(self):
+        args = self.args
+        self.tmp = tempfile.TemporaryDirectory()
+        socket_path = os.path.join(self.tmp.name, "lircd.sock")
+        keymap_file = self.keymap_file
+        if keymap_file is None:
+            keymap_file = Path(self.tmp.name) / "keymap.toml"
+            keymap_file.write_text(BENCH_KEYMAP, encoding="utf-8")
+
+        self.lircd = await FakeLircd(
+            socket_path, args.lircd_delay, fail_rate=args.lircd_fail_rate
+        ).start()
+        self.qlc_server = await FakeQlcPlus(
+            delay=args.qlc_delay, fail_rate=args.qlc_fail_rate
+        ).start()
+        self.ha_server = await FakeHomeAssistant(
+            delay=args.ha_delay, token="bench", fail_rate=args.ha_fail_rate
+        ).start()
+
+        self.onkyo_server = None
+        onkyo = None
+        if args.onkyo:
+            self.onkyo_server = await FakeOnkyo(delay=args.onkyo_delay).start()
+            onkyo = OnkyoSession.from_config(
+                {**BENCH_ONKYO, "port": self.onkyo_server.port}
+            )
+
+        qlc_config = config["qlcplus"]
+        qlc = QlcSession(
+            "127.0.0.1", self.qlc_server.port, qlc_config["path"], qlc_config["modes"]
+        )
+        home_assistant = HomeAssistant(
+            f"http://127.0.0.1:{self.ha_server.port}",
+            "bench",
+            config["home_assistant"].get("services", {}),
+        )
+        remote = Remote(
+            AsyncLircClient(socket_path),
+            qlc,
+            home_assistant,
+            load_remote_timings(),
+            onkyo=onkyo,
+        )
+        self.coordinator = Coordinator(remote, keymap_file)
+        self.coordinator.loop_monitor = LoopMonitor(self.coordinator.scheduler)
+        self.tasks = [
+            asyncio.create_task(self.coordinator.loop_monitor.run()),
+            asyncio.create_task(qlc.run()),
+            asyncio.create_task(remote.onkyo.run()),
+            asyncio.create_task(self.coordinator.run_queued_actions()),
+        ]
+        await self.wait_for(qlc.is_connected)
+        if onkyo is not None:
+            await self.wait_for(onkyo.is_connected)
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.coordinator.remote.client.close()
+        await self.coordinator.remote.home_assistant.http.close()
+        for server in (self.lircd, self.qlc_server, self.ha_server, self.onkyo_server):
+            if server is not None:
+                await server.stop()
+        self.tmp.cleanup()
+
+    async def wait_for(self, predicate, timeout=60.0):
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            if time.monotonic() > deadline:
+                raise TimeoutError("benchmark step did not complete")
+            await asyncio.sleep(0.0005)
+
+    def idle(self):
+        scheduler = self.coordinator.scheduler
+        return not scheduler.is_busy() and scheduler.next_action()[1] is None
+
+    def press(self, key: str, value=1) -> float:
+        """Feed one key event through the Coordinator; returns its timestamp."""
+        event = key_event(key, value)
+        self.coordinator.handle_keyboard_event(event, DEVICE)
+        # on the monotonic clock, like the stand-ins' logs
+        return time.monotonic() - (time.time() - event.timestamp())
+
+    async def time_until(self, log, key, value, matches) -> float:
+        seen = len(log)
+
+        def arrived():
+            return any(matches(entry[1]) for entry in log[seen:])
+
+        pressed = self.press(key, value)
+        await self.wait_for(arrived)
+        arrival = next(entry[0] for entry in log[seen:] if matches(entry[1]))
+        return arrival - pressed
+
+    # SCENARIOS
+    async def volume_hold(self):
+        steps, releases = [], []
+        for _ in range(self.args.presses):
+            steps.append(
+                await self.time_until(self.lircd.commands, "KEY_UP", 1, is_volume_step)
+            )
+            await asyncio.sleep(self.args.hold)
+            released = self.press("KEY_UP", 0)
+            await self.wait_for(lambda: not self.coordinator.holding)
+            releases.append(time.monotonic() - released)
+            await self.wait_for(self.idle)
+        return {"first_step": summarize(steps), "release": summarize(releases)}
+
+    async def one_shot(self, log, keys, matches):
+        latencies = []
+        for i in range(self.args.presses):
+            key = keys[i % len(keys)]
+            latencies.append(await self.time_until(log, key, 1, matches(key)))
+            await self.wait_for(self.idle)
+            await asyncio.sleep(0.01)
+        return summarize(latencies)
+
+    async def preempt(self):
+        """Volume pressed while a macro is running."""
+        latencies = []
+        for _ in range(max(1, self.args.presses // 10)):
+            self.press("KEY_T")
+            await asyncio.sleep(0.3)
+            latencies.append(
+                await self.time_until(self.lircd.commands, "KEY_UP", 1, is_volume_step)
+            )
+            self.press("KEY_UP", 0)
+            await self.wait_for(self.idle)
+        return summarize(latencies)
+
+    async def macros(self):
+        names = QUICK_MACROS if self.args.quick else MACRO_KEYS
+        results = {}
+        for name in names:
+            sends = len(self.lircd.commands)
+            eiscp = len(self.onkyo_server.messages) if self.onkyo_server else 0
+            pressed = self.press(MACRO_KEYS[name])
+            await asyncio.sleep(0)
+            await self.wait_for(self.idle, timeout=120.0)
+            results[name] = {
+                "wall_seconds": round(time.monotonic() - pressed, 3),
+                "ir_commands": len(self.lircd.commands) - sends,
+            }
+            if self.onkyo_server:
+                results[name]["eiscp_commands"] = (
+                    len(self.onkyo_server.messages) - eiscp
+                )
+        return results
+
+    async def event_rate(self):
+        """Highest paced event rate handled within MAX_EVENT_LAG_SECONDS at p99."""
+        loop = asyncio.get_running_loop()
+        steps = {}
+        sustained = 0
+        for rate in EVENT_RATES:
+            lags = []
+            dropped_before = self.dropped()
+            start_wall, start = time.time(), loop.time()
+            count = int(rate * self.args.rate_seconds)
+            sent = 0
+            while sent < count:
+                due = min(count, int((loop.time() - start) * rate) + 1)
+                while sent < due:
+                    # spotlight presses coalesce, so the queue never backs up
+                    key = "KEY_R" if sent % 2 else "KEY_W"
+                    event = key_event(key, 1, start_wall + sent / rate)
+                    self.coordinator.handle_keyboard_event(event, DEVICE)
+                    lags.append(time.time() - event.timestamp())
+                    sent += 1
+                await asyncio.sleep(0)
+            await self.wait_for(self.idle)
+            p99 = percentile(lags, 0.99)
+            dropped = self.dropped() - dropped_before
+            steps[rate] = {"p99_lag_ms": round(p99 * 1000, 3), "dropped": dropped}
+            if p99 > MAX_EVENT_LAG_SECONDS or dropped:
+                break
+            sustained = rate
+        return {"max_sustained_per_second": sustained, "steps": steps}
+
+    def dropped(self):
+        return sum(
+            stats["dropped"] for stats in self.coordinator.queue_stats().values()
+        )
+
+    async def run(self):
+        results = {"volume_hold": await self.volume_hold()}
+        results["pause"] = await self.one_shot(
+            self.lircd.commands, ["KEY_P"], lambda key: lambda c: "PLAY_PAUSE" in c
+        )
+
+        functions = {name: i for i, name in self.qlc_server.functions.items()}
+        colors = {"KEY_R": "red", "KEY_W": "white"}
+        results["spotlight"] = await self.one_shot(
+            self.qlc_server.messages,
+            list(colors),
+            lambda key: lambda m: m
+            == f"QLC+API|setFunctionStatus|{functions[colors[key]]}|1",
+        )
+        results["home_assistant"] = await self.one_shot(
+            HaLog(self.ha_server),
+            ["KEY_D"],
+            lambda key: lambda path: path.startswith("/api/services/"),
+        )
+        results["preempt_macro"] = await self.preempt()
+        results["macros"] = await self.macros()
+        results["event_rate"] = await self.event_rate()
+        results["loop"] = self.coordinator.loop_monitor.stats()
+        return results
+
+
+class HaLog:
+    """FakeHomeAssistant.calls viewed as (time, path) pairs."""
+
+    def __init__(self, server):
+        self.server = server
+
+    def __len__(self):
+        return len(self.server.calls)
+
+    def __getitem__(self, index):
+        calls = self.server.calls[index]
+        if isinstance(index, slice):
+            return [(t, path) for t, path, _ in calls]
+        return (calls[0], calls[1])
+
+
+def print_results(results, previous=None):
+    def walk(node, old, path=()):
+        for key, value in node.items():
+            old_value = old.get(key) if isinstance(old, dict) else None
+            if isinstance(value, dict):
+                walk(value, old_value, (*path, str(key)))
+            else:
+                line = f"{'.'.join((*path, str(key))):<70} {value}"
+                if isinstance(value, (int, float)) and isinstance(
+                    old_value, (int, float)
+                ):
+                    change = (value - old_value) / old_value * 100 if old_value else 0.0
+                    line += f"  (was {old_value}, {change:+.1f}%)"
+                print(line)
+
+    walk(results, previous or {})
+
+
+def add_backend_arguments(parser):
+    """Latency and failure injection for the stand-in servers."""
+    parser.add_argument("--lircd-delay", type=float, default=0.0)
+    parser.add_argument("--lircd-fail-rate", type=float, default=0.0)
+    parser.add_argument("--qlc-delay", type=float, default=0.0)
+    parser.add_argument("--qlc-fail-rate", type=float, default=0.0)
+    parser.add_argument("--ha-delay", type=float, default=0.0)
+    parser.add_argument("--ha-fail-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--onkyo", action="store_true", help="drive the receiver over eISCP, not IR"
+    )
+    parser.add_argument("--onkyo-delay", type=float, default=0.0)
+    parser.add_argument("--log-level", default="WARNING", help="service log level")
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--presses", type=int, default=50, help="presses per scenario")
+    parser.add_argument(
+        "--hold", type=float, default=0.05, help="seconds per volume hold"
+    )
+    parser.add_argument("--quick", action="store_true", help="skip the long macros")
+    parser.add_argument("--rate-seconds", type=float, default=0.5)
+    add_backend_arguments(parser)
+    parser.add_argument(
+        "--compare", type=Path, help="earlier result file to compare with"
+    )
+    parser.add_argument("--output", type=Path, default=RESULTS_DIR)
+    args = parser.parse_args()
+
+    configure_levels({"root": args.log_level})
+    bench = Bench(args)
+    await bench.start()
+    try:
+        results = await bench.run()
+    finally:
+        await bench.stop()
+
+    commit = git_commit()
+    run = {
+        "commit": commit,
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "args": {
+            k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()
+        },
+        "results": results,
+    }
+    previous = None
+    if args.compare:
+        previous = json.loads(args.compare.read_text(encoding="utf-8"))["results"]
+    print_results(results, previous)
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    path = args.output / f"{datetime.now():%Y%m%d-%H%M%S}-{commit}.json"
+    path.write_text(json.dumps(run, indent=2) + "\n", encoding="utf-8")
+    print(f"saved {path}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
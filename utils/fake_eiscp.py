@@ -0,0 +1,131 @@
+"""
+Stand-in for an Onkyo receiver's eISCP (ISCP over TCP) port, for exercising
+OnkyoSession without the receiver.
+
+    python utils/fake_eiscp.py --port 60128 --delay 0.02
+
+Point the service at it with host = "127.0.0.1" under [onkyo] in
+src/config.local.toml.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from onkyo import (  # noqa: E402
+    NOT_AVAILABLE,
+    QUESTION,
+    VOLUME_COMMANDS,
+    encode_message,
+    level_parameter,
+    level_value,
+    read_message,
+)
+
+# power on, volume 40, TV input, direct, zone 2 off
+DEFAULT_VALUES = {
+    "PWR": "01",
+    "MVL": "28",
+    "AMT": "00",
+    "SLI": "12",
+    "LMD": "01",
+    "ZPW": "00",
+    "ZVL": "20",
+    "SLZ": "12",
+    "SWL": "00",
+    "CTL": "00",
+}
+# receivers end what they send with EOF, CR, LF
+END = "\x1a\r\n"
+
+
+class FakeOnkyo:
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0, values=None, fail_rate=0.0):
+        self.host = host
+        self.port = port
+        # seconds before answering each command
+        self.delay = delay
+        # fraction of commands on which the connection is dropped instead
+        self.fail_rate = fail_rate
+        self.values = dict(values or DEFAULT_VALUES)
+        # (monotonic time, message) for every command received
+        self.messages = []
+        self.server = None
+        self.clients = set()
+
+    async def start(self):
+        self.server = await asyncio.start_server(
+            self.handle_client, self.host, self.port
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        for writer in self.clients:
+            writer.close()
+        await self.server.wait_closed()
+
+    def change(self, command: str, value: str):
+        """A change from the front panel or the IR remote: reported to every client."""
+        self.values[command] = value
+        for writer in self.clients:
+            writer.write(encode_message(command + value, END))
+
+    async def handle_client(self, reader, writer):
+        self.clients.add(writer)
+        try:
+            while True:
+                message = await read_message(reader)
+                self.messages.append((time.monotonic(), message))
+                if random.random() < self.fail_rate:
+                    break
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                self.handle_message(writer, message)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    def handle_message(self, writer, message):
+        command, parameter = message[:3], message[3:]
+        if command not in self.values:
+            writer.write(encode_message(command + NOT_AVAILABLE, END))
+            return
+        if parameter == QUESTION:
+            writer.write(encode_message(command + self.values[command], END))
+            return
+        if parameter in ("UP", "DOWN"):
+            step = 1 if parameter == "UP" else -1
+            level = level_value(self.values[command]) + step
+            parameter = level_parameter(level, command not in VOLUME_COMMANDS)
+        # like the receiver, every client hears about the change
+        self.change(command, parameter)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=60128)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    receiver = await FakeOnkyo(
+        args.host, args.port, args.delay, fail_rate=args.fail_rate
+    ).start()
+    print(f"fake Onkyo receiver listening on {args.host}:{receiver.port}")
+    async with receiver.server:
+        await receiver.server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
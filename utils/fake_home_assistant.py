@@ -0,0 +1,130 @@
+"""
+Stand-in for the Home Assistant REST API, for exercising the HomeAssistant
+client without a real instance.
+
+    python utils/fake_home_assistant.py --port 8123 --delay 0.05
+
+Point the service at it with url = "http://127.0.0.1:8123" under
+[home_assistant] in src/config.local.toml.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+
+class FakeHomeAssistant:
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0, token=None, fail_rate=0.0):
+        self.host = host
+        self.port = port
+        # seconds before answering each request
+        self.delay = delay
+        # if set, requests without this bearer token get a 401
+        self.token = token
+        # statuses to answer the next requests with, instead of 200
+        self.fail_statuses = []
+        # fraction of requests answered with a 503 at random
+        self.fail_rate = fail_rate
+        # (monotonic time, path, json body) for every request
+        self.calls = []
+        # entity_id -> "on" / "off", as switched by the service calls
+        self.states = {}
+        self.connections = 0
+        self.server = None
+        self.clients = set()
+
+    async def start(self):
+        self.server = await asyncio.start_server(
+            self.handle_client, self.host, self.port
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        for writer in self.clients:
+            writer.close()
+        await self.server.wait_closed()
+
+    async def handle_client(self, reader, writer):
+        self.connections += 1
+        self.clients.add(writer)
+        try:
+            while request_line := await reader.readline():
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                self.calls.append((time.monotonic(), path, json.loads(body or b"null")))
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                status, payload = self.respond(method, path, headers, body)
+
+                data = json.dumps(payload).encode("utf-8")
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status} OK\r\n"
+                        "Content-Type: application/json\r\n"
+                        f"Content-Length: {len(data)}\r\n\r\n"
+                    ).encode("latin-1")
+                    + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    def respond(self, method, path, headers, body=b""):
+        if self.token and headers.get("authorization") != f"Bearer {self.token}":
+            return 401, {"message": "Unauthorized"}
+        if self.fail_statuses:
+            return self.fail_statuses.pop(0), {"message": "injected failure"}
+        if random.random() < self.fail_rate:
+            return 503, {"message": "injected failure"}
+        if method == "POST" and path.startswith("/api/services/"):
+            self.switch(path.rsplit("/", 1)[-1], json.loads(body or b"{}"))
+            return 200, []
+        if method == "GET" and path.startswith("/api/states/"):
+            entity_id = path.removeprefix("/api/states/")
+            return 200, {
+                "entity_id": entity_id,
+                "state": self.states.get(entity_id, "off"),
+            }
+        return 404, {"message": "Not found"}
+
+    def switch(self, service, data):
+        entity_id = data.get("entity_id") if isinstance(data, dict) else None
+        if entity_id is None:
+            return
+        state = self.states.get(entity_id, "off")
+        if service == "toggle":
+            self.states[entity_id] = "off" if state == "on" else "on"
+        elif service in ("turn_on", "turn_off"):
+            self.states[entity_id] = service.removeprefix("turn_")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8123)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    ha = await FakeHomeAssistant(
+        args.host, args.port, args.delay, fail_rate=args.fail_rate
+    ).start()
+    print(f"fake Home Assistant listening on http://{args.host}:{ha.port}")
+    async with ha.server:
+        await ha.server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+"""
+Stand-in for lircd on a local Unix socket, for exercising AsyncLircClient
+without an IR emitter.
+
+    python utils/fake_lircd.py /tmp/fake-lircd.sock --delay 0.05
+
+Point the service at it with LIRCD_SOCKET=/tmp/fake-lircd.sock.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+
+class FakeLircd:
+    def __init__(self, path, delay=0.0, fail_keys=(), remotes=None, fail_rate=0.0):
+        self.path = path
+        # seconds to "transmit" each command before replying
+        self.delay = delay
+        # keys that get an ERROR reply
+        self.fail_keys = set(fail_keys)
+        # fraction of send commands that get an ERROR reply at random
+        self.fail_rate = fail_rate
+        self.remotes = remotes or {}
+        # (monotonic time, command) for every command received
+        self.commands = []
+        self.server = None
+        self.clients = set()
+
+    async def start(self):
+        self.server = await asyncio.start_unix_server(self.handle_client, self.path)
+        return self
+
+    async def stop(self):
+        self.server.close()
+        for writer in self.clients:
+            writer.close()
+        await self.server.wait_closed()
+
+    async def handle_client(self, reader, writer):
+        self.clients.add(writer)
+        try:
+            while line := await reader.readline():
+                command = line.decode("utf-8").strip()
+                if not command:
+                    continue
+                self.commands.append((time.monotonic(), command))
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                writer.write(self.reply(command).encode("utf-8"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    def reply(self, command):
+        words = command.split()
+        directive = words[0]
+        data = []
+        success = True
+
+        if directive in ("SEND_ONCE", "SEND_START", "SEND_STOP"):
+            success = len(words) < 3 or words[2] not in self.fail_keys
+            success = success and random.random() >= self.fail_rate
+            if not success:
+                data = [f'unknown command: "{words[2]}"']
+        elif directive == "LIST":
+            data = (
+                list(self.remotes)
+                if len(words) == 1
+                else self.remotes.get(words[1], [])
+            )
+        elif directive == "VERSION":
+            data = ["0.10.1-fake"]
+
+        packet = ["BEGIN", command, "SUCCESS" if success else "ERROR"]
+        if data:
+            packet += ["DATA", str(len(data)), *data]
+        packet.append("END")
+        return "\n".join(packet) + "\n"
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path")
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--fail-key", action="append", default=[])
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    lircd = await FakeLircd(
+        args.path, args.delay, args.fail_key, fail_rate=args.fail_rate
+    ).start()
+    print(f"fake lircd listening on {args.path}")
+    async with lircd.server:
+        await lircd.server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
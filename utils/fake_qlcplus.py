@@ -0,0 +1,160 @@
+"""
+Stand-in for the QLC+ WebSocket API, for exercising QlcSession without the
+lighting server.
+
+    python utils/fake_qlcplus.py --port 9999 --delay 0.02
+
+Point the service at it with host = "127.0.0.1" under [qlcplus] in
+src/config.local.toml.
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from ws_client import (  # noqa: E402
+    HANDSHAKE_GUID,
+    OP_CLOSE,
+    OP_PING,
+    OP_PONG,
+    OP_TEXT,
+    encode_frame,
+    read_frame,
+)
+
+DEFAULT_FUNCTIONS = ["off", "white", "red", "yellow_pretty", "fade", "reactive"]
+
+
+class FakeQlcPlus:
+    def __init__(
+        self, host="127.0.0.1", port=0, delay=0.0, functions=None, fail_rate=0.0
+    ):
+        self.host = host
+        self.port = port
+        # seconds before answering each API call
+        self.delay = delay
+        # fraction of API calls on which the connection is dropped instead
+        self.fail_rate = fail_rate
+        self.functions = dict(enumerate(functions or DEFAULT_FUNCTIONS))
+        self.running: set[int] = set()
+        # (monotonic time, message) for every text message received
+        self.messages = []
+        self.server = None
+        self.clients = set()
+        # when False, pings go unanswered (to exercise keepalive)
+        self.answer_pings = True
+
+    async def start(self):
+        self.server = await asyncio.start_server(
+            self.handle_client, self.host, self.port
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        for writer in self.clients:
+            writer.close()
+        await self.server.wait_closed()
+
+    def running_names(self):
+        return {self.functions[function_id] for function_id in self.running}
+
+    async def handshake(self, reader, writer):
+        head = await reader.readuntil(b"\r\n\r\n")
+        key = ""
+        for line in head.decode("latin-1").split("\r\n"):
+            name, _, value = line.partition(":")
+            if name.strip().lower() == "sec-websocket-key":
+                key = value.strip()
+        accept = base64.b64encode(
+            hashlib.sha1((key + HANDSHAKE_GUID).encode("ascii")).digest()
+        ).decode("ascii")
+        writer.write(
+            (
+                "HTTP/1.1 101 Switching Protocols\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+            ).encode("ascii")
+        )
+        await writer.drain()
+
+    async def handle_client(self, reader, writer):
+        self.clients.add(writer)
+        try:
+            await self.handshake(reader, writer)
+            while True:
+                _, opcode, payload = await read_frame(reader)
+                if opcode == OP_PING:
+                    if self.answer_pings:
+                        writer.write(encode_frame(OP_PONG, payload, masked=False))
+                elif opcode == OP_CLOSE:
+                    writer.write(encode_frame(OP_CLOSE, b"", masked=False))
+                    break
+                elif opcode == OP_TEXT:
+                    message = payload.decode("utf-8")
+                    self.messages.append((time.monotonic(), message))
+                    if random.random() < self.fail_rate:
+                        break
+                    reply = await self.handle_message(message)
+                    if reply is not None:
+                        writer.write(
+                            encode_frame(OP_TEXT, reply.encode("utf-8"), masked=False)
+                        )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    async def handle_message(self, message):
+        fields = message.split("|")
+        if fields[0] != "QLC+API" or len(fields) < 2:
+            return None
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+        api = fields[1]
+        if api == "getFunctionsList":
+            listing = [str(part) for item in self.functions.items() for part in item]
+            return "|".join(["QLC+API", api, *listing])
+        if api == "setFunctionStatus":
+            function_id, status = int(fields[2]), fields[3]
+            if status == "1":
+                self.running.add(function_id)
+            else:
+                self.running.discard(function_id)
+            return None
+        if api == "getFunctionStatus":
+            status = "Running" if int(fields[2]) in self.running else "Stopped"
+            return f"QLC+API|{api}|{status}"
+        return None
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    qlc = await FakeQlcPlus(
+        args.host, args.port, args.delay, fail_rate=args.fail_rate
+    ).start()
+    print(f"fake QLC+ listening on ws://{args.host}:{qlc.port}/qlcplusWS")
+    async with qlc.server:
+        await qlc.server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
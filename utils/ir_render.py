@@ -0,0 +1,107 @@
+"""
+Prints the pulse/space buffers the direct IR backend (src/ir_tx.py) renders
+from remotes/*.lircd.conf, in mode2's "pulse N" / "space N" format, so they can
+be compared with what lircd sends for the same button:
+
+    python utils/ir_render.py onkyo KEY_VOLUMEUP
+    python utils/ir_render.py onkyo KEY_VOLUMEUP --repeat 2 --compare simsend.out
+
+--compare checks against an irsimsend output file (irsimsend renders buttons
+with lircd's own transmit code, no hardware needed), allowing `eps` percent /
+`aeps` microseconds like lircd does. --decode prints a file written by the
+direct backend (device = "/some/file" under [ir] in config.toml) instead;
+written to a file, each frame is followed by its gap as a space.
+"""
+
+import argparse
+import os
+import re
+import sys
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from ir_tx import join_frames, render_remotes  # noqa: E402
+from lircd_conf import load_remote_timings  # noqa: E402
+
+
+def mode2_lines(durations):
+    return [
+        f"{'pulse' if i % 2 == 0 else 'space'} {us}" for i, us in enumerate(durations)
+    ]
+
+
+def read_mode2(path) -> list[int]:
+    """Durations from mode2/irsimsend output, merging runs like the renderer does."""
+    durations = []
+    for line in open(path, encoding="utf-8"):
+        match = re.match(r"\s*(pulse|space)\s+(\d+)", line)
+        if not match:
+            continue
+        pulse = match[1] == "pulse"
+        if durations and (len(durations) % 2 == 1) == pulse:
+            durations[-1] += int(match[2])
+        elif durations or pulse:
+            durations.append(int(match[2]))
+    return durations
+
+
+def matches(ours: int, theirs: int, eps: int, aeps: int) -> bool:
+    return abs(ours - theirs) <= max(aeps, theirs * eps / 100)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("remote", nargs="?")
+    parser.add_argument("button", nargs="?")
+    parser.add_argument(
+        "--repeat", type=int, default=0, help="repeat count, as for SEND_ONCE"
+    )
+    parser.add_argument("--compare", help="irsimsend / mode2 output to check against")
+    parser.add_argument("--decode", help="file written by the direct backend")
+    args = parser.parse_args()
+
+    if args.decode:
+        with open(args.decode, "rb") as f:
+            print("\n".join(mode2_lines(array("I", f.read()))))
+        return
+
+    remotes = render_remotes(load_remote_timings().remotes)
+    if args.remote not in remotes or args.button not in remotes[args.remote].presses:
+        for name, remote in remotes.items():
+            print(f"{name}: {' '.join(remote.presses)}")
+        sys.exit(0 if args.remote is None else 1)
+
+    remote = remotes[args.remote]
+    frame = join_frames(remote.send_once(args.button, args.repeat))
+    durations = frame.durations.tolist()
+    if not args.compare:
+        print("\n".join(mode2_lines(durations)))
+        print(f"# then {frame.gap} us of gap, {remote.carrier} Hz carrier")
+        return
+
+    theirs = read_mode2(args.compare)
+    eps = remote.remote.value("eps") or 30
+    aeps = remote.remote.value("aeps") or 100
+    # irsimsend may end on the gap's space; ours leaves it for the next write
+    if len(theirs) == len(durations) + 1:
+        theirs = theirs[:-1]
+    if len(theirs) != len(durations):
+        rendered, found = len(durations), len(theirs)
+        print(f"length differs: {rendered} rendered, {found} in {args.compare}")
+        sys.exit(1)
+    bad = [
+        i
+        for i, (ours, other) in enumerate(zip(durations, theirs))
+        if not matches(ours, other, eps, aeps)
+    ]
+    for i in bad:
+        print(f"#{i}: rendered {durations[i]}, {args.compare} has {theirs[i]}")
+    print(f"{len(durations) - len(bad)}/{len(durations)} durations match")
+    sys.exit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Connects to QLC+ the way the service does and lists its functions, to check
+the [qlcplus] settings and that QLC+ is running with its WebSocket (-w) on.
+
+    python utils/qlc_check.py
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import ws_client  # noqa: E402
+from config import config  # noqa: E402
+from qlc import QlcSession  # noqa: E402
+
+
+async def main():
+    qlc_config = config["qlcplus"]
+    qlc = QlcSession(
+        qlc_config["host"],
+        qlc_config["port"],
+        qlc_config["path"],
+        qlc_config["modes"],
+        timeout=qlc_config["timeout"],
+    )
+    qlc.websocket = await ws_client.connect(qlc.host, qlc.port, qlc.path, qlc.timeout)
+    print(f"connected to QLC+ at {qlc.host}:{qlc.port}")
+    reader = asyncio.create_task(qlc.read_messages())
+    try:
+        await qlc.load_functions()
+    finally:
+        reader.cancel()
+        await qlc.disconnect()
+    for name, function_id in sorted(qlc.functions.items(), key=lambda item: item[1]):
+        print(f"{function_id:4}  {name}")
+    missing = [mode for mode in qlc.modes if qlc.function_id(mode) is None]
+    if missing:
+        print(f"modes with no QLC+ function: {', '.join(missing)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
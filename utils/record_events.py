@@ -0,0 +1,72 @@
+"""
+Records key events from the devices named in src/keymap.toml into a compact
+binary log (see src/event_log.py), for replaying with utils/replay_events.py.
+
+    python utils/record_events.py /tmp/mashing-volume.vcev
+
+Devices are picked up as they are plugged in, like the service does. Reading
+doesn't grab the devices, so the running service keeps working meanwhile
+(unless the service grabs them: set grab = false under [input] first). Every
+key is recorded, bound or not. Stop with Ctrl-C.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tomllib
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from devices import DeviceSupervisor  # noqa: E402
+from event_log import EventLogWriter  # noqa: E402
+from keymap import KEYMAP_FILE, compile_keymap  # noqa: E402
+
+
+class Recorder:
+    """Stands in for the Coordinator as far as DeviceSupervisor is concerned."""
+
+    def __init__(self, keymap, writer: EventLogWriter):
+        self.keymap = keymap
+        self.writer = writer
+        self.keymap_listeners = []
+
+    def handle_keyboard_event(self, event, device):
+        self.writer.write(device, event)
+        # flush per event: a recording is usually ended with Ctrl-C
+        self.writer.flush()
+        print(f"{device}: code {event.code} value {event.value}", file=sys.stderr)
+
+    def device_detached(self, device):
+        pass
+
+
+async def record(output: Path, keymap_file: Path):
+    with open(keymap_file, "rb") as f:
+        raw = tomllib.load(f)
+    # only the devices matter here
+    keymap = compile_keymap({"devices": raw.get("devices", {})}, ())
+    with open(output, "wb") as f:
+        writer = EventLogWriter(f)
+        try:
+            await DeviceSupervisor(Recorder(keymap, writer), filter_events=False).run()
+        finally:
+            print(f"recorded {writer.count} events to {output}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("output", type=Path)
+    parser.add_argument("--keymap", type=Path, default=KEYMAP_FILE)
+    args = parser.parse_args()
+    try:
+        asyncio.run(record(args.output, args.keymap))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
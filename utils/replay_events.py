@@ -0,0 +1,83 @@
+"""
+Replays a key event log from utils/record_events.py through the real
+Coordinator, scheduler and Remote, talking to the stand-in lircd, QLC+ and
+Home Assistant servers (as in utils/benchmark.py).
+
+    python utils/replay_events.py /tmp/mashing-volume.vcev            # real speed
+    python utils/replay_events.py /tmp/mashing-volume.vcev --speed 10 # 10x
+    python utils/replay_events.py /tmp/mashing-volume.vcev --fast --repeat 100
+
+Prints what the queues and backends saw once everything has drained.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from benchmark import Bench, add_backend_arguments  # noqa: E402
+from event_log import read_event_log, replay  # noqa: E402
+from keymap import KEYMAP_FILE  # noqa: E402
+from logger import configure_levels  # noqa: E402
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("log", type=Path)
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="time compression factor"
+    )
+    parser.add_argument(
+        "--fast", action="store_true", help="replay as fast as possible"
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="replay the log N times")
+    parser.add_argument("--keymap", type=Path, default=KEYMAP_FILE)
+    add_backend_arguments(parser)
+    args = parser.parse_args()
+
+    with open(args.log, "rb") as f:
+        events = list(read_event_log(f))
+    if not events:
+        print(f"{args.log} has no events")
+        return
+
+    configure_levels({"root": args.log_level})
+    bench = Bench(args, args.keymap)
+    await bench.start()
+    try:
+        speed = 0.0 if args.fast else args.speed
+        started = time.monotonic()
+        replayed = 0
+        for _ in range(args.repeat):
+            replayed += await replay(
+                events, bench.coordinator.handle_keyboard_event, speed
+            )
+        fed = time.monotonic() - started
+        await bench.wait_for(bench.idle, timeout=600.0)
+        drained = time.monotonic() - started
+    finally:
+        await bench.stop()
+
+    print(
+        f"replayed {replayed} events in {fed:.3f}s ({replayed / max(fed, 1e-9):.0f}/s)"
+    )
+    print(f"queues drained after {drained:.3f}s")
+    for queue, stats in bench.coordinator.queue_stats().items():
+        print(
+            f"  {queue}: enqueued {stats['enqueued']}, coalesced {stats['coalesced']},"
+            f" dropped {stats['dropped']}, max depth {stats['max_depth']},"
+            f" max wait {stats['max_wait'] * 1000:.1f} ms"
+        )
+    print(f"lircd commands: {len(bench.lircd.commands)}")
+    print(f"QLC+ messages: {len(bench.qlc_server.messages)}")
+    print(f"Home Assistant calls: {len(bench.ha_server.calls)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())